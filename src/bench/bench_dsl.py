@@ -0,0 +1,101 @@
+#!/usr/local/bin/python
+# coding: utf8
+'''
+Measures the cost of the OFXNode DSL traversal done by 
+edofx2csv.build_Statement_tree on an already parsed file.
+
+usage: bench_dsl.py [-n loops] [-s src_dir] [ofx_file]
+
+Default ofx_file is test/fixtures/multi_account_file.ofx
+
+The 'eager trace' stage reproduces the DSL logging of edofx before
+OFXNode.trace: each access builds the node chain recursively and formats
+its INFO message, even with INFO disabled.
+To time another revision, point -s at the src directory of a checkout
+of it (e.g. made with git worktree); without OFXNode.trace, its 'trace'
+rows time its own logging and the 'eager trace' row adds to it.
+'''
+import logging
+import os
+import sys
+import timeit
+
+from optparse import OptionParser
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+# DSL accessors and INFO messages of edofx before OFXNode.trace
+EAGER_TRACES = (('__getattr__', '%s.__getattr__(%s)'),
+                ('__iter__', '%s.__iter__'),
+                ('__getitem__', '%s.__getitem__(%i)'),
+                ('__len__', '%s.__len__()'))
+
+
+def eager_nodes_chain(node):
+    if node.parent is None:
+        return node.name
+    return eager_nodes_chain(node.parent)+'.'+node.name
+
+
+def eager_trace(method, message):
+    def traced(self, *args):
+        self.logger.info(message % ((eager_nodes_chain(self),)+args))
+        return method(self, *args)
+    return traced
+
+
+def run(OFX, loops):
+    '''
+    returns best time of 3 runs for one build_Statement_tree call
+    '''
+    return min(timeit.repeat(lambda: build_Statement_tree(OFX), number=loops, repeat=3)) / loops
+
+
+def run_eager(OFXNode, OFX, loops):
+    '''
+    run() with the eager DSL logging of edofx before OFXNode.trace
+    '''
+    methods = [ (name, OFXNode.__dict__[name]) for name, message in EAGER_TRACES ]
+    try:
+        for name, message in EAGER_TRACES:
+            setattr(OFXNode, name, eager_trace(OFXNode.__dict__[name], message))
+        return run(OFX, loops)
+    finally:
+        for name, method in methods:
+            setattr(OFXNode, name, method)
+
+
+def main(source_file, loops):
+    parser = OFXParser.from_file(source_file)
+    OFX = parser.parse()
+    parser.close()
+    transactions = len(OFX.find_children_by_name('STMTTRN'))
+
+    logging.getLogger('OFXNode').setLevel(logging.WARNING)
+    print "%-40s %10s %16s" % ('build_Statement_tree', 'ms/call', 'transactions/s')
+    OFXNode.trace = False
+    t = run_eager(OFXNode, OFX, loops)
+    print "%-40s %10.3f %16.0f" % ('eager trace, INFO disabled', t*1000, transactions/t)
+    for label, trace in (('trace off', False), ('trace on, INFO disabled', True)):
+        OFXNode.trace = trace
+        t = run(OFX, loops)
+        print "%-40s %10.3f %16.0f" % (label, t*1000, transactions/t)
+    OFXNode.trace = False
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [-n loops] [-s src_dir] [ofx_file]"
+    parser = OptionParser(usage)
+    parser.add_option("-n", "--loops", type="int", dest="loops", default=20,
+                      help="number of build_Statement_tree calls per run")
+    parser.add_option("-s", "--src", dest="src_dir", default=SRC_DIR,
+                      help="directory of the edofx modules to time [default: this checkout]")
+    (options, args) = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(options.src_dir))
+    from edofx import OFXParser, OFXNode
+    from edofx2csv import build_Statement_tree
+
+    source_file = args[0] if args else os.path.join(SRC_DIR, 'test', 'fixtures', 'multi_account_file.ofx')
+    sys.exit(main(source_file, options.loops))
@@ -0,0 +1,269 @@
+#!/usr/local/bin/python
+# coding: utf8
+'''
+Measures throughput and peak memory of edofx stages on a synthetic (or
+supplied) OFX file and compares them with a stored baseline.
+
+usage: bench_suite.py [options]
+
+Each stage runs in its own Python process so that its peak memory
+(ru_maxrss) is not inflated by previous stages. Results are written as JSON:
+
+    {
+        "meta"    : { "edofx" : ..., "python" : ..., "file_size" : ..., ... },
+        "results" : { stage : { "seconds" : best time, "mb_per_s" : ...,
+                                "nodes_per_s" : ..., "peak_rss_kb" : ...,
+                                "setup_rss_kb" : ... }, ... }
+    }
+
+setup_rss_kb is the peak memory before the timed runs (interpreter, source
+and the tree for stages working on a parsed tree). With -b, results are
+compared with the baseline results and the exit status is 1 if a stage is
+slower than the baseline by more than the threshold. Throughputs (MB/s) are
+compared, baseline should be measured on a file of the same kind and size.
+
+    ./bench_suite.py -t 20000 -o results.json
+    ./bench_suite.py -t 20000 -b results.json
+'''
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, SRC_DIR)
+
+import edofx
+from edofx import OFXParser, OFXLazyParser, OFXXMLParser, OFXObfuscator, OFXPseudonymizer
+from edofx2csv import build_Statement_tree
+
+import synthetic
+
+
+def _read(path):
+    f = open(path, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def _tree(source):
+    return OFXParser(source).parse()
+
+def _xml_source(source):
+    return _tree(source).xml_repr()
+
+def _traverse(OFX):
+    '''
+    DSL accesses done by a typical report
+    '''
+    total = 0.0
+    for msgset, trnrs, stmtrs in (('BANKMSGSRSV1', 'STMTTRNRS', 'STMTRS'), ('CREDITCARDMSGSRSV1', 'CCSTMTTRNRS', 'CCSTMTRS')):
+        try:
+            statements = getattr(getattr(OFX, msgset), trnrs)
+        except AttributeError:
+            continue
+        for s in statements:
+            for t in getattr(s, stmtrs).BANKTRANLIST.STMTTRN:
+                total += t.TRNAMT.val
+                t.DTPOSTED.val
+                t.NAME.value
+    return total
+
+def _lazy_accounts(source):
+    '''
+    Status and account ids, the other aggregates of a lazy tree are not built
+    '''
+    OFX = OFXLazyParser(source).parse()
+    OFX.SIGNONMSGSRSV1.SONRS.STATUS.CODE.value
+    return [ s.STMTRS.BANKACCTFROM.ACCTID.value for s in OFX.BANKMSGSRSV1.STMTTRNRS ]
+
+def _statements_csv(OFX):
+    for stmt in build_Statement_tree(OFX):
+        stmt.export_as_csv()
+
+
+# stage : ( setup(path) returning the argument of run, run(argument) )
+STAGES = [
+    ('parse',               _read,          lambda source: OFXParser(source).parse()),
+    ('parse_char',          _read,          lambda source: OFXParser(source, tokenizer=OFXParser.TOKENIZER_CHAR).parse()),
+    ('parse_lazy',          _read,          _lazy_accounts),
+    ('parse_xml',           lambda path: _xml_source(_read(path)),
+                                            lambda source: OFXXMLParser(source).parse()),
+    ('dsl',                 lambda path: _tree(_read(path)),  _traverse),
+    ('select',              lambda path: _tree(_read(path)),
+                                            lambda OFX: list(OFX.select('OFX/*MSGSRSV1/*STMTTRNRS/*/BANKTRANLIST/STMTTRN[TRNAMT<0]'))),
+    ('ofx_repr',            lambda path: _tree(_read(path)),  lambda OFX: OFX.ofx_repr()),
+    ('xml_repr',            lambda path: _tree(_read(path)),  lambda OFX: OFX.xml_repr()),
+    ('obfuscator',          _read,          lambda source: OFXObfuscator(source).obfuscate()),
+    ('obfuscated_ofx_repr', lambda path: _tree(_read(path)),
+                                            lambda OFX: OFX.obfuscated_ofx_repr(pseudonymizer=OFXPseudonymizer('bench'))),
+    ('statements_csv',      lambda path: _tree(_read(path)),  _statements_csv),
+]
+STAGE_NAMES = [ s[0] for s in STAGES ]
+
+
+def peak_rss_kb():
+    '''
+    returns peak resident memory of current process in KB
+    '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # bytes on Mac OS X
+        rss //= 1024
+    return rss
+
+
+def run_stage(stage, path, repeat):
+    '''
+    Runs stage on the file at path in current process, returns its results
+    '''
+    setup, run = dict( (s[0], s[1:]) for s in STAGES )[stage]
+    source = _read(path)
+    size = len(source)
+    nodes = source.count('<') - source.count('</')
+    del source
+
+    argument = setup(path)
+    setup_rss = peak_rss_kb()
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        run(argument)
+        times.append(time.time() - start)
+    best = max(min(times), 1e-9)
+    return {
+        'seconds'      : best,
+        'mean_seconds' : sum(times) / len(times),
+        'repeat'       : repeat,
+        'mb_per_s'     : size / 1048576.0 / best,
+        'nodes_per_s'  : nodes / best,
+        'peak_rss_kb'  : peak_rss_kb(),
+        'setup_rss_kb' : setup_rss,
+    }
+
+
+def run_stage_in_subprocess(stage, path, repeat):
+    '''
+    Runs stage in a new Python process and returns its results
+    '''
+    process = subprocess.Popen([ sys.executable, os.path.abspath(__file__), '--worker', stage, '-r', str(repeat), '-f', path ],
+                               stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode <> 0:
+        raise RuntimeError, "stage %s failed (exit status %d)" % (stage, process.returncode)
+    return json.loads(output)
+
+
+def compare(results, baseline, threshold):
+    '''
+    Prints throughput of results against baseline, returns names of slower stages
+    '''
+    regressions = []
+    print
+    print "%-22s %12s %12s %8s" % ('stage', 'baseline MB/s', 'current MB/s', 'ratio')
+    for stage in STAGE_NAMES:
+        if stage not in results or stage not in baseline:
+            continue
+        ratio = results[stage]['mb_per_s'] / baseline[stage]['mb_per_s']
+        flag = ''
+        if ratio < 1 / (1 + threshold):
+            flag = '  SLOWER'
+            regressions.append(stage)
+        print "%-22s %12.2f %12.2f %8.2f%s" % (stage, baseline[stage]['mb_per_s'], results[stage]['mb_per_s'], ratio, flag)
+    return regressions
+
+
+def main(options):
+    work_dir = None
+    path = options.source_file
+    if path is None:
+        work_dir = tempfile.mkdtemp(prefix='edofx_bench')
+        path = os.path.join(work_dir, 'synthetic.ofx')
+        synthetic.generate(path, newline=options.newline, accounts=options.accounts,
+                           credit_cards=options.credit_cards, transactions=options.transactions,
+                           headers=options.headers)
+    try:
+        meta = {
+            'edofx'        : edofx.__version__,
+            'python'       : platform.python_version(),
+            'platform'     : platform.platform(),
+            'date'         : time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'file'         : options.source_file or 'synthetic',
+            'file_size'    : os.path.getsize(path),
+            'accounts'     : options.accounts,
+            'credit_cards' : options.credit_cards,
+            'transactions' : options.transactions,
+            'crlf'         : options.newline == '\r\n',
+            'headers'      : options.headers,
+        }
+        print "%s, %.1f MB" % (meta['file'], meta['file_size'] / 1048576.0)
+        print "%-22s %10s %10s %12s %12s" % ('stage', 'seconds', 'MB/s', 'nodes/s', 'peak MB')
+        results = {}
+        for stage in options.stages:
+            r = results[stage] = run_stage_in_subprocess(stage, path, options.repeat)
+            print "%-22s %10.4f %10.2f %12.0f %12.1f" % (stage, r['seconds'], r['mb_per_s'], r['nodes_per_s'], r['peak_rss_kb'] / 1024.0)
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir)
+
+    if options.output_file:
+        f = open(options.output_file, 'w')
+        json.dump({ 'meta' : meta, 'results' : results }, f, indent=2, sort_keys=True)
+        f.close()
+
+    if options.baseline_file:
+        baseline = json.load(open(options.baseline_file))
+        if baseline['meta'].get('file_size') <> meta['file_size']:
+            print
+            print "warning: baseline was measured on a %d bytes file" % baseline['meta'].get('file_size', 0)
+        if compare(results, baseline['results'], options.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options]"
+    parser = OptionParser(usage)
+    parser.add_option("-f", "--file", dest="source_file", metavar="OFX_FILE",
+                      help="benchmark OFX_FILE instead of a synthetic file")
+    parser.add_option("-a", "--accounts", type="int", dest="accounts", default=4,
+                      help="number of bank accounts of synthetic file [default: %default]")
+    parser.add_option("-c", "--credit-cards", type="int", dest="credit_cards", default=1,
+                      help="number of credit card accounts of synthetic file [default: %default]")
+    parser.add_option("-t", "--transactions", type="int", dest="transactions", default=5000,
+                      help="number of transactions per account of synthetic file [default: %default]")
+    parser.add_option("--crlf", action="store_const", const='\r\n', dest="newline", default='\n',
+                      help="use CRLF end of lines in synthetic file")
+    parser.add_option("--no-headers", action="store_false", dest="headers", default=True,
+                      help="no OFX headers in synthetic file")
+    parser.add_option("-s", "--stages", dest="stages", default=','.join(STAGE_NAMES),
+                      help="comma separated stages [default: %default]")
+    parser.add_option("-r", "--repeat", type="int", dest="repeat", default=3,
+                      help="runs per stage, best time is kept [default: %default]")
+    parser.add_option("-o", "--output", dest="output_file", metavar="JSON_FILE",
+                      help="write results to JSON_FILE")
+    parser.add_option("-b", "--baseline", dest="baseline_file", metavar="JSON_FILE",
+                      help="compare results with JSON_FILE written by -o")
+    parser.add_option("--threshold", type="float", dest="threshold", default=0.10,
+                      help="slowdown ratio reported as a regression [default: %default]")
+    parser.add_option("--worker", dest="worker", metavar="STAGE",
+                      help="(internal) run STAGE on OFX_FILE and print its results")
+    (options, args) = parser.parse_args()
+
+    if options.worker:
+        json.dump(run_stage(options.worker, options.source_file, options.repeat), sys.stdout)
+        sys.exit(0)
+
+    options.stages = [ s.strip() for s in options.stages.split(',') if s.strip() ]
+    unknown = [ s for s in options.stages if s not in STAGE_NAMES ]
+    if unknown:
+        parser.error("unknown stages %s, use %s" % (', '.join(unknown), ', '.join(STAGE_NAMES)))
+    sys.exit(main(options))
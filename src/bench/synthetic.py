@@ -0,0 +1,149 @@
+#!/usr/local/bin/python
+# coding: utf8
+'''
+Generates synthetic OFX 1.x files of any size for benchmarks.
+
+usage: synthetic.py [options] output_file
+
+Files hold bank accounts (STMTTRNRS) and credit cards (CCSTMTTRNRS), each
+with the same number of transactions. Content is random but reproducible
+(seed option).
+'''
+import random
+import sys
+
+from datetime import date, timedelta
+from optparse import OptionParser
+
+HEADERS = ( ('OFXHEADER', '100'), ('DATA', 'OFXSGML'), ('VERSION', '102'), ('SECURITY', 'NONE'),
+            ('ENCODING', 'USASCII'), ('CHARSET', '1252'), ('COMPRESSION', 'NONE'),
+            ('OLDFILEUID', 'NONE'), ('NEWFILEUID', 'NONE') )
+
+WORDS = ( 'PAIEMENT', 'PAR', 'CARTE', 'VIREMENT', 'PRELEVEMENT', 'CHEQUE', 'REMISE', 'RETRAIT',
+          'DAB', 'EDF', 'SNCF', 'BOULANGERIE', 'LIBRAIRIE', 'LOYER', 'SALAIRE', 'ASSURANCE',
+          'PARIS', 'LYON', 'MARSEILLE', 'FRAIS', 'COTISATION', 'REMBOURSEMENT', 'PRET' )
+
+TRNTYPES = ( 'DEBIT', 'CREDIT', 'CHECK', 'PAYMENT', 'XFER', 'OTHER' )
+
+
+def iter_lines(accounts=4, credit_cards=1, transactions=1000, headers=True, seed=0):
+    '''
+    Yields the lines of a synthetic OFX file (without end of line)
+    '''
+    rnd = random.Random(seed)
+    end_date = date(2010, 3, 6)
+    start_date = end_date - timedelta(days=max(1, transactions // 5))
+
+    if headers:
+        for header in HEADERS:
+            yield '%s:%s' % header
+
+    yield '<OFX>'
+    yield '<SIGNONMSGSRSV1>'
+    yield '<SONRS>'
+    yield '<STATUS>'
+    yield '<CODE>0'
+    yield '<SEVERITY>INFO'
+    yield '</STATUS>'
+    yield '<DTSERVER>%s094649' % end_date.strftime('%Y%m%d')
+    yield '<LANGUAGE>FRA'
+    yield '</SONRS>'
+    yield '</SIGNONMSGSRSV1>'
+
+    for msgset, count, trnrs, stmtrs, acctfrom in (
+            ('BANKMSGSRSV1', accounts, 'STMTTRNRS', 'STMTRS', 'BANKACCTFROM'),
+            ('CREDITCARDMSGSRSV1', credit_cards, 'CCSTMTTRNRS', 'CCSTMTRS', 'CCACCTFROM') ):
+        if not count:
+            continue
+        yield '<%s>' % msgset
+        for i in range(count):
+            yield '<%s>' % trnrs
+            yield '<TRNUID>%011d' % rnd.randint(0, 10**11-1)
+            yield '<STATUS>'
+            yield '<CODE>0'
+            yield '<SEVERITY>INFO'
+            yield '</STATUS>'
+            yield '<%s>' % stmtrs
+            yield '<CURDEF>EUR'
+            yield '<%s>' % acctfrom
+            if acctfrom == 'BANKACCTFROM':
+                yield '<BANKID>%05d' % rnd.randint(0, 99999)
+                yield '<BRANCHID>%05d' % rnd.randint(0, 99999)
+                yield '<ACCTID>%011d' % rnd.randint(0, 10**11-1)
+                yield '<ACCTTYPE>CHECKING'
+            else:
+                yield '<ACCTID>%016d' % rnd.randint(0, 10**16-1)
+            yield '</%s>' % acctfrom
+            yield '<BANKTRANLIST>'
+            yield '<DTSTART>%s000000' % start_date.strftime('%Y%m%d')
+            yield '<DTEND>%s235959' % end_date.strftime('%Y%m%d')
+            balance = 0
+            for t in range(transactions):
+                amount = rnd.randint(-100000, 60000)
+                balance += amount
+                posted = end_date - timedelta(days=t * (end_date - start_date).days // transactions)
+                yield '<STMTTRN>'
+                yield '<TRNTYPE>%s' % rnd.choice(TRNTYPES)
+                yield '<DTPOSTED>%s' % posted.strftime('%Y%m%d')
+                yield '<TRNAMT>%s%d.%02d' % ('-' if amount < 0 else '', abs(amount) // 100, abs(amount) % 100)
+                yield '<FITID>%013d' % rnd.randint(0, 10**13-1)
+                yield '<NAME>%s' % ' '.join(rnd.choice(WORDS) for w in range(rnd.randint(1, 4)))
+                yield '<MEMO>%s' % ' '.join(rnd.choice(WORDS) for w in range(rnd.randint(1, 3)))
+                yield '</STMTTRN>'
+            yield '</BANKTRANLIST>'
+            yield '<LEDGERBAL>'
+            yield '<BALAMT>%s%d.%02d' % ('-' if balance < 0 else '', abs(balance) // 100, abs(balance) % 100)
+            yield '<DTASOF>%s' % end_date.strftime('%Y%m%d')
+            yield '</LEDGERBAL>'
+            yield '</%s>' % stmtrs
+            yield '</%s>' % trnrs
+        yield '</%s>' % msgset
+    yield '</OFX>'
+
+
+def write_ofx(fp, newline='\n', **kwargs):
+    '''
+    Writes a synthetic OFX file to fp, kwargs are passed to iter_lines()
+    '''
+    batch = []
+    for line in iter_lines(**kwargs):
+        batch.append(line)
+        if len(batch) == 4096:
+            fp.write(newline.join(batch) + newline)
+            del batch[:]
+    if batch:
+        fp.write(newline.join(batch) + newline)
+
+
+def generate(path, **kwargs):
+    '''
+    Writes a synthetic OFX file at path, kwargs are passed to write_ofx()
+    '''
+    f = open(path, 'wb')
+    try:
+        write_ofx(f, **kwargs)
+    finally:
+        f.close()
+
+
+if __name__ == '__main__':
+    usage = "usage: %prog [options] output_file"
+    parser = OptionParser(usage)
+    parser.add_option("-a", "--accounts", type="int", dest="accounts", default=4,
+                      help="number of bank accounts [default: %default]")
+    parser.add_option("-c", "--credit-cards", type="int", dest="credit_cards", default=1,
+                      help="number of credit card accounts [default: %default]")
+    parser.add_option("-t", "--transactions", type="int", dest="transactions", default=1000,
+                      help="number of transactions per account [default: %default]")
+    parser.add_option("--crlf", action="store_const", const='\r\n', dest="newline", default='\n',
+                      help="use CRLF end of lines")
+    parser.add_option("--no-headers", action="store_false", dest="headers", default=True,
+                      help="don't write OFX headers")
+    parser.add_option("-s", "--seed", type="int", dest="seed", default=0,
+                      help="random seed [default: %default]")
+    (options, args) = parser.parse_args()
+    if len(args) <> 1:
+        parser.error("output_file is required")
+
+    generate(args[0], newline=options.newline, accounts=options.accounts, credit_cards=options.credit_cards,
+             transactions=options.transactions, headers=options.headers, seed=options.seed)
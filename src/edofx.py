@@ -27,11 +27,23 @@ Created on 28 févr. 2010
 @author: Cyril MORISSE - cmorisse@boxes3.net
 
 '''
+import codecs
+import hashlib
+import hmac
 import logging
+import mmap
+import operator
 import os
-import random
-
-from datetime import date
+import re
+import string
+import time
+
+from collections import deque
+from fnmatch import translate
+from itertools import islice
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+from datetime import date, datetime, timedelta, tzinfo
 #
 # ofx
 #    statement_list[]
@@ -50,10 +62,299 @@ from datetime import date
 #
 
 __version__ = "edofx v0.3 - novembre 2012"
+
+# version of the trees and headers given by the parsers, bump it with any
+# change of parsing results so that edofx_cache does not reuse older trees
+PARSER_VERSION = 2
+
+
+class OFXTimeZone(tzinfo):
+    '''
+    Fixed offset time zone of OFX datetimes ( [+1:CET], [-5:EST], [-3.5] ... )
+    '''
+    def __init__(self, offset_hours, name=None):
+        self.__offset = timedelta(hours=offset_hours)
+        self.__name = name or 'GMT%+g' % offset_hours
+
+    def utcoffset(self, dt):
+        return self.__offset
+
+    def dst(self, dt):
+        return timedelta(0)
+
+    def tzname(self, dt):
+        return self.__name
+
+    def __repr__(self):
+        return 'OFXTimeZone(%r)' % self.__name
+
+
+# YYYYMMDD[HHMM[SS[.XXX]]][ [gmt offset[:tz name]] ]
+OFX_DATETIME_RE = re.compile(r'\s*(\d{4})(\d\d)(\d\d)(?:(\d\d)(\d\d)(?:(\d\d)(?:[.,](\d{1,6}))?)?)?'
+                             r'\s*(?:\[\s*([+-]?\d+(?:[.,]\d+)?)\s*(?::\s*([^\]]*?)\s*)?\])?')
+
+_timezones = {}
+
+def parse_ofx_datetime(value):
+    '''
+    Returns a datetime from an OFX datetime string.
+    
+    When value contains a GMT offset, datetime is aware and its tzinfo is an
+    OFXTimeZone, else it is naive. Raises ValueError if value is not a datetime.
+    '''
+    m = OFX_DATETIME_RE.match(value)
+    if m is None:
+        raise ValueError, "'%s' is not an OFX datetime" % value
+    year, month, day, hour, minute, second, fraction, offset, tz_name = m.groups()
+    tz = None
+    if offset is not None:
+        key = (offset, tz_name)
+        tz = _timezones.get(key)
+        if tz is None:
+            tz = _timezones[key] = OFXTimeZone(float(offset.replace(',','.')), tz_name)
+    return datetime( int(year), int(month), int(day), 
+                     int(hour or 0), int(minute or 0), int(second or 0),
+                     int((fraction or '0').ljust(6, '0')), tz )
+
     
+# OFX 2.x (XML) files start with these processing instructions
+XML_DECLARATION_RE = re.compile(r'<\?xml\s(.*?)\?>', re.S)
+OFX_DECLARATION_RE = re.compile(r'<\?OFX\s(.*?)\?>', re.S)
+OFX_ROOT_RE = re.compile(r'<OFX[\s>]')
+XML_ATTRIBUTE_RE = re.compile(r'([\w.:-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+# bytes read at once by probe_ofx_file
+PROBE_SIZE = 512
+
+def parse_ofx_headers(text):
+    '''
+    Parses the OFX 1.x (SGML) header block at the start of text.
+
+    Header lines are 'NAME:VALUE', they end at the first '<'. Blank lines
+    are skipped, lines without ':' are logged and skipped.
+
+    returns ( headers dict, index of the first '<' in text or len(text) )
+    '''
+    end = text.find('<')
+    if end < 0:
+        end = len(text)
+    headers = {}
+    for line in text[:end].split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        name, colon, value = line.partition(':')
+        if not colon:
+            logging.getLogger('OFXParser').warning("Invalid header line '%s' skipped", line[:80])
+            continue
+        headers[name.strip()] = value.strip()
+    return headers, end
+
+
+def parse_ofx_xml_headers(text):
+    '''
+    Parses the headers of an OFX 2.x (XML) file at the start of text : the
+    attributes of the <?OFX ...?> instruction and the encoding of the XML 
+    declaration. OFXHEADER is set to '200' if text has no OFX instruction.
+
+    returns headers dict
+    '''
+    headers = {}
+    root = OFX_ROOT_RE.search(text)
+    if root is not None:
+        text = text[:root.start()]
+    m = OFX_DECLARATION_RE.search(text)
+    if m is not None:
+        for name, value, quoted_value in XML_ATTRIBUTE_RE.findall(m.group(1)):
+            headers[name] = value or quoted_value
+    m = XML_DECLARATION_RE.search(text)
+    if m is not None:
+        for name, value, quoted_value in XML_ATTRIBUTE_RE.findall(m.group(1)):
+            if name == 'encoding':
+                headers['encoding'] = value or quoted_value
+    if 'OFXHEADER' not in headers:
+        headers['OFXHEADER'] = '200'
+    return headers
+
+
+def ofx_encoding(headers):
+    '''
+    Returns the Python codec name of the text of an OFX file from its headers 
+    (see probe_ofx_file), None if it is not known.
+
+    OFX 1.x : ENCODING is USASCII or UTF-8, with USASCII CHARSET is a code
+              page (1252 -> cp1252), ISO-8859-1 or NONE (ascii).
+    OFX 2.x : encoding of XML declaration, utf-8 by default.
+    '''
+    if headers.get('OFXHEADER', '')[:1] == '2' or 'encoding' in headers:
+        encoding = headers.get('encoding', 'utf-8')
+    elif headers.get('ENCODING', '').upper().replace('-', '') == 'UTF8':
+        encoding = 'utf-8'
+    else:
+        charset = headers.get('CHARSET', 'NONE').strip()
+        if charset.upper() == 'NONE':
+            encoding = 'ascii'
+        elif charset.isdigit():
+            encoding = 'cp' + charset
+        else:
+            encoding = charset
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
+
+def probe_ofx_file(path, size=PROBE_SIZE):
+    '''
+    Reads the headers of the OFX file at path without reading its body.
+
+    OFX 1.x headers are the SGML header lines, OFX 2.x headers are the
+    attributes of the <?OFX ...?> instruction (OFXHEADER is 200 or more) 
+    plus the encoding of the XML declaration if any. 
+    The file is read by blocks of size bytes until headers are complete.
+
+    returns ( headers dict, encoding ) where encoding is given by ofx_encoding()
+    '''
+    f = open(path, 'rb')
+    try:
+        data = f.read(size)
+        if data.startswith(codecs.BOM_UTF8):
+            data = data[len(codecs.BOM_UTF8):]
+        while True:
+            if data.lstrip().startswith('<?'):
+                # XML headers end with the OFX instruction or at the root element
+                complete = OFX_DECLARATION_RE.search(data) or OFX_ROOT_RE.search(data)
+            else:
+                complete = '<' in data
+            if complete:
+                break
+            block = f.read(size)
+            if not block:
+                break
+            data += block
+    finally:
+        f.close()
+
+    if data.lstrip().startswith('<?'):
+        headers = parse_ofx_xml_headers(data)
+    else:
+        headers = parse_ofx_headers(data)[0]
+    return headers, ofx_encoding(headers)
+
+
+def map_file(path):
+    '''
+    Returns the content of the file at path as a read only memory map, or as
+    a string for files that can't be mapped (empty and special files).
+    Memory maps are to be closed by the caller.
+    '''
+    f = open(path, 'rb')
+    try:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            return f.read()
+    finally:
+        f.close()
+
+
+class OFXPseudonymizer(object):
+    '''
+    Replaces OFX values with pseudonyms derived from a secret key.
+
+    Each word of a value is replaced by a word of same length and shape 
+    (digits by digits, letters by uppercase letters, other chars kept)
+    computed with HMAC-SHA256 of the key and the word : with the same key,
+    an ACCTID or a NAME gets the same pseudonym in every file, so
+    pseudonymized files remain joinable. Pseudonyms are cached.
+
+    AMT values are multiplied by a factor in [0.5, 1.5[ derived from the key :
+    signs are kept, magnitudes and totals are scaled by the same factor (each
+    amount is rounded on its own, totals may differ by a few cents).
+
+    Without a key, a random one is used : pseudonyms are consistent within
+    the output of one pseudonymizer only.
+    '''
+    DIGITS  = '0123456789'
+    LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+    # words are cached until cache holds CACHE_SIZE words
+    CACHE_SIZE = 100000
+
+    __words_re = re.compile(r'(\s+)')
+
+    def __init__(self, key=None):
+        if key is None:
+            key = os.urandom(32)
+        self.key = key
+        self.__cache = {}
+        digest = hmac.new(key, '\0amount', hashlib.sha256).digest()
+        self.amount_factor = 0.5 + int(digest[:8].encode('hex'), 16) / float(1 << 64)
+
+    def __digest(self, word):
+        digest = hmac.new(self.key, word, hashlib.sha256).digest()
+        i = 0
+        while len(digest) < len(word):
+            i += 1
+            digest += hmac.new(self.key, '%s\0%d' % (word, i), hashlib.sha256).digest()
+        return digest
+
+    def __pseudonym(self, word):
+        pseudonym = []
+        for c, d in zip(word, self.__digest(word)):
+            if c.isdigit():
+                pseudonym.append(self.DIGITS[ord(d) % 10])
+            elif c.isalpha() or c > '\x7f':
+                pseudonym.append(self.LETTERS[ord(d) % 26])
+            else:
+                pseudonym.append(c)
+        return ''.join(pseudonym)
+
+    def text(self, value):
+        '''
+        returns the pseudonym of value, word by word
+        '''
+        cache = self.__cache
+        words = self.__words_re.split(value)
+        for i in xrange(0, len(words), 2):
+            word = words[i]
+            pseudonym = cache.get(word)
+            if pseudonym is None:
+                if len(cache) >= self.CACHE_SIZE:
+                    cache.clear()
+                pseudonym = cache[word] = self.__pseudonym(word)
+            words[i] = pseudonym
+        return ''.join(words)
+
+    def amount(self, value):
+        '''
+        returns the scaled amount value, with as many decimals as value
+        '''
+        number = value.strip().replace(',', '.')
+        try:
+            amount = float(number)
+        except ValueError:
+            return self.text(value)
+        decimals = len(number) - number.find('.') - 1 if '.' in number else 0
+        scaled = amount * self.amount_factor
+        unit = 10.0 ** -decimals
+        if amount and abs(scaled) < unit / 2:
+            # a non null amount remains non null
+            scaled = unit if amount > 0 else -unit
+        result = '%.*f' % (decimals, scaled)
+        if ',' in value:
+            result = result.replace('.', ',')
+        return result
+
+
 class OFXNode(object):
     '''
     Used to represent OFX Trees
+
+    Nodes are compact (no instance __dict__, logger shared by all nodes) as a
+    parsed file holds about ten nodes per transaction. Self closing tags have
+    an empty tuple as children. On CPython 2.7 64 bits, a leaf node costs 
+    104 bytes (plus its value string) instead of about 1250 bytes.
     '''
     TYPE_UNDEFINED  = 0
     TYPE_OPENING    = 1
@@ -61,68 +362,132 @@ class OFXNode(object):
     TYPE_SELFCLOSING= 3
     TYPE_ERROR      = 9
 
+    # aggregates with at least INDEX_MIN_CHILDREN children get a name -> children
+    # index on first lookup, smaller ones are scanned (see __named_children).
+    INDEX_MIN_CHILDREN = 16
+
+    __slots__ = ('type', 'name', 'value', 'children', 'parent', '_index', '_val')
+
+    logger = logging.getLogger('OFXNode')
+
+    # set OFXNode.trace = True to log DSL accesses (getattr, iter, ...) at INFO level.
+    # When False, DSL accesses cost no logging call at all.
+    trace = False
+
+    # type of AMT values, set OFXNode.amount_type = decimal.Decimal for exact amounts
+    amount_type = float
+
+    # DT values converted to date, shared by all nodes
+    __dates = {}
+
     def __init__(self, type=TYPE_UNDEFINED, name='', value=''):
-        self.logger = logging.getLogger('OFXNode')
         self.type = type
         self.name = name
         self.value = value
-        self.children = []
+        if type == self.TYPE_SELFCLOSING:
+            self.children = ()
+        else:
+            self.children = []
         self.parent = None
-        self.__iter_src__=[]
+        self._index = None      # ( children, len(children) when built, { name : [ children ] } )
+        self._val = None        # ( value, amount_type, val, datetime_val ) cached for value, None until accessed
     
     def __get_nodes_chain(self):
-        if self.parent is None:
-            return self.name
-        return self.parent.__get_nodes_chain()+'.'+self.name
+        names = []
+        node = self
+        while node is not None:
+            names.append(node.name)
+            node = node.parent
+        names.reverse()
+        return '.'.join(names)
+
+    def __named_children(self, name):
+        '''
+        returns the list of children named after name.
+        
+        append_child() and del keep the index valid. It is rebuilt when
+        children is another list or has another length, other changes 
+        (children[i] = node, sort(), ...) are not detected : set _index to
+        None after them.
+        '''
+        children = self.children
+        if len(children) < self.INDEX_MIN_CHILDREN:
+            return [ c for c in children if c.name == name ]
+
+        index = self._index
+        if index is None or index[0] is not children or index[1] <> len(children):
+            named = {}
+            for c in children:
+                if c.name in named:
+                    named[c.name].append(c)
+                else:
+                    named[c.name] = [c]
+            index = self._index = (children, len(children), named)
+        return index[2].get(name, [])
+
+    def append_child(self, node):
+        '''
+        Append node to children and keep the children index up to date
+        '''
+        self.children.append(node)
+        node.parent = self
+        index = self._index
+        if index is not None:
+            if node.name in index[2]:
+                index[2][node.name].append(node)
+            else:
+                index[2][node.name] = [node]
+            self._index = (index[0], len(self.children), index[2])
     
     def __getattr__(self, name):
-        self.logger.info('%s.__getattr__(%s)' % ( self.__get_nodes_chain(), name ) )
-        for c in self.children:
-            if c.name == name :
+        if self.trace and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('%s.__getattr__(%s)', self.__get_nodes_chain(), name)
+        if len(self.children) < self.INDEX_MIN_CHILDREN:
+            for c in self.children:
+                if c.name == name :
+                    c.parent = self
+                    return c
+        else:
+            named = self.__named_children(name)
+            if named:
+                c = named[0]
                 c.parent = self
                 return c
         raise AttributeError, "%s has no '%s' child node."  % (self.__get_nodes_chain(), name)
 
     def __delattr__(self,name):
-        self.logger.info('%s.__delattr__(%s)' % ( self.__get_nodes_chain(), name ) )
-        delete_list = []
-        for c in self.children:
-            if c.name == name :
-                delete_list.append(c)
-        if delete_list:
-            while delete_list:
-                self.children.__delitem__(self.children.index(delete_list[0]))
-                delete_list.__delitem__(0)
+        if self.trace and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('%s.__delattr__(%s)', self.__get_nodes_chain(), name)
+        children = self.children
+        kept = [ c for c in children if c.name <> name ]
+        if len(kept) < len(children):
+            children[:] = kept
+            if self._index is not None:
+                self._index[2].pop(name, None)
+                self._index = (self._index[0], len(children), self._index[2])
             return
         raise AttributeError, "%s has no '%s' child node."  % (self.__get_nodes_chain(), name)
     
     def __build_iter_source(self):
         if self.parent == None:
             return []
-        
-        for elem in self.parent.children:
-            if elem.name == self.name:
-                self.__iter_src__.append(elem)
-        return self.__iter_src__
+        return self.parent.__named_children(self.name)
     
     def __iter__(self):
-        self.logger.info('%s.__iter__' % ( self.__get_nodes_chain() ) )
-        if self.__iter_src__:
-            return iter(self.__iter_src__)
+        if self.trace and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('%s.__iter__', self.__get_nodes_chain())
         return iter(self.__build_iter_source())
     
     def __getitem__(self, index):
-        self.logger.info('%s.__getitem__(%i)' % ( self.__get_nodes_chain(), index ) )
+        if self.trace and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('%s.__getitem__(%r)', self.__get_nodes_chain(), index)
         if type(index)==int:
-            if self.__iter_src__:
-                return self.__iter_src__[index]
             return self.__build_iter_source()[index]
         raise TypeError, "list indices must be integers"
 
     def __len__(self):
-        self.logger.info('%s.__len__()' % ( self.__get_nodes_chain(), ) )
-        if self.__iter_src__:
-            return len(self.__iter_src__)            
+        if self.trace and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('%s.__len__()', self.__get_nodes_chain())
         return len(self.__build_iter_source())
 
     def __repr__(self, show_parent=False, xml_style=False ):
@@ -135,84 +500,244 @@ class OFXNode(object):
         return '<%s>...</%s>' % (self.name, self.name,)
 
     def __val(self):
+        value = self.value
+        cache = self._val
+        if cache is not None and cache[0] is value and cache[1] is self.amount_type:
+            return cache[2]
+
         if self.name[:2] == 'DT' :
-            return date( int(self.value[:4]), int(self.value[4:6]), int(self.value[6:8]) ) 
+            day = value[:8]
+            val = self.__dates.get(day)
+            if val is None:
+                val = self.__dates[day] = date( int(day[:4]), int(day[4:6]), int(day[6:8]) ) 
         elif self.name[-3:] == 'AMT' :
-            return float(self.value.replace(',','.'))
-        return self.value
-    val = property(__val)
+            val = self.amount_type(value.replace(',','.'))
+        else:
+            return value
+        if cache is not None and cache[0] is value:
+            self._val = (value, self.amount_type, val, cache[3])
+        else:
+            self._val = (value, self.amount_type, val, None)
+        return val
+    val = property(__val, doc='''
+        Typed value : DT* values are converted to date, *AMT values to
+        OFXNode.amount_type (float by default). Converted values are cached 
+        until value is changed.
+        ''')
+
+    def __datetime_val(self):
+        value = self.value
+        cache = self._val
+        if cache is not None and cache[0] is value:
+            if cache[3] is not None:
+                return cache[3]
+            val = parse_ofx_datetime(value)
+            self._val = cache[:3] + (val,)
+        else:
+            val = parse_ofx_datetime(value)
+            self._val = (value, None, None, val)
+        return val
+    datetime_val = property(__datetime_val, doc='''
+        Value of a DT* node as a datetime, including time and time zone (see
+        parse_ofx_datetime). Cached with val until value is changed.
+        ''')
          
-    def ofx_repr(self, repr=''):
+    def __iter_chunks(self, leaf, indent='', indent_step=''):
+        '''
+        Walks the tree rooted at self without recursion and yields one string
+        per tag : leaf(node, indent) for self closing tags, opening and
+        closing tags of aggregates otherwise.
+        '''
         if self.value:
             # this is a self closing tag
-            return self.__repr__()+'\n'
+            yield leaf(self, indent)
+            return
 
-        repr += "<%s>\n" % self.name
-        for c in self.children:
-            repr += c.ofx_repr() 
-        repr += "</%s>\n" % self.name
-        return repr
-
-    def __obfuscate_value(self):
-        result = ''
-        for c in self.value:
-            if c.isalpha() :
-                result+=chr(random.randint(65,89))
-            elif c.isdigit():
-                result+=random.choice('0123456789')
+        yield "%s<%s>\n" % (indent, self.name)
+        stack = [ (self, iter(self.children), indent) ]
+        while stack:
+            node, children, indent = stack[-1]
+            child_indent = indent+indent_step
+            for c in children:
+                if c.value:
+                    yield leaf(c, child_indent)
+                else:
+                    yield "%s<%s>\n" % (child_indent, c.name)
+                    stack.append( (c, iter(c.children), child_indent) )
+                    break
             else:
-                result+=c
-        return '<%s>%s' % (self.name, result,)
+                stack.pop()
+                yield "%s</%s>\n" % (indent, node.name)
+
+    @staticmethod
+    def __write_chunks(fp, chunks, batch_size=1024):
+        '''
+        Writes chunks to fp by batches of batch_size chunks
+        '''
+        batch = []
+        for chunk in chunks:
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                fp.write(''.join(batch))
+                del batch[:]
+        fp.write(''.join(batch))
+
+    def __ofx_leaf(self, indent):
+        return '<%s>%s\n' % (self.name, self.value)
+
+    def __xml_leaf(self, indent):
+        return '%s<%s>%s</%s>\n' % (indent, self.name, self.value, self.name)
+
+    def iter_ofx(self):
+        '''
+        Yields OFX source of the tree rooted at self, one tag at a time
+        '''
+        return self.__iter_chunks(OFXNode.__ofx_leaf)
+
+    def write_ofx(self, fp):
+        '''
+        Writes OFX source of the tree rooted at self to file like object fp
+        '''
+        self.__write_chunks(fp, self.iter_ofx())
+
+    def ofx_repr(self, repr=''):
+        return repr + ''.join(self.iter_ofx())
 
-    def obfuscated_ofx_repr(self, repr=''):
+    def __obfuscated_leaf(self, pseudonymizer):
+        if self.name[:2] == "DT" or self.name in ('ACCTTYPE', 'CODE', 'STATUS', 'SEVERITY', 'LANGUAGE', 'CURDEF', 'TRNTYPE', ) :
+            return self.__repr__()+'\n'
+        elif self.name[-3:] == 'AMT':
+            return '<%s>%s\n' % (self.name, pseudonymizer.amount(self.value))
+        return '<%s>%s\n' % (self.name, pseudonymizer.text(self.value))
+
+    def iter_obfuscated_ofx(self, pseudonymizer=None):
+        '''
+        Same as iter_ofx() but values are obfuscated (see obfuscated_ofx_repr)
+        '''
+        if pseudonymizer is None:
+            pseudonymizer = OFXPseudonymizer()
+        return self.__iter_chunks(lambda node, indent: node.__obfuscated_leaf(pseudonymizer))
+
+    def write_obfuscated_ofx(self, fp, pseudonymizer=None):
+        '''
+        Same as write_ofx() but values are obfuscated (see obfuscated_ofx_repr)
+        '''
+        self.__write_chunks(fp, self.iter_obfuscated_ofx(pseudonymizer))
+
+    def obfuscated_ofx_repr(self, repr='', pseudonymizer=None):
         ''' 
         obfuscates output but OFXNode is left unmodified'
         
         Nodes 'ACCTTYPE', 'CODE', 'STATUS', 'SEVERITY', 'LANGUAGE', 
-        'CURDEF', 'TRNTYPE' are not obfuscated.
-        
+        'CURDEF', 'TRNTYPE' and DT* are not obfuscated, other values are
+        replaced by pseudonymizer (an OFXPseudonymizer with a random key
+        if None). Use an OFXPseudonymizer with a key to get the same
+        pseudonyms in every output.
         '''
-        # TODO: implement a delegate
-        if self.value:
-            if self.name[:2] == "DT" or self.name in ('ACCTTYPE', 'CODE', 'STATUS', 'SEVERITY', 'LANGUAGE', 'CURDEF', 'TRNTYPE', ) :
-                return self.__repr__()+'\n'
-            elif self.name[-3:] == 'AMT':
-                # TODO: we must return a random float value with the same sign and in a coherent range
-                tmp_val = random.random()*1000
-                if self.val < 0 :
-                    tmp_val = tmp_val * -1
-                return '<%s>%.2f\n' % (self.name, tmp_val)
-
-            return self.__obfuscate_value()+'\n'
-
-        repr += "<%s>\n" % self.name
-        for c in self.children:
-            repr += c.obfuscated_ofx_repr() 
-        repr += "</%s>\n" % self.name
-        return repr
+        return repr + ''.join(self.iter_obfuscated_ofx(pseudonymizer))
+
+    def iter_xml(self, indent=''):
+        '''
+        Yields XML source of the tree rooted at self, one tag at a time.
+        Each level is indented by 4 spaces more than its parent.
+        '''
+        return self.__iter_chunks(OFXNode.__xml_leaf, indent, '    ')
+
+    def write_xml(self, fp, indent=''):
+        '''
+        Writes XML source of the tree rooted at self to file like object fp
+        '''
+        self.__write_chunks(fp, self.iter_xml(indent))
 
     def xml_repr(self, indent='', repr=''):
-        if self.value:
-            # this is a self closing tag
-            return indent+self.__repr__(xml_style=True)+'\n'
+        return repr + ''.join(self.iter_xml(indent))
 
-        repr += indent+"<%s>\n" % self.name
-        for c in self.children:
-            repr += c.xml_repr(indent+'    ') 
-        repr += indent+"</%s>\n" % self.name
-        return repr
+    def iter_preorder(self):
+        '''
+        returns a generator of self and its descendants, parents before 
+        their children (document order). Nodes are found as they are
+        consumed, without recursion, and their parent is set as by the DSL.
+        '''
+        yield self
+        stack = [ (self, iter(self.children)) ]
+        while stack:
+            node, children = stack[-1]
+            for c in children:
+                c.parent = node
+                yield c
+                if c.children:
+                    stack.append( (c, iter(c.children)) )
+                    break
+            else:
+                stack.pop()
 
-    def find_children_by_name(self, search_name):
+    def iter_postorder(self):
         '''
-            returns a list of all subnodes named after search_name
+        returns a generator of self and its descendants, children before
+        their parent (see iter_preorder)
         '''
+        stack = [ (self, iter(self.children)) ]
+        while stack:
+            node, children = stack[-1]
+            for c in children:
+                c.parent = node
+                if c.children:
+                    stack.append( (c, iter(c.children)) )
+                    break
+                yield c
+            else:
+                stack.pop()
+                yield node
+
+    def iter_find(self, search_name):
+        '''
+        returns a generator of self and descendants named after search_name,
+        in document order, nested ones included
+        '''
+        # iter_preorder inlined : only matches go through the generator
         if self.name == search_name:
-            return [self]
-        found_list = []  
-        for n in self.children:
-            found_list.extend(n.find_children_by_name(search_name))
-        return found_list
+            yield self
+        stack = [ (self, iter(self.children)) ]
+        while stack:
+            node, children = stack[-1]
+            for c in children:
+                if c.name == search_name:
+                    c.parent = node
+                    yield c
+                if c.children:
+                    c.parent = node
+                    stack.append( (c, iter(c.children)) )
+                    break
+            else:
+                stack.pop()
+
+    def iter_leaves(self):
+        '''
+        returns a generator of the self closing tags of the tree, in document order
+        '''
+        SELFCLOSING = self.TYPE_SELFCLOSING
+        for node in self.iter_preorder():
+            if node.type == SELFCLOSING:
+                yield node
+
+    def find_children_by_name(self, search_name):
+        '''
+            returns a list of all subnodes named after search_name (see iter_find)
+        '''
+        return list(self.iter_find(search_name))
     
+    def select(self, path):
+        '''
+        returns a generator of the nodes matching path, a selector string
+        or an OFXPath (see OFXPath), self being the root :
+
+            for t in OFX.select('OFX/*MSGSRSV1/*STMTTRNRS/*/BANKTRANLIST/STMTTRN[TRNAMT<0]'):
+                ...
+        '''
+        if not isinstance(path, OFXPath):
+            path = compile_path(path)
+        return path.select(self)
+
     def get_type_name(self):
         ''' 
         Used for parser tuning
@@ -228,30 +753,393 @@ class OFXNode(object):
         elif self.type == self.TYPE_ERROR:
             return 'TYPE_ERROR'
 
+
+class OFXPath(object):
+    '''
+    Compiled selector of OFXNode trees, an XPath subset :
+
+        OFX/SIGNONMSGSRSV1/SONRS       steps are separated by / (children)
+        OFX//STMTTRN                   or // (descendants at any depth)
+        //STMTTRN                      a leading // searches the whole tree
+        OFX/*MSGSRSV1/*/*STMTRS        names may hold * and ? wildcards
+        //STMTTRN[TRNAMT<0]            predicates filter nodes on a leaf
+        //STMTTRNRS[STATUS/CODE=0]     reached through child names,
+        //STMTTRN[CHECKNUM]            or on the existence of a child,
+        //STMTTRN[NAME="A B"][MEMO]    several predicates must all be true.
+
+    The first step matches the root node the selector is applied to (OFX
+    for a parsed file). Predicate operators are = != < <= > >=, numbers are
+    compared as numbers (except with DT* leaves), quoted or other values as
+    strings, DT* values being cut to the length of the compared date
+    ([DTPOSTED>=20100301]). A predicate on a missing leaf or a non numeric
+    value compared to a number is false.
+
+    select() is a generator of nodes in document order, they are found as 
+    they are consumed. A child step after a // step reads the nodes of the
+    previous steps first, to merge the children of nested ones in order.
+
+    During streaming parsing, matches(node, ancestors) tells if a node
+    complete in a parser handler matches, handlers(callback) returns the
+    handlers calling callback(node, ancestors) for matching nodes. Predicates
+    of the last step see the complete node, those of ancestors the children
+    parsed so far.
+
+    Invalid selectors raise ValueError.
+    '''
+    STEP_RE = re.compile(r'''(/{0,2})([^/\[\]\s]+)((?:\[(?:[^\]"']|"[^"]*"|'[^']*')*\])*)''')
+    PREDICATE_RE = re.compile(r'''\[((?:[^\]"']|"[^"]*"|'[^']*')*)\]''')
+    CONDITION_RE = re.compile(r'''^\s*([^\s=<>!/]+(?:/[^\s=<>!/]+)*)\s*(?:(<=|>=|!=|=|<|>)\s*("[^"]*"|'[^']*'|[^\s"'=<>!]*)\s*)?$''')
+
+    OPERATORS = { '=' : operator.eq, '!=' : operator.ne, '<' : operator.lt,
+                  '<=' : operator.le, '>' : operator.gt, '>=' : operator.ge }
+
+    def __init__(self, path):
+        self.path = path
+        # [ ( descendant, name, name regex match or None, predicates ) ]
+        self.steps = []
+        idx = 0
+        while idx < len(path):
+            m = self.STEP_RE.match(path, idx)
+            if m is None or m.end() == idx or (idx and not m.group(1)):
+                raise ValueError, "invalid selector '%s' at %d" % (path, idx)
+            axis, name, predicates = m.groups()
+            if '*' in name or '?' in name:
+                match = re.compile(translate(name)).match
+            else:
+                match = None
+            predicates = [ self.__compile_predicate(p) for p in self.PREDICATE_RE.findall(predicates) ]
+            self.steps.append( (axis == '//', name, match, predicates) )
+            idx = m.end()
+        if not self.steps:
+            raise ValueError, "empty selector"
+
+    def __compile_predicate(self, predicate):
+        m = self.CONDITION_RE.match(predicate)
+        if m is None:
+            raise ValueError, "invalid predicate [%s] in '%s'" % (predicate, self.path)
+        names, op, literal = m.groups()
+        names = names.split('/')
+        if op is None:
+            return ( names, None, None, None )
+        number = None
+        if literal[:1] in ('"', "'"):
+            literal = literal[1:-1]
+        else:
+            try:
+                number = float(literal)
+            except ValueError:
+                pass
+        return ( names, self.OPERATORS[op], literal, number )
+
+    def __repr__(self):
+        return "<OFXPath '%s'>" % self.path
+
+    @staticmethod
+    def __test(node, name, match, predicates):
+        if match is None:
+            if name <> '*' and node.name <> name:
+                return False
+        elif match(node.name) is None:
+            return False
+        for names, op, literal, number in predicates:
+            leaf = node
+            for child_name in names:
+                for c in leaf.children:
+                    if c.name == child_name:
+                        leaf = c
+                        break
+                else:
+                    return False
+            if op is None:
+                continue
+            value = leaf.value
+            if leaf.name[:2] == 'DT':
+                value = value[:len(literal)]
+            elif number is not None:
+                try:
+                    value = float(value.replace(',', '.'))
+                except ValueError:
+                    return False
+                if not op(value, number):
+                    return False
+                continue
+            if not op(value, literal):
+                return False
+        return True
+
+    def __iter_step(self, contexts, step, top, dedupe):
+        descendant, name, match, predicates = step
+        test = self.__test
+        seen = set() if dedupe else None
+        for context in contexts:
+            if top:
+                # the root is the only child of the document
+                candidates = context.iter_preorder() if descendant else (context,)
+            elif descendant:
+                candidates = islice(context.iter_preorder(), 1, None)
+            else:
+                candidates = context.children
+            for node in candidates:
+                if not test(node, name, match, predicates):
+                    continue
+                if seen is not None:
+                    if id(node) in seen:
+                        continue
+                    seen.add(id(node))
+                if not (top or descendant):
+                    # iter_preorder sets parents of descendants
+                    node.parent = context
+                yield node
+
+    def __iter_nested_step(self, contexts, step):
+        '''
+        __iter_step of a child step after a // step : a context may be a
+        descendant of a previous one, their children are then yielded in
+        document order.
+        '''
+        descendant, name, match, predicates = step
+        test = self.__test
+        contexts = list(contexts)
+        ids = set(id(c) for c in contexts)
+        # contexts which are not descendants of another one
+        outer = []
+        for context in contexts:
+            node = context.parent
+            while node is not None and id(node) not in ids:
+                node = node.parent
+            if node is None:
+                outer.append(context)
+        if len(outer) == len(contexts):
+            for context in contexts:
+                for node in context.children:
+                    if test(node, name, match, predicates):
+                        node.parent = context
+                        yield node
+            return
+        for context in outer:
+            # iter_preorder sets parents
+            for node in islice(context.iter_preorder(), 1, None):
+                if id(node.parent) in ids and test(node, name, match, predicates):
+                    yield node
+
+    def select(self, root):
+        '''
+        returns a generator of the nodes of root tree matching the selector
+        '''
+        nodes = iter((root,))
+        descendant_before = False
+        for i, step in enumerate(self.steps):
+            if descendant_before and not step[0]:
+                nodes = self.__iter_nested_step(nodes, step)
+            else:
+                # nested contexts of a previous // step give the same descendants twice
+                nodes = self.__iter_step(nodes, step, i == 0, step[0] and descendant_before)
+            descendant_before = descendant_before or step[0]
+        return nodes
+
+    def first(self, root):
+        '''
+        returns the first node of root tree matching the selector, None if no node matches
+        '''
+        for node in self.select(root):
+            return node
+        return None
+
+    def matches(self, node, ancestors=()):
+        '''
+        returns True if node matches, ancestors being the list of its 
+        ancestors, root first (as given to parser handlers)
+        '''
+        chain = list(ancestors)
+        chain.append(node)
+        return self.__match_chain(chain, 0, 0)
+
+    def __match_chain(self, chain, i, j):
+        # True if steps[i:] match chain[j:], the last step on the last node
+        if i == len(self.steps):
+            return j == len(chain)
+        descendant, name, match, predicates = self.steps[i]
+        for k in (xrange(j, len(chain)) if descendant else xrange(j, min(j+1, len(chain)))):
+            if self.__test(chain[k], name, match, predicates) and self.__match_chain(chain, i+1, k+1):
+                return True
+        return False
+
+    def handlers(self, callback):
+        '''
+        returns parser handlers calling callback(node, ancestors) for the 
+        nodes matching the selector. The last step name can't have wildcards.
+        '''
+        descendant, name, match, predicates = self.steps[-1]
+        if match is not None or name == '*':
+            raise ValueError, "last step of '%s' must be a tag name to be used as a handler" % self.path
+        def handler(node, ancestors):
+            if self.matches(node, ancestors):
+                callback(node, ancestors)
+        return { name : handler }
+
+
+# compiled selectors, see compile_path
+_paths = {}
+PATHS_CACHE_SIZE = 100
+
+def compile_path(path):
+    '''
+    returns the OFXPath of path, compiled selectors are cached
+    '''
+    compiled = _paths.get(path)
+    if compiled is None:
+        if len(_paths) >= PATHS_CACHE_SIZE:
+            _paths.clear()
+        compiled = _paths[path] = OFXPath(path)
+    return compiled
+
+
+class OFXParseStats(object):
+    '''
+    Statistics recorded by a parser created with stats=True :
+
+        bytes         : size of the source given to the tokenizer
+        lines         : lines read (current_line_number)
+        nodes         : aggregates and self closing tags of the tree
+        tags          : { tag name : count } of these nodes
+        max_depth     : depth of the deepest node, root is at depth 1
+        errors        : ( line number, tag name ) of TYPE_ERROR tags,
+                        name is '' when the tag name is malformed
+        header_time   : seconds spent parsing headers
+        tokenize_time : seconds spent reading tags
+        build_time    : seconds spent building the tree, without tokenize_time
+
+    OFXXMLParser does not tokenize, time spent in expat is part of build_time.
+    iter_events() does not build a tree, build_time is not recorded.
+    '''
+    def __init__(self):
+        self.bytes         = 0
+        self.lines         = 0
+        self.nodes         = 0
+        self.tags          = {}
+        self.max_depth     = 0
+        self.errors        = []
+        self.header_time   = 0.0
+        self.tokenize_time = 0.0
+        self.build_time    = 0.0
+
+    def as_dict(self):
+        '''
+        returns statistics as a dict, suitable for json or metrics export
+        '''
+        return dict(self.__dict__, tags=dict(self.tags), errors=list(self.errors))
+
+    def __repr__(self):
+        return "<OFXParseStats %d bytes, %d lines, %d nodes, depth %d, %d errors, %.3fs header, %.3fs tokenize, %.3fs build>" % (
+                   self.bytes, self.lines, self.nodes, self.max_depth, len(self.errors),
+                   self.header_time, self.tokenize_time, self.build_time)
+
+
 class OFXParser(object):
     '''
     Parses an OFX source string and returns corresponding OFXNode tree
+
+    Two tokenizers are available :
+        TOKENIZER_CHAR : historical tokenizer, consumes source one char at a time
+        TOKENIZER_FAST : scans whole tag names and values with str.find and slices
+
+    Both produce the same tags (including TYPE_ERROR ones) and keep
+    current_line_number up to date. TOKENIZER_FAST is the default.
+
+    handlers is a { aggregate name : handler } dict, handler(node, ancestors)
+    is called while the tree is built, as soon as node and its children are
+    complete. ancestors is the list of open aggregates, root first.
+
+    stats=True records parse statistics in stats (see OFXParseStats), 
+    stats is None otherwise and parsing is not slowed down.
+
+    parse_error is None unless the source could not be parsed to its end 
+    (see OFXXMLParser), the tree or events are then truncated.
     '''
-    def __init__(self, source):
+    TOKENIZER_CHAR = 'char'
+    TOKENIZER_FAST = 'fast'
+
+    EVENT_START = 'start'   # an aggregate is opened
+    EVENT_LEAF  = 'leaf'    # a self closing tag (name + value) has been read
+    EVENT_END   = 'end'     # an aggregate is closed
+
+    def __init__(self, source, tokenizer=TOKENIZER_FAST, handlers=None, stats=False):
         '''
         setup parser and define parsing parameters.
+
+        source is None for OFXIncrementalParser which receives it with feed().
         '''
         self.logger = logging.getLogger('OFXParser')
+        self.handlers = dict(handlers or {})
+
+        if tokenizer == self.TOKENIZER_FAST:
+            self.__read_tag = self.__read_tag_fast
+        elif tokenizer <> self.TOKENIZER_CHAR:
+            raise ValueError, "unknown tokenizer '%s'" % tokenizer
+        self.tokenizer = tokenizer
+
+        self.stats = None
+        if stats:
+            self.stats = OFXParseStats()
+            self.__read_tag = self.__counting_read_tag(self.__read_tag)
         
-        if len(source) < 10:
+        if source is None:
+            source = ''
+        elif len(source) < 10:
             self.logger.error("Supplied source string is null")
             self.ready = False
             self.src = ""
 
         self.ready               = True
-        self.source              = source
-        self.source_idx          = 0
-        self.source_len          = len(source)
-        self.__EOF               = False
+        self._set_source(source)
         self.current_char        = None
         self.current_line_number = 1
         self.OFX_tree            = None
         self.OFX_headers         = None
+        self.parse_error         = None
+
+    def _set_source(self, source):
+        '''
+        (Re)start tokenizer on source. Line numbering goes on.
+        '''
+        if self.stats is not None:
+            self.stats.bytes += len(source)
+        self.source              = source
+        self.source_idx          = 0
+        self.source_len          = len(source)
+        self.__EOF               = False
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        '''
+        Returns a parser reading the file at path through a read only memory map.
+        
+        Only tag names and values are copied out of the map, the file content
+        is never loaded as a whole string. Call close() to release the map
+        once parsing is done (nodes don't reference it).
+        
+        kwargs are passed to OFXParser constructor.
+        '''
+        return cls(map_file(path), **kwargs)
+
+    @classmethod
+    def from_stream(cls, fp, **kwargs):
+        '''
+        Returns a parser reading the content of the file like object fp.
+        
+        kwargs are passed to OFXParser constructor.
+        '''
+        return cls(fp.read(), **kwargs)
+
+    def close(self):
+        '''
+        Release the memory map opened by from_file(). 
+        Parsed nodes remain usable, parser does not.
+        '''
+        if isinstance(self.source, mmap.mmap):
+            self.source.close()
+            self.source = ''
+            self.source_len = 0
         
     def __read_char(self):
         '''
@@ -289,6 +1177,9 @@ class OFXParser(object):
         self.__EOF=False
         self.next_char = self.current_char
         self.current_char = self.source[self.source_idx]            
+        if self.current_char == '\n' :
+            # it will be counted again when read again
+            self.current_line_number -=1
         return self.current_char
 
     def __read_tag_name(self, first_char=''):
@@ -309,7 +1200,7 @@ class OFXParser(object):
         if not tmp_name.isalpha() and not tmp_name.isupper() :
             return ''
         
-        return tmp_name    
+        return intern(tmp_name)
         
     def __read_tag_value(self,first_char=''):
         '''
@@ -396,6 +1287,7 @@ class OFXParser(object):
 
             if value :
                 current_tag.type = OFXNode.TYPE_SELFCLOSING
+                current_tag.children = ()
                 if tmp_value[-1]=='\n' and tmp_value[-2]=='\r': # Windows style end of line
                     current_tag.value = tmp_value[:-2]  
                 elif tmp_value[-1] == '\n' :                    # Unix style end of line
@@ -408,64 +1300,317 @@ class OFXParser(object):
             return current_tag
 
 
-    def __read_header_line(self):
+    def __read_tag_fast(self):
         """
-        Parse current line and return a tuple if it's a header
+        Same contract as __read_tag but tag names and values are located with
+        str.find() and extracted as slices instead of being built char by char.
 
         returns:
             None when EOF is reached
-            ( header, header_value) if line is a header
+            Tag with type = TYPE_ERROR if line is malformed
         """
+        source = self.source
+        source_len = self.source_len
+        idx = self.source_idx
 
-        c = self.__read_char()
-        if c == '<':  # headers can't start with <, this is a tag
-            self.__reject_char()
+        if self.__EOF or idx >= source_len:
             return None
 
-        line = ''
-        while c != '\n':
-            line += c
-            c = self.__read_char()
+        if source[idx] <> '<':
+            # like __read_tag, the unexpected char is consumed
+            if source[idx] == '\n':
+                self.current_line_number += 1
+            self.source_idx = idx+1
+            self.__EOF = self.source_idx == source_len
+            return None
+
+        idx += 1
+        if idx == source_len:
+            self.source_idx = idx
+            self.__EOF = True
+            return OFXNode(OFXNode.TYPE_ERROR)
+
+        if source[idx] == '/':    # CLOSING TAG
+            tag_type = OFXNode.TYPE_CLOSING
+            idx += 1
+            end = source.find('>', idx)
+        else:                     # OPENING or SELF_CLOSING TAG, first char is part of the name
+            tag_type = OFXNode.TYPE_UNDEFINED
+            end = source.find('>', idx+1)
+
+        if end < 0:
+            # we should not have encountered eof in a tag name
+            self.current_line_number += source[idx:].count('\n')
+            self.source_idx = source_len
+            self.__EOF = True
+            return OFXNode(OFXNode.TYPE_ERROR)
+
+        name = source[idx:end]
+        self.current_line_number += name.count('\n')
+        idx = end+1
+        if not name.isalpha() and not name.isupper() :
+            self.source_idx = idx
+            self.__EOF = idx == source_len
+            return OFXNode(OFXNode.TYPE_ERROR)
+        name = intern(name)
+
+        end = source.find('<', idx)
+        if end < 0:
+            # __read_tag reads up to EOF then rejects the last char
+            tmp_value = source[idx:]
+            self.current_line_number += tmp_value[:-1].count('\n')
+            self.source_idx = source_len-1
+        else:
+            tmp_value = source[idx:end]
+            self.current_line_number += tmp_value.count('\n')
+            self.source_idx = end
+        self.__EOF = False
 
-        return line.split(':')
+        value = tmp_value.strip('\r\n') <> ''
 
+        if tag_type == OFXNode.TYPE_CLOSING:
+            if value:
+                tag_type = OFXNode.TYPE_ERROR
+            return OFXNode(tag_type, name)
 
-    # We parse headers and returns them
-    def __parse_headers(self):
+        if value :
+            if tmp_value[-2:] == '\r\n':   # Windows style end of line
+                tmp_value = tmp_value[:-2]
+            elif tmp_value[-1] == '\n':    # Unix style end of line
+                tmp_value = tmp_value[:-1]
+            return OFXNode(OFXNode.TYPE_SELFCLOSING, name, tmp_value)
 
-        headers_dict = {}
-        h = self.__read_header_line()
-        while h is not None:
-            headers_dict[h[0]]=h[1]
-            h = self.__read_header_line()
-        return headers_dict
+        return OFXNode(OFXNode.TYPE_OPENING, name)
+
+
+    def _read_tag_at(self, idx):
+        """
+        Read one tag starting at idx (see OFXLazyParser)
+        """
+        self.source_idx = idx
+        self.__EOF = idx >= self.source_len
+        return self.__read_tag()
+
+
+    def __counting_read_tag(self, read_tag):
+        """
+        Returns read_tag wrapped to record tokenize time and error tags in stats
+        """
+        stats = self.stats
+        clock = time.time
+        def counting_read_tag():
+            # line of the tag, its value may end on a later line
+            line = self.current_line_number
+            start = clock()
+            tag = read_tag()
+            stats.tokenize_time += clock() - start
+            if tag is not None and tag.type == OFXNode.TYPE_ERROR:
+                stats.errors.append( (line, tag.name) )
+            return tag
+        return counting_read_tag
+
+
+    def __counted_events(self, events):
+        """
+        Yields events and records nodes, tags and max depth in stats
+        """
+        stats = self.stats
+        tags = stats.tags
+        EVENT_START, EVENT_END = self.EVENT_START, self.EVENT_END
+        depth = 0
+        for event, tag in events:
+            if event == EVENT_END:
+                depth -= 1
+            elif event is not None:
+                stats.nodes += 1
+                tags[tag.name] = tags.get(tag.name, 0) + 1
+                if depth >= stats.max_depth:
+                    stats.max_depth = depth + 1
+                if event == EVENT_START:
+                    depth += 1
+            else:
+                stats.lines = self.current_line_number
+            yield event, tag
+        stats.lines = self.current_line_number
+
+
+    def _tag_events(self):
+        """
+        Returns _iter_tag_events() generator, counted in stats if enabled
+        """
+        if self.stats is None:
+            return self._iter_tag_events()
+        return self.__counted_events(self._iter_tag_events())
+
+
+    def __headers(self):
+        # _parse_headers(), timed in stats if enabled
+        if self.stats is None:
+            return self._parse_headers()
+        start = time.time()
+        headers = self._parse_headers()
+        self.stats.header_time += time.time() - start
+        self.stats.lines = self.current_line_number
+        return headers
+
+
+    def _parse_headers(self):
+        """
+        Parse headers (see parse_ofx_headers) and move tokenizer to the first tag
+        """
+        start = self.source_idx
+        end = self.source.find('<', start)
+        if end < 0:
+            end = self.source_len
+        text = self.source[start:end]
+        headers = parse_ofx_headers(text)[0]
+        self.current_line_number += text.count('\n')
+        self.source_idx = end
+        if end == self.source_len:
+            self.__EOF = True
+        return headers
 
 
     def __parse_content(self):
+        """
+        Build the OFXNode tree from tag events with an explicit stack
+        of open aggregates, so nesting depth is not bounded by recursion limit.
+
+        returns the root node or None if source contains no tag.
+        """
+        root = None
+        open_nodes = []
+        handlers = self.handlers
+        for event, tag in self._tag_events():
+            if event == self.EVENT_END:
+                open_nodes.pop()
+                self.logger.debug(tag)
+                if tag.name in handlers:
+                    handlers[tag.name](tag, open_nodes)
+                continue
+
+            if open_nodes:
+                open_nodes[-1].children.append(tag)
+            else:
+                root = tag
+
+            if event == self.EVENT_START:
+                open_nodes.append(tag)
+
+        return root
+
+
+    def _more_data_expected(self):
+        '''
+        Returns True if more source may come once tokenizer has reached
+        the end of current source (see OFXIncrementalParser).
+        '''
+        return False
+
+
+    def _iter_tag_events(self):
+        """
+        Read tags and yield ( event, tag ) tuples.
+
+        'end' events carry the tag of the aggregate being closed (the one 
+        sent with its 'start' event). Stops when the root aggregate is closed
+        or on EOF. If _more_data_expected() at the end of source, yields 
+        ( None, None ) and goes on with the new source when resumed.
+
+        Malformed input is recovered from and logged as a warning :
+            - a closing tag for an ancestor aggregate also closes all aggregates
+              opened inside it,
+            - a closing tag that matches no open aggregate is ignored (this
+              happens with <CODE>0</CODE> style leaves),
+            - a closing tag followed by a value is used as a closing tag,
+            - other malformed tags and text outside of tags are skipped,
+            - aggregates still open at EOF are closed.
+        """
+        open_tags = []
+        open_names = []
+        # warnings give the line where tag starts, its value may end on a later line
+        line = self.current_line_number
         tag = self.__read_tag()
-        if tag is None:
-            pass
+        while True:
+            if tag is None:
+                if self.source_idx >= self.source_len:
+                    if not self._more_data_expected():
+                        break
+                    yield None, None
+                    line = self.current_line_number
+                    tag = self.__read_tag()
+                    continue
+                self.logger.warning("Unexpected text skipped at line %i", line)
+                while tag is None and self.source_idx < self.source_len:
+                    line = self.current_line_number
+                    tag = self.__read_tag()
+                continue
+
+            if tag.type == OFXNode.TYPE_SELFCLOSING:
+                yield self.EVENT_LEAF, tag
+                if not open_tags:
+                    return
+
+            elif tag.type == OFXNode.TYPE_OPENING:
+                open_tags.append(tag)
+                open_names.append(tag.name)
+                yield self.EVENT_START, tag
+
+            elif tag.type == OFXNode.TYPE_CLOSING or (tag.type == OFXNode.TYPE_ERROR and tag.name):
+                if tag.type == OFXNode.TYPE_ERROR:
+                    self.logger.warning("Value after closing tag </%s> ignored at line %i", tag.name, line)
+
+                if tag.name in open_names:
+                    if open_names[-1] <> tag.name:
+                        self.logger.warning("Closing tag </%s> closes unclosed aggregates at line %i", tag.name, line)
+                    while open_names.pop() <> tag.name:
+                        yield self.EVENT_END, open_tags.pop()
+                    yield self.EVENT_END, open_tags.pop()
+                    if not open_tags:
+                        return
+                else:
+                    self.logger.warning("Unexpected closing tag </%s> ignored at line %i", tag.name, line)
 
-        if tag.type == tag.TYPE_CLOSING :
-            return None
+            else:
+                self.logger.warning("Malformed tag skipped at line %i", line)
 
-        if tag.type == tag.TYPE_SELFCLOSING :
-            return tag
+            line = self.current_line_number
+            tag = self.__read_tag()
+
+        if open_tags:
+            self.logger.warning("Aggregate <%s> not closed at EOF", open_tags[0].name)
+        while open_tags:
+            yield self.EVENT_END, open_tags.pop()
+
+
+    def iter_events(self):
+        """
+        Parse OFX source as a stream of events without building the OFXNode tree.
+
+        yields ( event, node ) tuples where event is one of :
+            EVENT_START : node is an aggregate, its children are not attached
+            EVENT_LEAF  : node is a self closing tag, node.value and node.val are set
+            EVENT_END   : node is the aggregate sent with the matching EVENT_START
+
+        Headers are parsed first and are available in OFX_headers.
+        Yields nothing if parser is not ready.
+        """
+        if not self.ready:
+            return
 
-        child = self.__parse_content()
-        while child is not None:
-            tag.children.append( child )
-            child = self.__parse_content()
+        if self.OFX_headers is None:
+            self.OFX_headers = self.__headers()
 
-        self.logger.debug(tag)
-        return tag
+        for event in self._tag_events():
+            yield event
 
 
     def parse_headers(self):
         """
         Parse headers only and set parser ready to parse content.
         This is useful if you want to check header before reopening the file
-        with another encoding for example.
+        with another encoding for example (probe_ofx_file() does it without
+        reading the file).
 
         returns a dict of headers or None if the file contains no headers or parser is not ready.
         """
@@ -473,7 +1618,7 @@ class OFXParser(object):
             return None
 
         if self.OFX_headers is None:
-            self.OFX_headers = self.__parse_headers()
+            self.OFX_headers = self.__headers()
 
         return self.OFX_headers
 
@@ -488,77 +1633,537 @@ class OFXParser(object):
             return None
 
         if self.OFX_headers is None:
-            self.OFX_headers = self.__parse_headers()
+            self.OFX_headers = self.__headers()
 
         if self.OFX_tree is not None:
             return self.OFX_tree
 
-        self.OFX_tree = self.__parse_content()
+        if self.stats is None:
+            self.OFX_tree = self.__parse_content()
+        else:
+            stats = self.stats
+            start = time.time()
+            tokenize_time = stats.tokenize_time
+            self.OFX_tree = self.__parse_content()
+            stats.build_time += time.time() - start - (stats.tokenize_time - tokenize_time)
 
         return self.OFX_tree
 
 
 
+class OFXIncrementalParser(OFXParser):
+    '''
+    Push style OFX parser : source is supplied with feed() as it arrives and
+    events are available with read_events() as soon as their tags are complete.
+
+        parser = OFXIncrementalParser(discard=('STMTTRN',))
+        for chunk in chunks:
+            parser.feed(chunk)
+            for event, node in parser.read_events():
+                if node.name == 'STMTTRN':
+                    ... node is a complete STMTTRN subtree ...
+        OFX = parser.close()
+
+    events : events queued for read_events(), EVENT_END nodes are complete subtrees
+    discard : names of aggregates removed from the tree once complete, this 
+              keeps memory low when their events are all we need.
+    handlers : called before aggregates are discarded (see OFXParser)
+    stats : as OFXParser, build_time includes the time spent in feed() 
+            to queue events
+    '''
+    def __init__(self, events=(OFXParser.EVENT_END,), discard=(), tokenizer=OFXParser.TOKENIZER_FAST, handlers=None, stats=False):
+        OFXParser.__init__(self, None, tokenizer, handlers, stats)
+        self.events         = frozenset(events)
+        self.discard        = frozenset(discard)
+        self.closed         = False
+        self.__buffer       = ''        # received data not given to the tokenizer yet
+        self.__tag_events   = None      # _iter_tag_events() generator, created after headers
+        self.__open_nodes   = []
+        self.__ready_events = deque()
+
+    def _more_data_expected(self):
+        return not self.closed
+
+    def feed(self, data):
+        '''
+        Supply a new chunk of source. 
+        Tags are tokenized as soon as the next '<' is received.
+        '''
+        if self.closed:
+            raise ValueError, "feed() called after close()"
+
+        buffer = self.__buffer + data
+        end = self.__last_tag_start(buffer)
+        if end <= 0 or (self.__tag_events is None and buffer.find('<') == end):
+            # headers are parsed once the first tag is complete
+            self.__buffer = buffer
+            return
+        self.__buffer = buffer[end:]
+        self.__push(buffer[:end])
+
+    @staticmethod
+    def __last_tag_start(buffer):
+        '''
+        Returns the offset of the last '<' of buffer known to start a tag, 0 if none.
+
+        Tokenizers read tag names up to the next '>', so a '<' of a malformed
+        name (<NAM\n</STMTTRN>) doesn't start a tag. buffer starts with a tag
+        or with headers, its first '<' starts a tag. Another '<' does if there
+        is a '>' between it and the previous '<' (excluding the char following
+        the previous '<', the first char of a name).
+        '''
+        start = buffer.rfind('<')
+        while start > 0:
+            previous = buffer.rfind('<', 0, start)
+            if previous < 0 or buffer.find('>', previous+2, start) >= 0:
+                return start
+            start = previous
+        return 0
+
+    def close(self):
+        '''
+        Signal end of source, flush pending tags and returns the OFXNode tree.
+        '''
+        if not self.closed:
+            self.closed = True
+            buffer, self.__buffer = self.__buffer, ''
+            self.__push(buffer)
+        return self.OFX_tree
+
+    def read_events(self):
+        '''
+        Yields ( event, node ) tuples available so far (see OFXParser.iter_events)
+        '''
+        ready_events = self.__ready_events
+        while ready_events:
+            yield ready_events.popleft()
+
+    def parse(self):
+        '''
+        Returns the OFXNode tree once close() has been called, None otherwise
+        '''
+        return self.OFX_tree if self.closed else None
+
+    def __push(self, source):
+        # previous source has been fully consumed by the tokenizer 
+        self._set_source(source)
+        if self.__tag_events is None:
+            self.OFX_headers = self.parse_headers()
+            self.__tag_events = self._tag_events()
+
+        if self.stats is None:
+            self.__build(self.__tag_events)
+        else:
+            stats = self.stats
+            start = time.time()
+            tokenize_time = stats.tokenize_time
+            self.__build(self.__tag_events)
+            stats.build_time += time.time() - start - (stats.tokenize_time - tokenize_time)
+
+    def __build(self, tag_events):
+
+        open_nodes = self.__open_nodes
+        for event, tag in tag_events:
+            if event is None:
+                # waiting for more data
+                return
+
+            if event == self.EVENT_END:
+                open_nodes.pop()
+                if tag.name in self.handlers:
+                    self.handlers[tag.name](tag, open_nodes)
+                if tag.name in self.discard and open_nodes:
+                    # a complete aggregate is the last child of its parent
+                    open_nodes[-1].children.pop()
+            else:
+                if open_nodes:
+                    open_nodes[-1].children.append(tag)
+                elif self.OFX_tree is None:
+                    self.OFX_tree = tag
+                if event == self.EVENT_START:
+                    open_nodes.append(tag)
+
+            if event in self.events:
+                self.__ready_events.append((event, tag))
+
+
+class OFXXMLParser(OFXParser):
+    '''
+    Parses OFX 2.x (XML) sources with expat and returns the same OFXNode 
+    trees and events as OFXParser :
+
+        - elements with text and no child element are self closing tags,
+          their value is the text as in the source : in the encoding of the
+          document, with &amp; &lt; &gt; entities as in OFX 1.x files,
+        - other elements are aggregates, text between their children is ignored.
+
+    OFX_headers holds the attributes of the <?OFX ...?> instruction and the
+    encoding of the XML declaration (see parse_ofx_xml_headers). 
+    Invalid XML is logged as an error and set in parse_error, aggregates 
+    still open are closed : the tree or events stop at the error.
+
+    encoding overrides the encoding of the document, files written by 
+    OFXNode.xml_repr() have no XML declaration and are in the encoding of
+    their OFX source (cp1252 for example).
+
+    With stats=True, invalid XML is recorded in stats errors with a '' tag name.
+    '''
+    # bytes given to expat at once
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, source, handlers=None, encoding=None, stats=False):
+        OFXParser.__init__(self, source, OFXParser.TOKENIZER_FAST, handlers, stats)
+        self.encoding = encoding
+
+    def _parse_headers(self):
+        # headers end at the root element
+        root = OFX_ROOT_RE.search(self.source)
+        end = root.start() if root is not None else self.source_len
+        return parse_ofx_xml_headers(self.source[:end])
+
+    def _iter_tag_events(self):
+        """
+        Feed source to expat and yield ( event, node ) tuples
+        """
+        EVENT_START, EVENT_LEAF, EVENT_END = self.EVENT_START, self.EVENT_LEAF, self.EVENT_END
+        events = []
+        open_tags = []
+        # [ name, text chunks ] of the element whose content is not known yet
+        pending = []
+
+        def flush_pending():
+            # pending element has a child element : it is an aggregate
+            name = pending[0]
+            del pending[:]
+            tag = OFXNode(OFXNode.TYPE_OPENING, name)
+            open_tags.append(tag)
+            events.append( (EVENT_START, tag) )
+
+        def start_element(name, attributes):
+            if pending:
+                flush_pending()
+            pending[:] = [ intern(str(name)), [] ]
+
+        def end_element(name):
+            if pending:
+                value = u''.join(pending[1])
+                if value.strip():
+                    value = escape(value).encode(encoding, 'xmlcharrefreplace')
+                    events.append( (EVENT_LEAF, OFXNode(OFXNode.TYPE_SELFCLOSING, pending[0], value)) )
+                    del pending[:]
+                    return
+                flush_pending()
+            events.append( (EVENT_END, open_tags.pop()) )
+
+        def character_data(data):
+            if pending:
+                pending[1].append(data)
+
+        headers = self.OFX_headers or {}
+        encoding = self.encoding or headers.get('encoding') or 'utf-8'
+        parser = expat.ParserCreate(self.encoding)
+        parser.buffer_text = True
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+
+        source = self.source
+        idx = self.source_idx
+        try:
+            while idx < self.source_len:
+                parser.Parse(source[idx:idx+self.CHUNK_SIZE], False)
+                idx += self.CHUNK_SIZE
+                self.source_idx = min(idx, self.source_len)
+                self.current_line_number = parser.CurrentLineNumber
+                for event in events:
+                    yield event
+                del events[:]
+            parser.Parse('', True)
+        except expat.ExpatError, e:
+            self.logger.error("Invalid XML at line %i : %s", e.lineno, expat.ErrorString(e.code))
+            self.parse_error = "Invalid XML at line %i : %s" % (e.lineno, expat.ErrorString(e.code))
+            self.current_line_number = e.lineno
+            if self.stats is not None:
+                self.stats.errors.append( (e.lineno, '') )
+            # events before the error are valid
+            for event in events:
+                yield event
+            while open_tags:
+                yield EVENT_END, open_tags.pop()
+            return
+
+        self.current_line_number = parser.CurrentLineNumber
+        for event in events:
+            yield event
+
+
+class OFXLazyNode(OFXNode):
+    '''
+    Aggregate of OFXLazyParser trees : children are parsed from the source
+    on first access, they are kept afterwards. Aggregates among them are
+    OFXLazyNode as well, only subtrees actually walked are built.
+    '''
+    __slots__ = ('_parser', '_span')
+
+    __children = OFXNode.children
+
+    def __init__(self, name, parser, start, end):
+        OFXNode.__init__(self, OFXNode.TYPE_OPENING, name)
+        self._parser = parser
+        self._span = (start, end)      # content in source, None once expanded
+
+    def __get_children(self):
+        span = self._span
+        if span is not None:
+            OFXLazyNode.__children.__set__(self, self._parser._expand(*span))
+            self._span = None
+            self._parser = None
+        return OFXLazyNode.__children.__get__(self)
+
+    def __set_children(self, children):
+        OFXLazyNode.__children.__set__(self, children)
+        self._span = None
+        self._parser = None
+
+    children = property(__get_children, __set_children)
+
+    @property
+    def expanded(self):
+        '''
+        True once children have been parsed
+        '''
+        return self._span is None
+
+
+class OFXLazyParser(OFXParser):
+    '''
+    Parses OFX sources on demand : parse() scans the source for aggregate
+    tags and returns an OFXLazyNode root, children of an aggregate are 
+    parsed when they are first accessed through the DSL :
+
+        parser = OFXLazyParser.from_file('statements.ofx')
+        OFX = parser.parse()
+        OFX.SIGNONMSGSRSV1.SONRS.STATUS.CODE.val
+        OFX.BANKMSGSRSV1.STMTTRNRS[3].STMTRS.BANKACCTFROM.ACCTID.value
+
+    builds the nodes of SIGNONMSGSRSV1 and of the aggregates on the way to
+    the 4th STMTTRNRS only. Walks and serializations (iter_preorder, 
+    ofx_repr, ...) build what they visit.
+
+    The scan follows OFXParser recovery rules for unclosed aggregates and
+    unexpected closing tags, trees are the same as OFXParser ones. Malformed
+    tags are skipped without warning and line numbers are not tracked.
+    The source is read as long as the tree is not fully built : close() the
+    parser once the tree is no longer used.
+    '''
+    # closing tags and aggregate opening tags (without value), other tags are skipped
+    AGGREGATE_TAG_RE = re.compile(r'<(?:/([^<>]*)>|([^<>/][^<>]*)>(?=[\r\n]*(?:<|\Z)))')
+    # same as AGGREGATE_TAG_RE for tag names holding '<' (malformed), tags
+    # are split as by the tokenizers : the name is up to the next '>'
+    MALFORMED_TAG_RE = re.compile(r'<(?:>|[^>]*(?:<|\Z))')
+    TAG_RE = re.compile(r'<(?:/([^>]*)|([\s\S][^>]*)(?=>[\r\n]*(?:<|\Z))|[\s\S][^>]*)>')
+
+    def __init__(self, source, tokenizer=OFXParser.TOKENIZER_FAST):
+        OFXParser.__init__(self, source, tokenizer)
+        # { offset of an aggregate tag : ( name, content start, content end, offset after it ) }
+        self.__index = None
+
+    def __scan(self, start):
+        index = {}
+        open_tags = []      # ( name, tag offset, content start )
+        open_names = []
+        tag_re = self.AGGREGATE_TAG_RE
+        if self.MALFORMED_TAG_RE.search(self.source, start):
+            tag_re = self.TAG_RE
+        for m in tag_re.finditer(self.source, start):
+            name = m.group(2)
+            if name is not None:
+                if name.isalpha() or name.isupper():
+                    open_tags.append( (intern(name), m.start(), m.end()) )
+                    open_names.append(name)
+                continue
+            name = m.group(1)
+            if name is None or name not in open_names:
+                continue
+            # a closing tag of an ancestor also closes aggregates opened inside it
+            while True:
+                open_name, offset, content_start = open_tags.pop()
+                open_names.pop()
+                if open_name == name:
+                    index[offset] = (open_name, content_start, m.start(), m.end())
+                    break
+                index[offset] = (open_name, content_start, m.start(), m.start())
+            if not open_tags:
+                return index
+        for open_name, offset, content_start in open_tags:
+            index[offset] = (open_name, content_start, self.source_len, self.source_len)
+        return index
+
+    def _expand(self, start, end):
+        """
+        returns the children of the aggregate whose content is source[start:end]
+        """
+        source = self.source
+        index = self.__index
+        SELFCLOSING = OFXNode.TYPE_SELFCLOSING
+        OPENING = OFXNode.TYPE_OPENING
+        children = []
+        idx = source.find('<', start, end)
+        while idx >= 0:
+            aggregate = index.get(idx)
+            if aggregate is not None:
+                name, content_start, content_end, after = aggregate
+                children.append(OFXLazyNode(name, self, content_start, content_end))
+                idx = source.find('<', after, end)
+                continue
+            tag = self._read_tag_at(idx)
+            if tag is not None and (tag.type == SELFCLOSING or tag.type == OPENING):
+                children.append(tag)
+            idx = source.find('<', max(self.source_idx, idx+1), end)
+        return children
+
+    def parse(self):
+        """
+        Scan OFX source and returns an OFXLazyNode tree, an OFXNode tree if
+        the source doesn't start with an aggregate
+
+        returns None if source is undefined.
+        """
+        if not self.ready:
+            return None
+        self.parse_headers()
+        if self.OFX_tree is not None:
+            return self.OFX_tree
+
+        start = self.source_idx
+        self.__index = self.__scan(start)
+        root = self.__index.get(start)
+        if root is None:
+            return OFXParser.parse(self)
+        name, content_start, content_end, after = root
+        self.OFX_tree = OFXLazyNode(name, self, content_start, content_end)
+        return self.OFX_tree
+
+
+def parser_for_file(path, **kwargs):
+    '''
+    Returns an OFXXMLParser for OFX 2.x files, an OFXParser otherwise,
+    reading the file at path (see probe_ofx_file and OFXParser.from_file).
+    '''
+    headers, encoding = probe_ofx_file(path)
+    if headers.get('OFXHEADER', '')[:1] == '2':
+        return OFXXMLParser.from_file(path, **kwargs)
+    return OFXParser.from_file(path, **kwargs)
+
+
+def parser_for_source(source, **kwargs):
+    '''
+    Returns an OFXXMLParser for OFX 2.x sources (starting with an XML 
+    declaration or instruction), an OFXParser otherwise (see parser_for_file).
+    '''
+    head = source[:PROBE_SIZE]
+    if head.startswith(codecs.BOM_UTF8):
+        head = head[len(codecs.BOM_UTF8):]
+    if head.lstrip().startswith('<?') and parse_ofx_xml_headers(head).get('OFXHEADER', '')[:1] == '2':
+        return OFXXMLParser(source, **kwargs)
+    return OFXParser(source, **kwargs)
+
+
 class OFXObfuscator(object):
     '''
     Obfuscates OFX source strings
-    
-    Problem with OFXObfuscator is that it's so basic, it breaks date.
-    So when parsing an obfuscated file you can't use .val on date attribute
-    an must rely on .value. 
-    
+
+    Headers and tags are kept, letters of values are replaced by 'A' and
+    digits by '9' (bytes above 127 by 'A' too, so the result is ASCII).
+    Values of DT* tags are kept so dates remain valid, AMT values remain
+    valid numbers ('-844.61' becomes '-999.99'). Values of codes 
+    (ACCTTYPE, CODE, STATUS, SEVERITY, LANGUAGE, CURDEF, TRNTYPE) are kept.
+
+    Source is processed by chunks of whole tags, each value is translated
+    in one str.translate() call, so big files can be streamed :
+
+        OFXObfuscator.from_file('big.ofx').write(open('obfuscated.ofx', 'wb'))
     '''
+    KEPT_VALUES = frozenset(('ACCTTYPE', 'CODE', 'STATUS', 'SEVERITY', 'LANGUAGE', 'CURDEF', 'TRNTYPE'))
+
+    TABLE = string.maketrans( string.ascii_letters + string.digits + ''.join(chr(i) for i in range(128, 256)),
+                              'A'*52 + '9'*10 + 'A'*128 )
+
     def __init__(self, source):
         '''
-        setup parser and define parsing parameters.
+        source is a string or a memory map (see from_file)
         '''
         self.logger = logging.getLogger('OFXObfuscator')
         
         if len(source) < 10:
             self.logger.error("Supplied source string is too short to be an OFX")
-            self.ready = False
-            self.source = ""
 
         self.ready      = True
         self.source     = source
-        self.source_idx = 0
         self.source_len = len(source)
-        self.result     = ''
 
-    def __read_tag_name(self):
+    @classmethod
+    def from_file(cls, path):
         '''
-        Read an OFX tag name (Uppercase and Letters string)
-        
+        Returns an obfuscator reading the file at path through a read only memory map
         '''
-        # on entry idx is on '<'
-        # on exit idx is on '>'
-        while self.source_idx < self.source_len and self.source[self.source_idx] <> '>' :
-            self.result += self.source[self.source_idx]
-            self.source_idx+=1
-        
-        if self.source_idx < self.source_len:
-            self.result += self.source[self.source_idx]
-                    
-    def obfuscate(self):
-        if not self.ready:
-            raise "NotReady"
-        
-        while( self.source_idx < self.source_len ) :
-            
-            current_char = self.source[self.source_idx]
-            
-            if current_char == '<' :
-                self.result+= '<'
-                self.source_idx+=1
-                self.__read_tag_name()
-                
-            elif current_char.isdigit() :
-                self.result+='9'
-            elif current_char.isalpha():
-                self.result+= 'A'
-            else :
-                self.result += current_char
+        return cls(map_file(path))
 
-            self.source_idx+=1;
-                 
-        return self.result
+    def __obfuscate_chunk(self, chunk):
+        '''
+        Obfuscates values of chunk which starts with a tag
+        '''
+        table = self.TABLE
+        kept = self.KEPT_VALUES
+        pieces = chunk.split('<')
+        for i in xrange(1, len(pieces)):
+            piece = pieces[i]
+            end = piece.find('>') + 1
+            if end == 0 or end == len(piece):
+                # no value (or tag not closed at EOF)
+                continue
+            name = piece[:end-1]
+            if name[:2] == 'DT' or name in kept:
+                continue
+            pieces[i] = piece[:end] + piece[end:].translate(table)
+        return '<'.join(pieces)
+
+    def iter_obfuscated(self, chunk_size=1<<20):
+        '''
+        Yields obfuscated source by chunks of about chunk_size bytes
+        '''
+        source = self.source
+        source_len = self.source_len
+
+        # headers are kept as is
+        start = source.find('<')
+        if start < 0:
+            start = source_len
+        if start:
+            yield source[:start]
+
+        while start < source_len:
+            end = start + chunk_size
+            if end < source_len:
+                # chunks are cut before a tag
+                cut = source.rfind('<', start+1, end)
+                if cut < 0:
+                    cut = source.find('<', end)
+                end = cut if cut >= 0 else source_len
+            else:
+                end = source_len
+            yield self.__obfuscate_chunk(source[start:end])
+            start = end
+
+    def write(self, fp, chunk_size=1<<20):
+        '''
+        Writes obfuscated source to file like object fp
+        '''
+        for chunk in self.iter_obfuscated(chunk_size):
+            fp.write(chunk)
+
+    def obfuscate(self):
+        '''
+        returns obfuscated source
+        '''
+        return ''.join(self.iter_obfuscated())
@@ -20,9 +20,15 @@ __version__ = "edofx2csv.py v0.1 - mai 2010"
 import sys
 
 import os
+import csv
+import glob
+import time
+import traceback
+import multiprocessing
 import ConfigParser
 
-from edofx import OFXParser
+from StringIO import StringIO
+from edofx import OFXParser, parser_for_file
 from optparse import OptionParser, OptionGroup
 
 class StatementTransaction(object):
@@ -53,38 +59,79 @@ class Statement(object):
         self.balance = 0
         self.balance_date = ''
 
-    def export_as_csv(self, separator=';', header_line = True):
-        tmp = ""
+    def write_csv(self, fp, **options):
+        '''
+        Writes transactions as CSV to fp, options are those of StatementCSVWriter
+        '''
+        writer = StatementCSVWriter(fp, **options)
+        writer.write_statement(self)
+        writer.flush()
+
+    def export_as_csv(self, separator=';', header_line = True, **options):
+        tmp = StringIO()
+        self.write_csv(tmp, separator=separator, header_line=header_line, **options)
+        return tmp.getvalue()
+
+
+class StatementCSVWriter(object):
+    '''
+    Writes transactions of statements as CSV rows to a file like object.
+
+    Rows are written by batches of batch_size rows through the csv module,
+    which quotes fields containing separator, quotes or end of lines.
+    Amounts are written with decimal_separator, dates with date_format.
+    Several statements can be written in the same file.
+    '''
+    HEADER = ( 'ACCOUNT_TYPE', 'BANK_ID', 'BRANCH_ID', 'ACCOUNT_ID', 'FITID',
+               'TRANSACTION_TYPE', 'TRANSACTION_DATE', 'TRANSACTION_AMOUNT',
+               'TRANSACTION_CREDIT', 'TRANSACTION_DEBIT', 'TRANSACTION_NAME',
+               'TRANSACTION_MEMO' )
+
+    def __init__(self, fp, separator=';', decimal_separator=',', date_format='%d/%m/%Y',
+                 header_line=True, batch_size=1024, quoting=csv.QUOTE_MINIMAL):
+        self.writer = csv.writer(fp, delimiter=separator, quoting=quoting, lineterminator='\n')
+        self.decimal_separator = decimal_separator
+        self.date_format = date_format
+        self.batch_size = batch_size
+        self.rows = []
+        self.__dates = {}
         if header_line:
-            tmp += 'ACCOUNT_TYPE%s' % ( separator )
-            tmp += 'BANK_ID%s' % ( separator )
-            tmp += 'BRANCH_ID%s' % ( separator )
-            tmp += 'ACCOUNT_ID%s' % ( separator )
-            tmp += 'FITID%s' % ( separator )
-            tmp += 'TRANSACTION_TYPE%s' % (separator)
-            tmp += 'TRANSACTION_DATE%s' % (separator)
-            tmp += 'TRANSACTION_AMOUNT%s' % ( separator )
-            tmp += 'TRANSACTION_CREDIT%s' % ( separator )
-            tmp += 'TRANSACTION_DEBIT%s' % ( separator )
-            tmp += 'TRANSACTION_NAME%s' % ( separator )
-            tmp += 'TRANSACTION_MEMO' 
-            tmp += '\n'
-        
-        for e in self.transaction_list:
-            tmp += '"%s"%s' % (self.type, separator)
-            tmp += '"%s"%s' % (self.bank_id, separator)
-            tmp += '"%s"%s' % (self.branch_id, separator)
-            tmp += '"%s"%s' % (self.account_id, separator)
-            tmp += '"%s"%s' % (e.fitid, separator)
-            tmp += '"%s"%s' % (e.type, separator)
-            tmp += '"%s"%s' % (e.date.strftime("%d/%m/%Y"), separator)
-            tmp += str(e.amount).replace('.',',') + separator
-            tmp += ( str(e.amount) if e.amount > 0 else '' ) + separator
-            tmp += ( str(e.amount) if e.amount < 0 else '' ) + separator
-            tmp += '"%s"%s' % (e.name, separator)
-            tmp += '"%s"' % (e.memo)
-            tmp += '\n'
-        return tmp
+            self.rows.append(self.HEADER)
+
+    def __format_date(self, d):
+        formatted = self.__dates.get(d)
+        if formatted is None:
+            formatted = self.__dates[d] = d.strftime(self.date_format) if d else ''
+        return formatted
+
+    def write_transaction(self, stmt, st):
+        '''
+        Adds one row for transaction st of statement stmt
+        '''
+        amount = str(st.amount)
+        if self.decimal_separator <> '.':
+            amount = amount.replace('.', self.decimal_separator)
+        self.rows.append( ( stmt.type, stmt.bank_id, stmt.branch_id, stmt.account_id,
+                            st.fitid, st.type, self.__format_date(st.date), amount,
+                            amount if st.amount > 0 else '',
+                            amount if st.amount < 0 else '',
+                            st.name, st.memo ) )
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def write_statement(self, stmt):
+        '''
+        Adds one row per transaction of stmt
+        '''
+        for st in stmt.transaction_list:
+            self.write_transaction(stmt, st)
+
+    def flush(self):
+        '''
+        Writes pending rows
+        '''
+        self.writer.writerows(self.rows)
+        del self.rows[:]
 
 # Global OFX file structure is (without self closing tags) :
 # OFX
@@ -180,38 +227,311 @@ def build_Statement_tree(OFX):
     return statement_list
 
 
-def main(source_file):
+# Leaves read by iter_statement_items, indexed by ( parent aggregate, leaf name )
+STATEMENT_LEAVES = {
+    ('STMTRS', 'CURDEF')          : 'currency',
+    ('CCSTMTRS', 'CURDEF')        : 'currency',
+    ('BANKACCTFROM', 'BANKID')    : 'bank_id',
+    ('BANKACCTFROM', 'BRANCHID')  : 'branch_id',
+    ('BANKACCTFROM', 'ACCTID')    : 'account_id',
+    ('CCACCTFROM', 'ACCTID')      : 'account_id',
+    ('BANKTRANLIST', 'DTSTART')   : 'start_date',
+    ('BANKTRANLIST', 'DTEND')     : 'end_date',
+    ('LEDGERBAL', 'BALAMT')       : 'balance',
+    ('LEDGERBAL', 'DTASOF')       : 'balance_date',
+}
+
+TRANSACTION_LEAVES = {
+    'FITID'     : 'fitid',
+    'TRNTYPE'   : 'type',
+    'DTPOSTED'  : 'date',
+    'TRNAMT'    : 'amount',
+    'NAME'      : 'name',
+    'MEMO'      : 'memo',
+}
+
+def iter_statement_items(events):
+    '''
+    consume OFXParser.iter_events() without building the OFXNode tree.
+
+    yields :
+        ( stmt, transaction ) for each STMTTRN as soon as it is read. stmt is
+                              the Statement being read, its balance is not known yet.
+        ( stmt, None )        when a statement is complete.
+
+    Transactions are not stored in stmt.transaction_list so memory
+    usage does not depend on the number of transactions.
+    '''
+    stmt = None
+    st = None
+    parent_names = []
+    for event, node in events:
+        if event == OFXParser.EVENT_LEAF:
+            if st is not None:
+                if node.name in TRANSACTION_LEAVES:
+                    setattr(st, TRANSACTION_LEAVES[node.name], node.val)
+            elif stmt is not None and parent_names:
+                attr = STATEMENT_LEAVES.get((parent_names[-1], node.name))
+                if attr is not None:
+                    setattr(stmt, attr, node.val)
+        elif event == OFXParser.EVENT_START:
+            parent_names.append(node.name)
+            if node.name == 'STMTTRN' and stmt is not None:
+                st = StatementTransaction()
+            elif node.name == 'STMTTRNRS':
+                stmt = Statement('CHECKING')
+            elif node.name == 'CCSTMTTRNRS':
+                stmt = Statement('CREDIT_CARD')
+        else:
+            parent_names.pop()
+            if node.name == 'STMTTRN' and st is not None:
+                yield stmt, st
+                st = None
+            elif node.name in ('STMTTRNRS', 'CCSTMTTRNRS') and stmt is not None:
+                yield stmt, None
+                stmt = None
+
+def iter_Statement(events):
+    '''
+    same as build_Statement_tree but works on OFXParser.iter_events() and 
+    yields each Statement (with its transaction_list) as soon as it is complete.
+    '''
+    for stmt, st in iter_statement_items(events):
+        if st is None:
+            yield stmt
+        else:
+            stmt.transaction_list.append(st)
+
+
+def main(source_file, combined_file=None, output_dir=None, prefix='', **csv_options):
     """
         Takes a multi-account OFX file as input and
-        output one OFX file per account.
+        output one CSV file per account (in output_dir if supplied,
+        named after prefix, account and dates),
+        or append all accounts to combined_file if supplied.
+
+        csv_options are passed to StatementCSVWriter.
+
+        returns ( number of statements, number of transactions )
+        raises ValueError if the file could not be parsed to its end
+        (statements read before the error are written).
     """
-    f = open(source_file)
-    p = OFXParser(f.read())
-    o = p.parse()
-    
-    statement_list = build_Statement_tree(o) 
-    
-    for stmt in statement_list:
-        file_name =  'releve_compte_'+stmt.account_id.strip()+'_du_'+str(stmt.start_date.strftime("%d-%m-%Y"))+'_au_'+str(stmt.end_date.strftime("%d-%m-%Y"))+'.csv'
-        f = open(file_name,'w')
-        f.write(stmt.export_as_csv())
-        f.close()
-        
+    statements = transactions = 0
+    p = parser_for_file(source_file)
+    try:
+        if combined_file is not None:
+            # transactions are written as they are parsed
+            f = open(combined_file, 'wb')
+            writer = StatementCSVWriter(f, **csv_options)
+            for stmt, st in iter_statement_items(p.iter_events()):
+                if st is not None:
+                    writer.write_transaction(stmt, st)
+                    transactions += 1
+                else:
+                    statements += 1
+            writer.flush()
+            f.close()
+        else:
+            for stmt in iter_Statement(p.iter_events()):
+                file_name =  prefix+'releve_compte_'+stmt.account_id.strip()+'_du_'+str(stmt.start_date.strftime("%d-%m-%Y"))+'_au_'+str(stmt.end_date.strftime("%d-%m-%Y"))+'.csv'
+                if output_dir is not None:
+                    file_name = os.path.join(output_dir, file_name)
+                f = open(file_name,'wb')
+                stmt.write_csv(f, **csv_options)
+                f.close()
+                statements += 1
+                transactions += len(stmt.transaction_list)
+        if p.parse_error is not None:
+            raise ValueError, "%s : %s" % (source_file, p.parse_error)
+    finally:
+        p.close()
+    return statements, transactions
+
+
+def expand_sources(args):
+    """
+        Returns the list of OFX files designated by args.
+        An arg can be a file, a glob pattern (for shells which don't expand
+        them) or a directory (all its *.ofx files).
+        A file designated several times is listed once, at its first place.
+    """
+    sources = []
+    for arg in args:
+        if os.path.isdir(arg):
+            names = sorted(n for n in os.listdir(arg) if n.lower().endswith('.ofx'))
+            sources.extend(os.path.join(arg, n) for n in names)
+        elif os.path.exists(arg):
+            sources.append(arg)
+        else:
+            # a missing file stays in the list so that it is reported as failed
+            sources.extend(sorted(glob.glob(arg)) or [arg])
+    unique = []
+    seen = set()
+    for source_file in sources:
+        path = os.path.realpath(source_file)
+        if path not in seen:
+            seen.add(path)
+            unique.append(source_file)
+    return unique
+
+
+def source_prefixes(sources):
+    """
+        Returns the prefix of CSV file names of each of sources : the name of
+        its file, or its path from the directory common to sources if another
+        source has the same name ( 2024-01/bank.ofx gives 2024-01_bank_ ).
+        Prefixes are unique, case insensitively, a counter is added if needed.
+        A single source has no prefix.
+    """
+    if len(sources) < 2:
+        return [''] * len(sources)
+    paths = [ os.path.splitext(os.path.abspath(s))[0].split(os.sep) for s in sources ]
+    common = len(os.path.commonprefix([ p[:-1] for p in paths ]))
+    counts = {}
+    for p in paths:
+        counts[p[-1].lower()] = counts.get(p[-1].lower(), 0) + 1
+    prefixes = []
+    used = set()
+    for p in paths:
+        name = p[-1] if counts[p[-1].lower()] == 1 else '_'.join(p[common:])
+        prefix = name + '_'
+        i = 1
+        # case insensitive file systems
+        while prefix.lower() in used:
+            i += 1
+            prefix = '%s_%d_' % (name, i)
+        used.add(prefix.lower())
+        prefixes.append(prefix)
+    return prefixes
+
+
+def convert_file(task):
+    """
+        Converts one file, task is ( source_file, output_dir, prefix, csv_options ).
+        Never raises so that a malformed file does not abort a batch.
+
+        returns ( source_file, error, statements, transactions, size, seconds )
+        where error is None on success or the formatted exception
+    """
+    source_file, output_dir, prefix, csv_options = task
+    start = time.time()
+    statements = transactions = size = 0
+    error = None
+    try:
+        size = os.path.getsize(source_file)
+        statements, transactions = main(source_file, None, output_dir, prefix, **csv_options)
+    except Exception:
+        error = ''.join(traceback.format_exception_only(*sys.exc_info()[:2])).strip()
+    return source_file, error, statements, transactions, size, time.time() - start
+
+
+def convert_files(sources, jobs=None, output_dir=None, **csv_options):
+    """
+        Converts sources across jobs worker processes (one per CPU if None).
+        Yields convert_file() results as the files are done.
+
+        With several sources, CSV file names start with the name of their
+        source file (see source_prefixes), so statements of the same account
+        and period in two files don't overwrite each other.
+    """
+    tasks = [ (source_file, output_dir, prefix, csv_options)
+              for source_file, prefix in zip(sources, source_prefixes(sources)) ]
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(tasks))
+    if jobs <= 1:
+        for task in tasks:
+            yield convert_file(task)
+        return
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        # small chunks keep the workers busy when file sizes vary a lot
+        chunksize = max(1, len(tasks) // (jobs * 8))
+        for result in pool.imap_unordered(convert_file, tasks, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def print_summary(results, elapsed, out=None):
+    """
+        Prints one line per file then totals and throughput,
+        results is a list of convert_file() results.
+        returns the number of failed files
+    """
+    if out is None:
+        out = sys.stdout
+    failed = 0
+    size_total = transactions_total = 0
+    for source_file, error, statements, transactions, size, seconds in results:
+        if error is None:
+            print >> out, "OK     %s : %d statements, %d transactions, %.1f KB in %.3f s" % (
+                source_file, statements, transactions, size / 1024.0, seconds)
+            size_total += size
+            transactions_total += transactions
+        else:
+            failed += 1
+            print >> out, "FAILED %s : %s" % (source_file, error)
+    elapsed = max(elapsed, 1e-6)
+    print >> out
+    print >> out, "%d files converted, %d failed in %.2f s" % (len(results) - failed, failed, elapsed)
+    print >> out, "%.2f MB/s, %.0f transactions/s, %.1f files/s" % (
+        size_total / 1048576.0 / elapsed, transactions_total / elapsed, len(results) / elapsed)
+    return failed
+
 
 if __name__ == '__main__':
     
-    usage = "usage: %prog ofx_file"
+    usage = "usage: %prog [options] ofx_file|directory|pattern ..."
     parser = OptionParser(usage, version=__version__)
+
+    group = OptionGroup(parser, "CSV format")
+    group.add_option("-s", "--separator", dest="separator", default=";",
+                     help="field separator [default: %default]")
+    group.add_option("-d", "--decimal-separator", dest="decimal_separator", default=",",
+                     help="decimal separator of amounts [default: %default]")
+    group.add_option("-f", "--date-format", dest="date_format", default="%d/%m/%Y",
+                     help="strftime format of dates [default: %default]")
+    group.add_option("-n", "--no-header", dest="header_line", action="store_false", default=True,
+                     help="don't write a header line")
+    parser.add_option_group(group)
+    parser.add_option("-c", "--combined", dest="combined_file", metavar="CSV_FILE",
+                      help="write all accounts to CSV_FILE instead of one file per account (one ofx_file only)")
+    parser.add_option("-o", "--output-dir", dest="output_dir", metavar="DIR",
+                      help="directory of the CSV files [default: current directory]")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", metavar="N",
+                      help="number of worker processes [default: one per CPU]")
     
     (options, args) = parser.parse_args()
     
-    if not args or len(args) > 1 :
+    if not args:
         print "18ducks - OFX to CSV converter"
         print
         print "    use ./edofx2csv.py -h or --help for usage instructions."
         print
         sys.exit(0)
 
-    ret = main( args[0] )
-    sys.exit(ret)
-    
+    csv_options = dict( separator=options.separator, decimal_separator=options.decimal_separator,
+                        date_format=options.date_format, header_line=options.header_line )
+
+    if options.combined_file is not None:
+        if len(args) > 1:
+            parser.error("--combined accepts only one ofx_file")
+        main(args[0], options.combined_file, **csv_options)
+        sys.exit(0)
+
+    if options.jobs is not None and options.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    sources = expand_sources(args)
+    if not sources:
+        parser.error("no OFX file found")
+
+    start = time.time()
+    results = list(convert_files(sources, options.jobs, options.output_dir, **csv_options))
+    failed = print_summary(results, time.time() - start)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,238 @@
+# coding: utf8
+'''
+edofx_cache keeps parsed OFX trees on disk, so a file parsed by a previous
+job is reloaded from a snapshot instead of being parsed again.
+
+Snapshots are keyed by the SHA-1 of the file content and edofx.PARSER_VERSION :
+a new version of the parsers never reuses older snapshots. The cache
+directory is bounded in size, least recently used snapshots are removed
+first (use is tracked with the modification time of snapshots).
+
+    cache = OFXCache('/var/cache/edofx', max_size=512*1024*1024)
+    headers, OFX = cache.parse_file('statement.ofx')
+
+A snapshot is a marshal dump of the tree in preorder as flat lists (names,
+values and children counts), it has no nesting so deep trees are handled.
+
+'''
+import hashlib
+import logging
+import marshal
+import mmap
+import os
+import tempfile
+
+import edofx
+from edofx import OFXNode, map_file, parser_for_source
+
+# changed when the snapshot layout changes
+SNAPSHOT_FORMAT = 2
+
+
+def tree_to_snapshot(root):
+    '''
+    returns ( names, values, counts ) lists of root tree in preorder.
+    counts is the number of children of aggregates, -1 for leaves (values are
+    None for aggregates).
+    '''
+    names = []
+    values = []
+    counts = []
+    if root is None:
+        return names, values, counts
+    stack = [ [root] ]
+    while stack:
+        nodes = stack.pop()
+        while nodes:
+            node = nodes.pop()
+            names.append(node.name)
+            if node.type == OFXNode.TYPE_SELFCLOSING:
+                values.append(node.value)
+                counts.append(-1)
+            else:
+                values.append(None)
+                counts.append(len(node.children))
+                if node.children:
+                    # remaining siblings are walked once node children are done
+                    stack.append(nodes)
+                    nodes = list(reversed(node.children))
+    return names, values, counts
+
+
+def snapshot_to_tree(names, values, counts):
+    '''
+    returns the root of the tree stored by tree_to_snapshot()
+    '''
+    if not names:
+        return None
+    Node = OFXNode
+    SELFCLOSING = OFXNode.TYPE_SELFCLOSING
+    OPENING = OFXNode.TYPE_OPENING
+    root = Node(OPENING, names[0]) if counts[0] >= 0 else Node(SELFCLOSING, names[0], values[0])
+    # children lists of open aggregates and their number of children left
+    open_lists = []
+    lefts = []
+    children = root.children
+    left = counts[0]
+    for i in xrange(1, len(names)):
+        count = counts[i]
+        if count < 0:
+            children.append(Node(SELFCLOSING, names[i], values[i]))
+            left -= 1
+        else:
+            node = Node(OPENING, names[i])
+            children.append(node)
+            left -= 1
+            if count:
+                open_lists.append(children)
+                lefts.append(left)
+                children = node.children
+                left = count
+                continue
+        while not left and open_lists:
+            children = open_lists.pop()
+            left = lefts.pop()
+    return root
+
+
+class OFXCache(object):
+    '''
+    Size bounded on disk cache of parsed OFX trees
+    '''
+    SUFFIX = '.ofxsnap'
+
+    def __init__(self, directory, max_size=256*1024*1024, version=edofx.PARSER_VERSION):
+        '''
+        directory is created if needed, max_size is in bytes.
+        '''
+        self.logger = logging.getLogger('OFXCache')
+        self.directory = directory
+        self.max_size = max_size
+        self.version = '%s/%d' % (version, SNAPSHOT_FORMAT)
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, source):
+        '''
+        returns the cache key of source (a string or a memory map)
+        '''
+        digest = hashlib.sha1(self.version)
+        digest.update(source)
+        return digest.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def load(self, key):
+        '''
+        returns ( headers, tree ) stored for key or None
+        '''
+        path = self.__path(key)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                version, headers, names, values, counts = marshal.load(f)
+            except (EOFError, ValueError, TypeError):
+                self.logger.warning("Invalid snapshot %s removed", path)
+                version = None
+        finally:
+            f.close()
+        if version <> self.version:
+            self.__remove(path)
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return headers, snapshot_to_tree(names, values, counts)
+
+    def store(self, key, headers, tree):
+        '''
+        stores ( headers, tree ) for key, then evicts least recently used snapshots
+        '''
+        fd, tmp_path = tempfile.mkstemp(self.SUFFIX + '.tmp', '', self.directory)
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                marshal.dump( (self.version, headers) + tree_to_snapshot(tree), f, 2)
+            finally:
+                f.close()
+            os.rename(tmp_path, self.__path(key))
+        except:
+            self.__remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        '''
+        removes least recently used snapshots until cache size is below max_size
+        '''
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append( (st.st_mtime, st.st_size, path) )
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            self.__remove(path)
+            total -= size
+
+    def clear(self):
+        '''
+        removes all snapshots
+        '''
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX):
+                self.__remove(os.path.join(self.directory, name))
+
+    def __remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def parse(self, source):
+        '''
+        returns ( headers, tree ) of OFX source string, from cache if possible.
+        OFX 2.x (XML) sources are parsed with OFXXMLParser.
+        raises ValueError if source could not be parsed to its end, nothing is stored.
+        '''
+        key = self.key(source)
+        cached = self.load(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        parser = parser_for_source(source)
+        tree = parser.parse()
+        headers = parser.OFX_headers
+        parser.close()
+        if parser.parse_error is not None:
+            raise ValueError, parser.parse_error
+        self.store(key, headers, tree)
+        return headers, tree
+
+    def parse_file(self, path):
+        '''
+        returns ( headers, tree ) of the OFX file at path, from cache if possible.
+        '''
+        source = map_file(path)
+        try:
+            return self.parse(source)
+        finally:
+            if isinstance(source, mmap.mmap):
+                source.close()
@@ -0,0 +1,195 @@
+# coding: utf8
+'''
+edofx_columns extracts the transactions of an OFX file as columns instead
+of one Python object per STMTTRN, so that aggregations (balances, sums by
+type, monthly totals) run on whole vectors.
+
+Columns are NumPy arrays when NumPy is installed, array.array otherwise.
+
+    table = TransactionTable.from_file('statement.ofx')
+    table.balance_by_account()
+    table.monthly_totals()
+
+'''
+from array import array
+from datetime import date
+
+from edofx import OFXParser, parser_for_file
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# dates are stored as a number of days since EPOCH
+EPOCH = date(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+
+# ( aggregate, statement type ) of statements
+STATEMENT_AGGREGATES = {
+    'STMTTRNRS'   : 'CHECKING',
+    'CCSTMTTRNRS' : 'CREDIT_CARD',
+}
+
+
+class TransactionTable(object):
+    '''
+    Transactions of one or several statements stored as columns.
+
+    Numeric columns (one item per transaction) :
+        account      : code of the account, index in accounts
+        type         : code of TRNTYPE, index in types
+        date         : DTPOSTED as a number of days since 1970-01-01 (int64)
+        amount       : TRNAMT (float64)
+        amount_cents : TRNAMT in cents (int64), exact for reconciliation
+
+    String columns (lists) :
+        fitid, name, memo
+
+    Categories :
+        accounts     : list of ( statement type, account id )
+        types        : list of transaction types
+    '''
+    def __init__(self):
+        self.accounts     = []
+        self.types        = []
+        self.account      = array('l')
+        self.type         = array('l')
+        self.date         = array('l')
+        self.amount       = array('d')
+        self.amount_cents = array('l')
+        self.fitid        = []
+        self.name         = []
+        self.memo         = []
+
+    def __len__(self):
+        return len(self.amount)
+
+    @classmethod
+    def from_events(cls, events):
+        '''
+        Builds a table from OFXParser.iter_events() (the OFXNode tree is not built)
+        '''
+        table = cls()
+        account_codes = {}
+        type_codes = {}
+        statement_type = None
+        account_id = ''
+        account_code = None
+        in_transaction = False
+        trn = {}
+
+        for event, node in events:
+            if event == OFXParser.EVENT_LEAF:
+                if in_transaction:
+                    trn[node.name] = node
+                elif statement_type is not None and node.name == 'ACCTID':
+                    account_id = node.value
+            elif event == OFXParser.EVENT_START:
+                if node.name == 'STMTTRN':
+                    in_transaction = True
+                    trn.clear()
+                elif node.name in STATEMENT_AGGREGATES:
+                    statement_type = STATEMENT_AGGREGATES[node.name]
+                    account_id = ''
+                    account_code = None
+            elif node.name == 'STMTTRN' and in_transaction:
+                in_transaction = False
+                if account_code is None:
+                    # ACCTID comes before BANKTRANLIST
+                    key = (statement_type, account_id.strip())
+                    account_code = account_codes.get(key)
+                    if account_code is None:
+                        account_code = account_codes[key] = len(table.accounts)
+                        table.accounts.append(key)
+                table.__append(account_code, trn, type_codes)
+            elif node.name in STATEMENT_AGGREGATES:
+                statement_type = None
+
+        if numpy is not None:
+            table.__to_numpy()
+        return table
+
+    @classmethod
+    def from_file(cls, path):
+        '''
+        Builds a table from the OFX file at path
+        '''
+        parser = parser_for_file(path)
+        try:
+            return cls.from_events(parser.iter_events())
+        finally:
+            parser.close()
+
+    def __append(self, account_code, trn, type_codes):
+        trntype = trn['TRNTYPE'].value if 'TRNTYPE' in trn else ''
+        type_code = type_codes.get(trntype)
+        if type_code is None:
+            type_code = type_codes[trntype] = len(self.types)
+            self.types.append(trntype)
+
+        amount = trn['TRNAMT'].val if 'TRNAMT' in trn else 0.0
+        self.account.append(account_code)
+        self.type.append(type_code)
+        self.date.append(trn['DTPOSTED'].val.toordinal() - EPOCH_ORDINAL if 'DTPOSTED' in trn else 0)
+        self.amount.append(amount)
+        self.amount_cents.append(int(round(amount*100)))
+        self.fitid.append(trn['FITID'].value if 'FITID' in trn else '')
+        self.name.append(trn['NAME'].value if 'NAME' in trn else '')
+        self.memo.append(trn['MEMO'].value if 'MEMO' in trn else '')
+
+    def __to_numpy(self):
+        self.account      = numpy.array(self.account, dtype=numpy.int64)
+        self.type         = numpy.array(self.type, dtype=numpy.int64)
+        self.date         = numpy.array(self.date, dtype=numpy.int64)
+        self.amount       = numpy.array(self.amount, dtype=numpy.float64)
+        self.amount_cents = numpy.array(self.amount_cents, dtype=numpy.int64)
+
+    def dates(self):
+        '''
+        returns date column as a list of date
+        '''
+        return [ date.fromordinal(d + EPOCH_ORDINAL) for d in self.date ]
+
+    def __sum_cents_by(self, codes, count):
+        '''
+        returns a list of amount_cents sums, one per code in range(count)
+        '''
+        if numpy is not None:
+            return [ int(x) for x in numpy.bincount(codes, weights=self.amount_cents, minlength=count) ]
+        sums = [0] * count
+        for code, cents in zip(codes, self.amount_cents):
+            sums[code] += cents
+        return sums
+
+    def balance_by_account(self):
+        '''
+        returns { ( statement type, account id ) : sum of amounts in cents }
+        '''
+        return dict(zip(self.accounts, self.__sum_cents_by(self.account, len(self.accounts))))
+
+    def sum_by_type(self):
+        '''
+        returns { transaction type : sum of amounts in cents }
+        '''
+        return dict(zip(self.types, self.__sum_cents_by(self.type, len(self.types))))
+
+    def monthly_totals(self):
+        '''
+        returns { ( year, month ) : sum of amounts in cents }
+        '''
+        if not len(self):
+            return {}
+        if numpy is not None:
+            months = self.date.astype('datetime64[D]').astype('datetime64[M]').astype(numpy.int64)
+            first = int(months.min())
+            count = int(months.max()) - first + 1
+            sums = self.__sum_cents_by(months - first, count)
+            used = numpy.bincount(months - first, minlength=count)
+            return dict( ( (1970 + (first+i) // 12, (first+i) % 12 + 1), sums[i] )
+                         for i in range(count) if used[i] )
+        totals = {}
+        for d, cents in zip(self.dates(), self.amount_cents):
+            key = (d.year, d.month)
+            totals[key] = totals.get(key, 0) + cents
+        return totals
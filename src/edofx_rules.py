@@ -0,0 +1,224 @@
+# coding: utf8
+'''
+edofx_rules rewrites transactions (STMTTRN) with declarative rules loaded
+from an INI file, to fix bank specific oddities while the file is parsed.
+
+Each section is a rule, rules are applied in file order :
+
+    [card_payment]
+    # conditions, all must be true (none : rule applies to all transactions)
+    when.TRNTYPE = PAIEMENT PAR CARTE
+    match.NAME   = ^\s*(?P<name>.*?)\s*(?P<date>.{5})$
+    within       = BANKMSGSRSV1
+    # rewrites
+    set.NAME     = {name}
+    set.MEMO     = "Operation du {date}"
+
+    when.FIELD  : value of FIELD equals (missing fields are '')
+    match.FIELD : value of FIELD matches the regular expression (re.search),
+                  named groups can be used in set templates
+    within      : space separated names, one must be an ancestor of STMTTRN
+    set.FIELD   : new value of FIELD (created if missing), a str.format template
+                  of transaction values ({MEMO}) and named groups ({date}).
+                  Missing fields are '', names that are neither STMTTRN fields
+                  (see Rule.FIELDS and fields of the rule) nor named groups
+                  are rejected when the rule is compiled.
+                  Double quotes around a value are removed (to keep spaces).
+
+Rules are compiled once : regular expressions are precompiled and rules with
+a when.TRNTYPE condition are found with a dict lookup on TRNTYPE.
+
+    rules = RuleSet.from_file('credit_agricole.ini')
+    parser = OFXParser.from_file('statement.ofx', handlers=rules.handlers())
+    OFX = parser.parse()        # transactions are rewritten as they are parsed
+
+'''
+import re
+import string
+import ConfigParser
+
+from edofx import OFXNode
+
+
+class FieldValues(dict):
+    '''
+    { field : value } of a transaction, missing fields are ''
+    '''
+    def __missing__(self, field):
+        return ''
+
+
+class Rule(object):
+    '''
+    A compiled rule
+    '''
+    # aggregates and elements of STMTTRN (OFX 2.1.1 specification)
+    FIELDS = frozenset(( 'TRNTYPE', 'DTPOSTED', 'DTUSER', 'DTAVAIL', 'TRNAMT', 'FITID', 'CORRECTFITID',
+                         'CORRECTACTION', 'SRVRTID', 'CHECKNUM', 'REFNUM', 'SIC', 'PAYEEID', 'NAME',
+                         'EXTDNAME', 'PAYEE', 'BANKACCTTO', 'CCACCTTO', 'MEMO', 'IMAGEDATA', 'CURRENCY',
+                         'ORIGCURRENCY', 'INV401KSOURCE' ))
+
+    FORMATTER = string.Formatter()
+
+    def __init__(self, name, when=None, match=None, within=None, set=None):
+        '''
+        when   : { field : value }
+        match  : { field : regular expression }
+        within : names of aggregates
+        set    : { field : template }
+        '''
+        self.name = name
+        when = dict(when or {})
+        # names usable in templates ('set' argument hides the builtin)
+        names = list(self.FIELDS) + when.keys() + (match or {}).keys() + (set or {}).keys()
+        self.trntype = when.pop('TRNTYPE', None)
+        self.when = when.items()
+        self.match = []
+        for field, pattern in sorted((match or {}).items()):
+            try:
+                regex = re.compile(pattern)
+            except re.error, e:
+                raise ValueError, "rule [%s] : invalid regular expression for %s (%s)" % (name, field, e)
+            self.match.append( (field, regex) )
+            names.extend(regex.groupindex)
+        self.within = frozenset(within or ())
+        self.set = []
+        for field, template in sorted((set or {}).items()):
+            # constant values are not formatted
+            formatted = '{' in template or '}' in template
+            if formatted:
+                self.__check_template(field, template, names)
+            self.set.append( (field, template, formatted) )
+        self.sets_trntype = 'TRNTYPE' in (set or {})
+
+    def __check_template(self, field, template, names):
+        try:
+            references = [ r for literal, r, spec, conversion in self.FORMATTER.parse(template) if r is not None ]
+        except ValueError, e:
+            raise ValueError, "rule [%s] : invalid %s template (%s)" % (self.name, field, e)
+        for reference in references:
+            # {NAME.attribute} and {NAME[index]} refer to NAME
+            reference = re.split(r'[.\[]', reference, 1)[0]
+            if reference not in names:
+                raise ValueError, "rule [%s] : unknown name in %s template ('%s')" % (self.name, field, reference)
+
+    def apply(self, values, ancestors):
+        '''
+        Returns { field : new value } if rule matches values ({ field : value }), None otherwise
+        '''
+        if self.within and not [ a for a in ancestors if a.name in self.within ]:
+            return None
+        for field, value in self.when:
+            if values.get(field, '') <> value:
+                return None
+        groups = None
+        for field, regex in self.match:
+            m = regex.search(values.get(field, ''))
+            if m is None:
+                return None
+            if groups is None:
+                groups = FieldValues(values)
+            groups.update(m.groupdict())
+
+        result = {}
+        for field, template, formatted in self.set:
+            if formatted:
+                if groups is None:
+                    groups = FieldValues(values)
+                result[field] = self.FORMATTER.vformat(template, (), groups)
+            else:
+                result[field] = template
+        return result
+
+
+class RuleSet(object):
+    '''
+    Ordered rules applied to STMTTRN aggregates.
+
+    Rules are grouped in stages : a stage ends with a rule setting TRNTYPE,
+    TRNTYPE is constant in a stage so the rules of a transaction are found
+    with one dict lookup per stage.
+    '''
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        # [ ( { TRNTYPE : [ rules ] }, [ rules without TRNTYPE condition ] ) ]
+        self.__stages = []
+        stage = []
+        for rule in self.rules:
+            stage.append(rule)
+            if rule.sets_trntype:
+                self.__add_stage(stage)
+                stage = []
+        if stage:
+            self.__add_stage(stage)
+
+    def __add_stage(self, rules):
+        generic = [ r for r in rules if r.trntype is None ]
+        by_type = {}
+        for trntype in set(r.trntype for r in rules if r.trntype is not None):
+            by_type[trntype] = [ r for r in rules if r.trntype in (None, trntype) ]
+        self.__stages.append( (by_type, generic) )
+
+    @classmethod
+    def from_config(cls, config):
+        '''
+        Compiles rules of a RawConfigParser, one rule per section
+        '''
+        rules = []
+        for section in config.sections():
+            options = { 'when' : {}, 'match' : {}, 'set' : {} }
+            within = None
+            for option, value in config.items(section):
+                if len(value) > 1 and value[0] == value[-1] == '"':
+                    value = value[1:-1]
+                if option == 'within':
+                    within = value.split()
+                    continue
+                kind, _, field = option.partition('.')
+                if kind not in options or not field:
+                    raise ValueError, "rule [%s] : unknown option '%s'" % (section, option)
+                options[kind][field] = value
+            rules.append(Rule(section, within=within, **options))
+        return cls(rules)
+
+    @classmethod
+    def from_file(cls, path):
+        '''
+        Compiles rules of the INI file at path
+        '''
+        config = ConfigParser.RawConfigParser()
+        config.optionxform = str        # field names are case sensitive
+        if not config.read(path):
+            raise IOError, "can't read rules file '%s'" % path
+        return cls.from_config(config)
+
+    def apply(self, stmttrn, ancestors=()):
+        '''
+        Rewrites the leaves of the STMTTRN node stmttrn.
+        ancestors are the nodes containing stmttrn, root first.
+        '''
+        leaves = {}
+        for c in stmttrn.children:
+            if c.type == OFXNode.TYPE_SELFCLOSING:
+                leaves[c.name] = c
+        values = dict( (name, leaf.value) for name, leaf in leaves.iteritems() )
+
+        for by_type, generic in self.__stages:
+            for rule in by_type.get(values.get('TRNTYPE', ''), generic):
+                result = rule.apply(values, ancestors)
+                if result:
+                    values.update(result)
+
+        for name, value in values.iteritems():
+            leaf = leaves.get(name)
+            if leaf is None:
+                leaf = OFXNode(OFXNode.TYPE_SELFCLOSING, name, value)
+                stmttrn.append_child(leaf)
+            elif leaf.value <> value:
+                leaf.value = value
+
+    def handlers(self):
+        '''
+        returns OFXParser handlers applying rules as transactions are parsed
+        '''
+        return { 'STMTTRN' : self.apply }
@@ -19,65 +19,298 @@ import sys
 
 import os
 import ConfigParser
-from edofx import OFXParser
+from datetime import date
+from edofx import OFXNode, parser_for_file, ofx_encoding
+from edofx_rules import RuleSet
 
 from optparse import OptionParser, OptionGroup
 
 __version__ = "ofxplode.py v0.1 - april 2010" 
 
-def main(source_file):
+# fix-ups of Credit Agricole files, applied unless --raw
+DEFAULT_RULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules', 'credit_agricole.ini')
+
+# message set : ( statement response, statement, account ) aggregates
+STATEMENT_AGGREGATES = {
+    'BANKMSGSRSV1'       : ('STMTTRNRS', 'STMTRS', 'BANKACCTFROM'),
+    'CREDITCARDMSGSRSV1' : ('CCSTMTTRNRS', 'CCSTMTRS', 'CCACCTFROM'),
+}
+
+# message set : prefix of file names, a bank account and a card may have the same ACCTID
+FILE_PREFIXES = {
+    'BANKMSGSRSV1'       : 'compte_',
+    'CREDITCARDMSGSRSV1' : 'cc_compte_',
+}
+
+# OFX 1.x headers are written in this order, unknown headers after them
+HEADERS_ORDER = ( 'OFXHEADER', 'DATA', 'VERSION', 'SECURITY', 'ENCODING', 'CHARSET',
+                  'COMPRESSION', 'OLDFILEUID', 'NEWFILEUID' )
+
+# OFX 1.x headers of documents split from OFX 2.x (XML) sources, see sgml_headers()
+SGML_HEADERS = {
+    'OFXHEADER'   : '100',
+    'DATA'        : 'OFXSGML',
+    'VERSION'     : '102',
+    'SECURITY'    : 'NONE',
+    'ENCODING'    : 'USASCII',
+    'CHARSET'     : 'NONE',
+    'COMPRESSION' : 'NONE',
+    'OLDFILEUID'  : 'NONE',
+    'NEWFILEUID'  : 'NONE',
+}
+
+# split periods : function returning the ( first day, last day ) of the period of a date
+def _month(d):
+    if d.month == 12:
+        return date(d.year, 12, 1), date(d.year, 12, 31)
+    return date(d.year, d.month, 1), date.fromordinal(date(d.year, d.month+1, 1).toordinal()-1)
+
+def _quarter(d):
+    first_month = (d.month-1) // 3 * 3 + 1
+    last = _month(date(d.year, first_month+2, 1))[1]
+    return date(d.year, first_month, 1), last
+
+def _year(d):
+    return date(d.year, 1, 1), date(d.year, 12, 31)
+
+PERIODS = {
+    'month'   : _month,
+    'quarter' : _quarter,
+    'year'    : _year,
+}
+
+
+def sgml_headers(headers):
+    """
+        returns the OFX 1.x headers of an OFX 2.x (XML) headers dict :
+        SECURITY and file UIDs are kept, ENCODING and CHARSET give the
+        encoding of the XML source, which is the encoding of node values.
+    """
+    sgml = dict(SGML_HEADERS)
+    for name in ('SECURITY', 'OLDFILEUID', 'NEWFILEUID'):
+        if name in headers:
+            sgml[name] = headers[name]
+    encoding = ofx_encoding(headers) or headers['encoding']
+    if encoding == 'utf-8':
+        sgml['ENCODING'] = 'UTF-8'
+    elif encoding.startswith('cp') and encoding[2:].isdigit():
+        sgml['CHARSET'] = encoding[2:]
+    elif encoding == 'iso8859-1':
+        sgml['CHARSET'] = 'ISO-8859-1'
+    elif encoding <> 'ascii':
+        sgml['CHARSET'] = encoding
+    return sgml
+
+
+def headers_repr(headers):
+    """
+        returns OFX headers dict as an OFX header block,
+        OFX 2.x headers are written as OFX 1.x ones (see sgml_headers)
+    """
+    if not headers:
+        return ''
+    if headers.get('OFXHEADER', '')[:1] == '2' or 'encoding' in headers:
+        headers = sgml_headers(headers)
+    names = [ h for h in HEADERS_ORDER if h in headers ]
+    names.extend(sorted(h for h in headers if h not in HEADERS_ORDER))
+    return ''.join('%s:%s\n' % (h, headers[h]) for h in names)
+
+
+def _aggregate(node, children):
+    """
+        returns a copy of aggregate node with children.
+        children are not reparented so the source tree is left unmodified.
+    """
+    copy = OFXNode(node.type, node.name)
+    copy.children = children
+    return copy
+
+
+def _leaf(node, value):
+    return OFXNode(OFXNode.TYPE_SELFCLOSING, node.name, value)
+
+
+class OFXSplitter(object):
+    """
+        Splits an OFX tree into one document per statement of bank
+        (STMTTRNRS) or credit card (CCSTMTTRNRS) account.
+
+        The shared envelope (headers, SIGNONMSGSRSV1, ...) is serialized
+        once, each statement is serialized once per output format : the
+        cost is proportional to the size of the source, not to
+        accounts x size. The source tree is not modified.
+
+        With a period ('month', 'quarter' or 'year'), each statement is
+        split into one document per period, holding the transactions
+        posted during the period. DTSTART and DTEND are bounded by the
+        period, other statement values (LEDGERBAL, ...) are kept as is.
+    """
+    def __init__(self, ofx, headers=None, period=None):
+        if period is not None and period not in PERIODS:
+            raise ValueError, "Unknown period '%s', use one of %s" % (period, ', '.join(sorted(PERIODS)))
+        self.ofx = ofx
+        self.period = period
+
+        header_block = headers_repr(headers)
+        # message set name : ( OFX before, OFX after, XML before, XML after ) the statement
+        self.__envelopes = {}
+        for i, msgset in enumerate(ofx.children):
+            if msgset.name not in STATEMENT_AGGREGATES or msgset.name in self.__envelopes:
+                continue
+            before = [ c for c in ofx.children[:i] if c.name not in STATEMENT_AGGREGATES ]
+            after = [ c for c in ofx.children[i+1:] if c.name not in STATEMENT_AGGREGATES ]
+            statement_name = STATEMENT_AGGREGATES[msgset.name][0]
+            others = [ c for c in msgset.children if c.name <> statement_name ]
+            self.__envelopes[msgset.name] = (
+                header_block + '<%s>\n' % ofx.name + ''.join(c.ofx_repr() for c in before) +
+                '<%s>\n' % msgset.name + ''.join(c.ofx_repr() for c in others),
+                '</%s>\n' % msgset.name + ''.join(c.ofx_repr() for c in after) + '</%s>\n' % ofx.name,
+                '<%s>\n' % ofx.name + ''.join(c.xml_repr('    ') for c in before) +
+                '    <%s>\n' % msgset.name + ''.join(c.xml_repr('        ') for c in others),
+                '    </%s>\n' % msgset.name + ''.join(c.xml_repr('    ') for c in after) + '</%s>\n' % ofx.name,
+            )
+
+    def iter_statements(self):
+        """
+            yields ( message set name, statement response node ) for each statement
+        """
+        for msgset in self.ofx.children:
+            if msgset.name in STATEMENT_AGGREGATES:
+                statement_name = STATEMENT_AGGREGATES[msgset.name][0]
+                for c in msgset.children:
+                    if c.name == statement_name:
+                        yield msgset.name, c
+
+    def iter_documents(self):
+        """
+            yields ( message set name, account id, DTSTART value, DTEND value, statement response node )
+            for each document, statement response node is a copy when split by period.
+        """
+        for msgset_name, stmttrnrs in self.iter_statements():
+            stmt_name, account_name = STATEMENT_AGGREGATES[msgset_name][1:]
+            stmtrs = getattr(stmttrnrs, stmt_name)
+            account_id = getattr(stmtrs, account_name).ACCTID.val.strip()
+            tranlist = stmtrs.BANKTRANLIST
+            if self.period is None:
+                yield msgset_name, account_id, tranlist.DTSTART.value, tranlist.DTEND.value, stmttrnrs
+                continue
+            for dtstart, dtend, period_tranlist in self.__split_tranlist(tranlist):
+                period_stmtrs = _aggregate(stmtrs, [ period_tranlist if c is tranlist else c for c in stmtrs.children ])
+                period_stmttrnrs = _aggregate(stmttrnrs, [ period_stmtrs if c is stmtrs else c for c in stmttrnrs.children ])
+                yield msgset_name, account_id, dtstart, dtend, period_stmttrnrs
+
+    def __split_tranlist(self, tranlist):
+        """
+            yields ( DTSTART value, DTEND value, BANKTRANLIST copy ) for each period
+            between DTSTART and DTEND of tranlist
+        """
+        period_of = PERIODS[self.period]
+        start, end = tranlist.DTSTART.val, tranlist.DTEND.val
+        transactions = {}
+        for c in tranlist.children:
+            if c.name == 'STMTTRN':
+                try:
+                    posted = c.DTPOSTED.val
+                except AttributeError:
+                    posted = start
+                transactions.setdefault(period_of(posted), []).append(c)
+
+        periods = set(transactions)
+        day = start
+        while day <= end:
+            first, last = period_of(day)
+            periods.add( (first, last) )
+            day = date.fromordinal(last.toordinal()+1)
+
+        for first, last in sorted(periods):
+            dtstart = tranlist.DTSTART.value if first <= start <= last else first.strftime('%Y%m%d')
+            dtend = tranlist.DTEND.value if first <= end <= last else last.strftime('%Y%m%d')
+            children = []
+            for c in tranlist.children:
+                if c.name == 'DTSTART':
+                    children.append(_leaf(c, dtstart))
+                elif c.name == 'DTEND':
+                    children.append(_leaf(c, dtend))
+                elif c.name <> 'STMTTRN':
+                    children.append(c)
+            children.extend(transactions.get( (first, last), [] ))
+            yield dtstart, dtend, _aggregate(tranlist, children)
+
+    def write_ofx(self, fp, msgset_name, stmttrnrs):
+        """
+            Writes the OFX document of the statement stmttrnrs of msgset_name to fp
+        """
+        before, after = self.__envelopes[msgset_name][:2]
+        fp.write(before)
+        stmttrnrs.write_ofx(fp)
+        fp.write(after)
+
+    def write_xml(self, fp, msgset_name, stmttrnrs):
+        """
+            Writes the XML document of the statement stmttrnrs of msgset_name to fp
+        """
+        before, after = self.__envelopes[msgset_name][2:]
+        fp.write(before)
+        stmttrnrs.write_xml(fp, '        ')
+        fp.write(after)
+
+
+def main(source_file, output_dir=None, period=None, headers=True, rules=None):
     """
         Takes a multi-account OFX file as input and
-        output one OFX file per account.
+        output one OFX and one XML file per account (and per period if supplied),
+        named compte_<ACCTID>_from_<DTSTART>_to_<DTEND> for bank accounts and
+        cc_compte_... for credit cards.
+
+        rules is an edofx_rules.RuleSet applied to transactions while parsing.
+
+        returns the list of written file names
+        raises ValueError if the file could not be parsed to its end, no file is written.
     """
-    f = open(source_file)
-    p = OFXParser(f.read())
-    o = p.parse()
-    
-    # on vire les infos sur les cartes de crédits
+    p = parser_for_file(source_file, handlers=rules.handlers() if rules is not None else None)
     try:
-        del o.CREDITCARDMSGSRSV1
-    except:
-        pass    
-    
-    # first we backup all account information
-    account_list = list() 
-    for e in o.BANKMSGSRSV1.STMTTRNRS:
-        account_list.append(e)
-
-    # we wipe all accounts
-    del o.BANKMSGSRSV1.STMTTRNRS
- 
-    for e in account_list:
-        o.BANKMSGSRSV1.children.append(e)
-        for t in o.BANKMSGSRSV1.STMTTRNRS.STMTRS.BANKTRANLIST.STMTTRN:
-            t.TRNTYPE.value = t.MEMO.value # update transaction type
-            t.MEMO.value = ''
-            if t.TRNTYPE.value == 'PAIEMENT PAR CARTE' :
-                t.MEMO.value = "Operation du %s" % (t.NAME.value[-5:],)
-                t.NAME.value = t.NAME.value[:-5].lstrip().rstrip() 
-            elif t.TRNTYPE.value == 'REMBOURSEMENT DE PRET' :
-                t.MEMO.value = "Echeance du %s " % (t.NAME.value[-8:],)
-                t.NAME.value = t.NAME.value[:-8].lstrip().rstrip() 
-                
-            
-        
-        fofx = open('compte_%s_from_%s_to_%s.ofx' %  (e.STMTRS.BANKACCTFROM.ACCTID.val, e.STMTRS.BANKTRANLIST.DTSTART.value[:8], e.STMTRS.BANKTRANLIST.DTEND.value[:8] ),'w')
-        fofx.write(o.ofx_repr())
-        fofx.close()
-        
-        fxml = open('compte_%s_from_%s_to_%s.xml' %  (e.STMTRS.BANKACCTFROM.ACCTID.val, e.STMTRS.BANKTRANLIST.DTSTART.value[:8], e.STMTRS.BANKTRANLIST.DTEND.value[:8] ),'w')
-        fxml.write(o.xml_repr())
-        fxml.close()
+        o = p.parse()
+        if p.parse_error is not None:
+            raise ValueError, "%s : %s" % (source_file, p.parse_error)
+        splitter = OFXSplitter(o, p.OFX_headers if headers else None, period)
+    finally:
+        p.close()
+
+    written = []
+    for msgset_name, account_id, dtstart, dtend, stmttrnrs in splitter.iter_documents():
+        file_name = '%s%s_from_%s_to_%s' % (FILE_PREFIXES[msgset_name], account_id, dtstart[:8], dtend[:8])
+        if output_dir is not None:
+            file_name = os.path.join(output_dir, file_name)
 
-        del o.BANKMSGSRSV1.STMTTRNRS
+        fofx = open(file_name+'.ofx', 'w')
+        try:
+            splitter.write_ofx(fofx, msgset_name, stmttrnrs)
+        finally:
+            fofx.close()
+
+        fxml = open(file_name+'.xml', 'w')
+        try:
+            splitter.write_xml(fxml, msgset_name, stmttrnrs)
+        finally:
+            fxml.close()
+        written.extend( (file_name+'.ofx', file_name+'.xml') )
+    return written
         
 
 if __name__ == '__main__':
-    # TODO:  add an option for CA files
     
-    usage = "usage: %prog ofx_source_filename"
+    usage = "usage: %prog [options] ofx_source_filename"
     parser = OptionParser(usage, version=__version__)
+    parser.add_option("-o", "--output-dir", dest="output_dir", metavar="DIR",
+                      help="directory of the output files [default: current directory]")
+    parser.add_option("-p", "--period", dest="period", type="choice", choices=sorted(PERIODS),
+                      help="split statements by period : %s" % ', '.join(sorted(PERIODS)))
+    parser.add_option("-H", "--no-headers", dest="headers", action="store_false", default=True,
+                      help="don't copy OFX headers to output OFX files")
+    parser.add_option("-R", "--rules", dest="rules", metavar="INI_FILE", default=DEFAULT_RULES,
+                      help="transaction rewrite rules [default: Credit Agricole fix-ups]")
+    parser.add_option("-r", "--raw", dest="rules", action="store_const", const=None,
+                      help="don't rewrite transactions")
     
     (options, args) = parser.parse_args()
     
@@ -88,6 +321,8 @@ if __name__ == '__main__':
         print
         sys.exit(0)
 
-    ret = main( args[0] )
-    sys.exit(ret)
-    
+    rules = None
+    if options.rules is not None:
+        rules = RuleSet.from_file(options.rules)
+    main( args[0], options.output_dir, options.period, options.headers, rules )
+    sys.exit(0)
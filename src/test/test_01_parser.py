@@ -9,19 +9,22 @@ import logging
 import sys
 import os
 
-from edofx import OFXParser, OFXNode
+from edofx import OFXParser, OFXNode, OFXIncrementalParser, OFXXMLParser, OFXLazyParser, probe_ofx_file, parser_for_file
 from edofx_integration import render_as_DOT
+from edofx2csv import build_Statement_tree, iter_Statement
 
 
 class TestLoggingHandler(logging.Handler):
     def __init__(self):
         logging.Handler.__init__(self)
         self.messages_list = list()
+        self.args_list = list()
         self.last_message=''
         
     def emit(self, record):
         self.last_message = record.msg
         self.messages_list.append(record.msg)
+        self.args_list.append(record.args)
 
 class AcceptanceTests(unittest.TestCase):
 
@@ -131,6 +134,312 @@ class AcceptanceTests(unittest.TestCase):
         self.assertTrue( OFX.BANKMSGSRSV1.STMTTRNRS.TRNUID.val == '41425367824' )
 
 
+    def test_10_fast_and_char_tokenizers_agree(self):
+        """
+        Both tokenizers must return the same tags and line numbers
+        """
+        sources = [ open(self.path+f).read() for f in ('real_file_no_headers.ofx',
+                                                       'real_file_with_headers.ofx',
+                                                       'multi_account_file.ofx',
+                                                       'selfclosing_tag.ofx') ]
+        sources += [ '<A>\n<B>x\n</A>', '<A>\n</B>val\n<C>\n', '<a1 2>v\n<B>\n', '<A>\n<B>x' ]
+        for source in sources:
+            tokens = {}
+            for tokenizer in (OFXParser.TOKENIZER_CHAR, OFXParser.TOKENIZER_FAST):
+                parser = OFXParser(source, tokenizer=tokenizer)
+                parser.parse_headers()
+                tokens[tokenizer] = []
+                tag = parser._OFXParser__read_tag()
+                while tag is not None:
+                    tokens[tokenizer].append((tag.type, tag.name, tag.value, parser.current_line_number))
+                    tag = parser._OFXParser__read_tag()
+            self.assertEqual(tokens[OFXParser.TOKENIZER_CHAR], tokens[OFXParser.TOKENIZER_FAST])
+
+    def test_11_fast_and_char_trees_agree(self):
+        """
+        Both tokenizers must build the same OFXNode tree
+        """
+        source = open(self.path+'multi_account_file.ofx').read()
+        char_tree = OFXParser(source, tokenizer=OFXParser.TOKENIZER_CHAR).parse()
+        fast_tree = OFXParser(source, tokenizer=OFXParser.TOKENIZER_FAST).parse()
+        self.assertEqual(char_tree.ofx_repr(), fast_tree.ofx_repr())
+
+    def test_12_unknown_tokenizer(self):
+        self.assertRaises(ValueError, OFXParser, '<OFX>\n</OFX>\n', tokenizer='nope')
+
+    def test_13_parse_as_events(self):
+        """
+        Events must describe the same structure as the tree
+        """
+        source = open(self.path+'real_file_with_headers.ofx').read()
+        events = list(OFXParser(source).iter_events())
+        self.assertEqual(events[0][0], OFXParser.EVENT_START)
+        self.assertEqual(events[0][1].name, 'OFX')
+        self.assertEqual(events[-1], (OFXParser.EVENT_END, events[0][1]))
+        self.assertEqual(events[0][1].children, [])
+
+        # rebuild a tree from events and compare it with parse() result
+        stack = [OFXNode()]
+        for event, node in events:
+            if event == OFXParser.EVENT_END:
+                stack.pop()
+            else:
+                stack[-1].children.append(node)
+                if event == OFXParser.EVENT_START:
+                    stack.append(node)
+        tree = OFXParser(source).parse()
+        self.assertEqual(stack[0].children[0].ofx_repr(), tree.ofx_repr())
+
+    def test_14_statements_from_events(self):
+        """
+        iter_Statement on events and build_Statement_tree on tree must agree
+        """
+        source = open(self.path+'multi_account_file.ofx').read()
+        from_tree = build_Statement_tree(OFXParser(source).parse())
+        from_events = list(iter_Statement(OFXParser(source).iter_events()))
+        self.assertEqual(len(from_tree), len(from_events))
+        for s1, s2 in zip(from_tree, from_events):
+            self.assertEqual(s1.export_as_csv(), s2.export_as_csv())
+            self.assertEqual((s1.type, s1.currency, s1.balance, s1.balance_date),
+                             (s2.type, s2.currency, s2.balance, s2.balance_date))
+
+    def test_15_parse_deeply_nested_source(self):
+        """
+        Tree building must not depend on recursion limit
+        """
+        depth = sys.getrecursionlimit() * 2
+        source = ''.join('<A%s>\n' % ('B'*(i%3)) for i in range(depth))
+        source += '<CODE>0\n'
+        source += ''.join('</A%s>\n' % ('B'*(i%3)) for i in reversed(range(depth)))
+        node = OFXParser(source).parse()
+        for i in range(depth):
+            node = node.children[0]
+        self.assertEqual(node.value, '0')
+
+    def test_16_parse_malformed_sources(self):
+        """
+        Mismatched closing tags and EOF are recovered from
+        """
+        # closing tag of an ancestor closes inner aggregates
+        OFX = OFXParser('<OFX>\n<A>\n<B>\n<C>1\n</A>\n<D>2\n</OFX>\n').parse()
+        self.assertEqual(OFX.A.B.C.val, '1')
+        self.assertEqual(OFX.D.val, '2')
+
+        # unknown closing tags are ignored
+        OFX = OFXParser('<OFX>\n<STATUS>\n<CODE>0</CODE>\n<SEVERITY>INFO</SEVERITY>\n</STATUS>\n</OFX>\n').parse()
+        self.assertEqual(OFX.STATUS.SEVERITY.val, 'INFO')
+        self.assertEqual(len(OFX.children), 1)
+        self.assertTrue(self.logging_handler.last_message.startswith('Unexpected closing tag'))
+
+        # unclosed aggregates at EOF
+        OFX = OFXParser('<OFX>\n<A>\n<B>1\n').parse()
+        self.assertEqual(OFX.A.B.val, '1')
+
+        # malformed tags and the text after them are skipped
+        OFX = OFXParser('<OFX>\n<A>\n<b c>x\n<B>1\n</A>\n</OFX>\n').parse()
+        self.assertEqual(OFX.A.B.val, '1')
+        self.assertEqual(len(OFX.A.children), 1)
+
+    def test_17_parse_from_file_and_stream(self):
+        """
+        from_file (memory mapped) and from_stream must parse like a string
+        """
+        expected = OFXParser(open(self.path+'real_file_with_headers.ofx').read()).parse().ofx_repr()
+
+        parser = OFXParser.from_file(self.path+'real_file_with_headers.ofx')
+        OFX = parser.parse()
+        parser.close()
+        self.assertEqual(parser.OFX_headers['CHARSET'], '1252')
+        self.assertEqual(OFX.ofx_repr(), expected)
+
+        src = open(self.path+'real_file_with_headers.ofx')
+        parser = OFXParser.from_stream(src, tokenizer=OFXParser.TOKENIZER_CHAR)
+        src.close()
+        self.assertEqual(parser.parse().ofx_repr(), expected)
+
+        parser = OFXParser.from_file(self.path+'empty.ofx')
+        self.assertFalse(parser.source)
+
+    def test_18_incremental_parsing(self):
+        """
+        Feed a file by chunks, whatever the chunk size the tree must be the same
+        """
+        source = open(self.path+'real_file_with_headers.ofx').read()
+        expected = OFXParser(source).parse().ofx_repr()
+        for chunk_size in (1, 7, 256, len(source)):
+            parser = OFXIncrementalParser()
+            transactions = []
+            for i in range(0, len(source), chunk_size):
+                parser.feed(source[i:i+chunk_size])
+                transactions.extend(node for event, node in parser.read_events() if node.name == 'STMTTRN')
+            self.assertEqual(len(transactions), 41)
+            self.assertEqual(transactions[0].FITID.val, '8323719579843')
+            OFX = parser.close()
+            self.assertEqual(OFX.ofx_repr(), expected)
+            self.assertEqual(parser.OFX_headers['VERSION'], '102')
+
+        # tag names holding '<' : chunks are not cut inside them
+        for source in (source.replace('<NAME>', '<NAM\n', 3), source.replace('<MEMO>', '<<>MEMO>', 2), '<OFX><A<B>1<C>2</OFX>'):
+            expected = OFXParser(source).parse().ofx_repr()
+            for chunk_size in (1, 3, 50):
+                parser = OFXIncrementalParser()
+                for i in range(0, len(source), chunk_size):
+                    parser.feed(source[i:i+chunk_size])
+                self.assertEqual(parser.close().ofx_repr(), expected)
+
+    def test_19_incremental_parsing_discards_transactions(self):
+        """
+        Discarded aggregates are sent as events but not kept in the tree
+        """
+        source = open(self.path+'real_file_no_headers.ofx').read()
+        parser = OFXIncrementalParser(discard=('STMTTRN',))
+        parser.feed(source)
+        OFX = parser.close()
+        self.assertEqual(len([ e for e in parser.read_events() if e[1].name == 'STMTTRN' ]), 41)
+        self.assertEqual(OFX.find_children_by_name('STMTTRN'), [])
+        self.assertEqual(OFX.BANKMSGSRSV1.STMTTRNRS.STMTRS.BANKTRANLIST.DTSTART.val.year, 2010)
+        self.assertRaises(ValueError, parser.feed, '<OFX>')
+
+    def test_20_parse_malformed_headers(self):
+        """
+        Blank lines, lines without ':' and a missing trailing newline don't stop header parsing
+        """
+        parser = OFXParser('OFXHEADER:100\r\n\r\nGARBAGE\r\nVERSION:102\r\nNEWFILEUID:A:B<OFX>\n<CODE>0\n</OFX>\n')
+        OFX = parser.parse()
+        self.assertEqual(parser.OFX_headers, {'OFXHEADER' : '100', 'VERSION' : '102', 'NEWFILEUID' : 'A:B'})
+        self.assertEqual(OFX.CODE.value, '0')
+        self.assertEqual(parser.current_line_number, 7)
+
+        parser = OFXParser('OFXHEADER:100\nVERSION:102')
+        self.assertEqual(parser.parse_headers(), {'OFXHEADER' : '100', 'VERSION' : '102'})
+        self.assertEqual(parser.parse(), None)
+
+    def test_21_probe_headers_and_encoding(self):
+        """
+        Headers and encoding are read from the first bytes of a file
+        """
+        headers, encoding = probe_ofx_file(self.path+'real_file_with_headers.ofx', size=64)
+        self.assertEqual(headers, OFXParser(open(self.path+'real_file_with_headers.ofx').read()).parse_headers())
+        self.assertEqual(encoding, 'cp1252')
+        self.assertEqual(probe_ofx_file(self.path+'real_file_no_headers.ofx'), ({}, 'ascii'))
+
+        f = open('output/ofx2.ofx', 'w')
+        f.write('\xef\xbb\xbf<?xml version="1.0" encoding="ISO-8859-1"?>\n'
+                '<?OFX OFXHEADER="200" VERSION="211" SECURITY="NONE" OLDFILEUID="NONE" NEWFILEUID="NONE"?>\n'
+                '<OFX>' + '<SIGNONMSGSRSV1></SIGNONMSGSRSV1>' * 100 + '</OFX>\n')
+        f.close()
+        headers, encoding = probe_ofx_file('output/ofx2.ofx', size=16)
+        self.assertEqual(headers['VERSION'], '211')
+        self.assertEqual(headers['OFXHEADER'], '200')
+        self.assertEqual(encoding, 'iso8859-1')
+
+        f = open('output/utf8.ofx', 'w')
+        f.write('OFXHEADER:100\nENCODING:UTF-8\nCHARSET:NONE\n<OFX>\n</OFX>\n')
+        f.close()
+        self.assertEqual(probe_ofx_file('output/utf8.ofx')[1], 'utf-8')
+
+    def test_22_parse_xml_ofx(self):
+        """
+        OFX 2.x files give the same tree and events as their OFX 1.x version
+        """
+        OFX = OFXParser(open(self.path+'real_file_with_headers.ofx').read()).parse()
+        OFX.BANKMSGSRSV1.STMTTRNRS.STMTRS.BANKTRANLIST.STMTTRN[0].NAME.value = 'B&amp;YOU \xe9'
+        f = open('output/ofx2.xml', 'w')
+        f.write('<?xml version="1.0" encoding="ISO-8859-1" standalone="no"?>\n'
+                '<?OFX OFXHEADER="200" VERSION="211" SECURITY="NONE" OLDFILEUID="NONE" NEWFILEUID="NONE"?>\n')
+        OFX.write_xml(f)
+        f.close()
+
+        parser = parser_for_file('output/ofx2.xml')
+        self.assertTrue(isinstance(parser, OFXXMLParser))
+        self.assertEqual(parser.parse_headers()['VERSION'], '211')
+        self.assertEqual(parser.parse().ofx_repr(), OFX.ofx_repr())
+        parser.close()
+
+        sgml_events = [ (e, n.name, n.value) for e, n in OFXParser(OFX.ofx_repr()).iter_events() ]
+        xml_events = [ (e, n.name, n.value) for e, n in OFXXMLParser(OFX.xml_repr(), encoding='iso-8859-1').iter_events() ]
+        self.assertEqual(xml_events, sgml_events)
+
+        handled = []
+        parser = OFXXMLParser('<OFX><A><B>1</B></A><A><B>2</B></A><C>\n</C></OFX>', handlers={'A' : lambda n, a: handled.append(n.B.value)})
+        OFX = parser.parse()
+        self.assertEqual(handled, ['1', '2'])
+        self.assertEqual(OFX.C.children, [])
+
+        self.assertEqual(parser.parse_error, None)
+
+        parser = OFXXMLParser('<OFX><A><B>1</B></A><A><B>2</C></A></OFX>')
+        OFX = parser.parse()
+        self.assertEqual(self.logging_handler.last_message, "Invalid XML at line %i : %s")
+        self.assertEqual(parser.parse_error, "Invalid XML at line 1 : mismatched tag")
+        self.assertEqual(OFX.A.B.value, '1')
+        self.assertEqual(len(OFX.A), 2)
+
+    def test_23_parse_stats(self):
+        """
+        stats=True records sizes, tag counts, depth, error tags and phase times
+        """
+        source = open(self.path+'real_file_with_headers.ofx').read()
+        self.assertEqual(OFXParser(source).stats, None)
+
+        parser = OFXParser(source, stats=True)
+        OFX = parser.parse()
+        stats = parser.stats
+        self.assertEqual(stats.bytes, len(source))
+        self.assertEqual(stats.lines, parser.current_line_number)
+        self.assertEqual(stats.tags['STMTTRN'], source.count('<STMTTRN>'))
+        self.assertEqual(stats.tags['OFX'], 1)
+        self.assertEqual(stats.nodes, sum(stats.tags.values()))
+        self.assertEqual(stats.nodes, source.count('<') - source.count('</'))
+        self.assertEqual(stats.max_depth, 7)
+        self.assertEqual(stats.errors, [])
+        self.assertTrue(stats.header_time > 0 and stats.tokenize_time > 0 and stats.build_time > 0)
+        self.assertEqual(stats.as_dict()['nodes'], stats.nodes)
+
+        for tokenizer in (OFXParser.TOKENIZER_CHAR, OFXParser.TOKENIZER_FAST):
+            parser = OFXParser('<OFX>\n<A>\n<B>1\n</A>x\n<c1>\n</OFX>\n', tokenizer=tokenizer, stats=True)
+            parser.parse()
+            self.assertEqual(parser.stats.errors, [ (4, 'A'), (5, '') ])
+            self.assertEqual(self.logging_handler.args_list[-3:], [ ('A', 4), (5,), (5,) ])
+            self.assertEqual(parser.stats.tags, { 'OFX' : 1, 'A' : 1, 'B' : 1 })
+            self.assertEqual(parser.stats.max_depth, 3)
+
+        parser = OFXIncrementalParser(stats=True)
+        for i in range(0, len(source), 100):
+            parser.feed(source[i:i+100])
+        parser.close()
+        self.assertEqual((parser.stats.bytes, parser.stats.nodes, parser.stats.tags), (stats.bytes, stats.nodes, stats.tags))
+
+        parser = OFXXMLParser('<OFX><A><B>1</B></A>\n<A><B>2</C></A></OFX>', stats=True)
+        parser.parse()
+        self.assertEqual(parser.stats.errors, [ (2, '') ])
+        self.assertEqual(parser.stats.tags, { 'OFX' : 1, 'A' : 2, 'B' : 1 })
+
+    def test_24_lazy_parse(self):
+        """
+        Lazy trees are the parsed trees, only aggregates accessed are built
+        """
+        for name in ('real_file_with_headers.ofx', 'multi_account_file.ofx', 'one_block.ofx'):
+            source = open(self.path+name).read()
+            parser = OFXLazyParser(source)
+            self.assertEqual(parser.parse().ofx_repr(), OFXParser(source).parse().ofx_repr())
+            self.assertEqual(parser.OFX_headers, OFXParser(source).parse_headers())
+        for source in ('<OFX>\n<A>\n<B>1\n</OFX>x\n<C>2', '<OFX>\r\n<A>\r\n<B<1>2\r\n</A>\r\n</B>\r\n<C>\r\n', '<B>1\n<C>2'):
+            self.assertEqual(OFXLazyParser(source).parse().ofx_repr(), OFXParser(source).parse().ofx_repr())
+        self.assertEqual(OFXLazyParser(open(self.path+'closing_tag.ofx').read()).parse(), None)
+
+        parser = OFXLazyParser.from_file(self.path+'multi_account_file.ofx')
+        OFX = parser.parse()
+        self.assertEqual(OFX.SIGNONMSGSRSV1.SONRS.STATUS.CODE.val, '0')
+        self.assertFalse(OFX.BANKMSGSRSV1.expanded)
+        statement = OFX.BANKMSGSRSV1.STMTTRNRS[1]
+        self.assertTrue(OFX.BANKMSGSRSV1.expanded)
+        self.assertFalse(OFX.BANKMSGSRSV1.STMTTRNRS[0].expanded)
+        self.assertEqual(statement.STMTRS.BANKACCTFROM.ACCTID.value, 
+                         OFXParser(open(self.path+'multi_account_file.ofx').read()).parse().BANKMSGSRSV1.STMTTRNRS[1].STMTRS.BANKACCTFROM.ACCTID.value)
+        self.assertTrue(statement.children is OFX.BANKMSGSRSV1.STMTTRNRS[1].children)
+        parser.close()
+
 
 if __name__=="__main__":
     unittest.main()
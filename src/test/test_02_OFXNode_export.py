@@ -8,6 +8,9 @@ import unittest
 import logging
 import sys
 import os
+from StringIO import StringIO
+from datetime import date, datetime
+from decimal import Decimal
 from edofx import OFXParser, OFXNode
 from edofx_integration import render_as_DOT
 
@@ -116,6 +119,173 @@ class AcceptanceTests(unittest.TestCase):
             print e.export_as_csv()            
 
  
+    def test_12_compact_nodes(self):
+        '''
+        Nodes have no __dict__, leaves share an empty children tuple and tag names are interned
+        '''
+        OFX = OFXParser(open(self.path+'real_file_no_headers.ofx').read()).parse()
+        leaf = OFX.SIGNONMSGSRSV1.SONRS.STATUS.CODE
+        self.assertFalse(hasattr(leaf, '__dict__'))
+        self.assertTrue(leaf.children is ())
+        self.assertTrue(leaf.logger is OFX.logger)
+        self.assertTrue(sys.getsizeof(leaf) <= 104)
+        transactions = OFX.find_children_by_name('STMTTRN')
+        self.assertTrue(transactions[0].TRNAMT.name is transactions[1].TRNAMT.name)
+
+    def test_13_children_index(self):
+        '''
+        Lookups on large aggregates go through the children index, which must
+        follow append_child(), del, appends to children and new children lists
+        '''
+        root = OFXNode(OFXNode.TYPE_OPENING, 'BANKTRANLIST')
+        root.append_child(OFXNode(OFXNode.TYPE_SELFCLOSING, 'DTSTART', '20100101'))
+        for i in range(100):
+            trn = OFXNode(OFXNode.TYPE_OPENING, 'STMTTRN')
+            trn.append_child(OFXNode(OFXNode.TYPE_SELFCLOSING, 'FITID', str(i)))
+            root.append_child(trn)
+        self.assertEqual(len(root.STMTTRN), 100)
+        self.assertEqual(root.STMTTRN[42].FITID.val, '42')
+        self.assertEqual([ t.FITID.val for t in root.STMTTRN ][-1], '99')
+
+        root.append_child(OFXNode(OFXNode.TYPE_SELFCLOSING, 'DTEND', '20100201'))
+        self.assertEqual(root.DTEND.value, '20100201')
+        root.children.append(OFXNode(OFXNode.TYPE_SELFCLOSING, 'MEMO', 'direct'))
+        self.assertEqual(root.MEMO.val, 'direct')
+
+        del root.STMTTRN
+        self.assertEqual(len(root.children), 3)
+        self.assertRaises(AttributeError, getattr, root, 'STMTTRN')
+        self.assertEqual(root.DTSTART.value, '20100101')
+
+        for i in range(20):
+            root.append_child(OFXNode(OFXNode.TYPE_SELFCLOSING, 'X', str(i)))
+        self.assertEqual(root.X.value, '0')
+        root.children = root.children[:3] + [ OFXNode(OFXNode.TYPE_SELFCLOSING, 'Y', 'y') ] + root.children[4:]
+        self.assertEqual(root.Y.value, 'y')
+        self.assertEqual(root.X.value, '1')
+        root.children[3] = OFXNode(OFXNode.TYPE_SELFCLOSING, 'Z', 'z')
+        root._index = None
+        self.assertEqual(root.Z.value, 'z')
+        self.assertRaises(AttributeError, getattr, root, 'Y')
+
+    def test_14_dsl_tracing(self):
+        '''
+        DSL accesses are logged only when OFXNode.trace is set
+        '''
+        handler = TestLoggingHandler()
+        logger = logging.getLogger('OFXNode')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        try:
+            OFX = OFXParser(open(self.path+'real_file_no_headers.ofx').read()).parse()
+            OFX.SIGNONMSGSRSV1.SONRS
+            self.assertEqual(handler.messages_list, [])
+
+            OFXNode.trace = True
+            OFX.SIGNONMSGSRSV1.SONRS
+            self.assertEqual(handler.messages_list, ['%s.__getattr__(%s)', '%s.__getattr__(%s)'])
+        finally:
+            OFXNode.trace = False
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
+
+    def test_15_write_ofx_and_xml(self):
+        '''
+        write_* methods and iter_* generators produce the same output as *_repr methods
+        '''
+        OFX = OFXParser(open(self.path+'multi_account_file.ofx').read()).parse()
+        out = StringIO()
+        OFX.write_ofx(out)
+        self.assertEqual(out.getvalue(), OFX.ofx_repr())
+        self.assertEqual(out.getvalue(), open(self.path+'multi_account_file.ofx').read())
+
+        out = StringIO()
+        OFX.BANKMSGSRSV1.write_xml(out, indent='  ')
+        self.assertEqual(out.getvalue(), OFX.BANKMSGSRSV1.xml_repr('  '))
+        self.assertEqual(''.join(OFX.SIGNONMSGSRSV1.iter_xml()), 
+                         OFX.SIGNONMSGSRSV1.xml_repr())
+        self.assertEqual(OFX.SIGNONMSGSRSV1.SONRS.STATUS.CODE.xml_repr('  '), '  <CODE>0</CODE>\n')
+
+        out = StringIO()
+        OFX.write_obfuscated_ofx(out)
+        self.assertEqual(len(out.getvalue().splitlines()), len(OFX.ofx_repr().splitlines()))
+
+    def test_16_write_deep_tree(self):
+        '''
+        Serializers must not depend on recursion limit
+        '''
+        root = node = OFXNode(OFXNode.TYPE_OPENING, 'A')
+        for i in range(sys.getrecursionlimit()*2):
+            child = OFXNode(OFXNode.TYPE_OPENING, 'A')
+            node.append_child(child)
+            node = child
+        node.append_child(OFXNode(OFXNode.TYPE_SELFCLOSING, 'CODE', '0'))
+        self.assertEqual(len(root.ofx_repr().splitlines()), sys.getrecursionlimit()*4+3)
+
+    def test_17_typed_values(self):
+        '''
+        val and datetime_val are cached until value changes, amounts may be Decimal, datetimes keep time zone
+        '''
+        OFX = OFXParser(open(self.path+'real_file_no_headers.ofx').read()).parse()
+        trn = OFX.BANKMSGSRSV1.STMTTRNRS.STMTRS.BANKTRANLIST.STMTTRN
+        self.assertEqual(trn.TRNAMT.val, -340.18)
+        self.assertTrue(trn.DTPOSTED.val is trn.DTPOSTED.val)
+        self.assertEqual(trn.DTPOSTED.val, date(2010, 2, 26))
+
+        trn.TRNAMT.value = '12,5'
+        self.assertEqual(trn.TRNAMT.val, 12.5)
+        OFXNode.amount_type = Decimal
+        try:
+            self.assertEqual(trn.TRNAMT.val, Decimal('12.5'))
+        finally:
+            OFXNode.amount_type = float
+        self.assertEqual(type(trn.TRNAMT.val), float)
+
+        node = OFXNode(OFXNode.TYPE_SELFCLOSING, 'DTSERVER', '20100305094649[+1:CET]')
+        self.assertEqual(node.val, date(2010, 3, 5))
+        self.assertEqual(node.datetime_val.isoformat(), '2010-03-05T09:46:49+01:00')
+        self.assertEqual(node.datetime_val.tzname(), 'CET')
+        datetime_val = node.datetime_val
+        self.assertTrue(node.datetime_val is datetime_val)
+        self.assertEqual(node.val, date(2010, 3, 5))
+        self.assertTrue(node.datetime_val is datetime_val)
+        node.value = '20100305094649.5'
+        self.assertEqual(node.datetime_val, datetime(2010, 3, 5, 9, 46, 49, 500000))
+        node.value = 'NONE'
+        self.assertRaises(ValueError, getattr, node, 'datetime_val')
+
+    def test_18_tree_walkers(self):
+        '''
+        Walkers are lazy, don't depend on recursion limit and find nested nodes
+        '''
+        OFX = OFXParser('<OFX><A><A><B>1</A><B>2</A><C>3</OFX>').parse()
+        self.assertEqual([ n.name for n in OFX.iter_preorder() ], ['OFX', 'A', 'A', 'B', 'B', 'C'])
+        self.assertEqual([ n.name for n in OFX.iter_postorder() ], ['B', 'A', 'B', 'A', 'C', 'OFX'])
+        self.assertEqual([ n.value for n in OFX.iter_leaves() ], ['1', '2', '3'])
+        self.assertEqual(len(OFX.find_children_by_name('A')), 2)
+        self.assertEqual(OFX.find_children_by_name('A')[1].parent, OFX.A)
+        self.assertEqual([ n.value for n in OFX.A.iter_find('B') ], ['1', '2'])
+
+        def walked(OFX):
+            for n in OFX.iter_preorder():
+                walked.count += 1
+                yield n
+        walked.count = 0
+        OFX = OFXParser(open(self.path+'real_file_with_headers.ofx').read()).parse()
+        self.assertEqual(next(n for n in walked(OFX) if n.name == 'STMTTRN').TRNAMT.val,
+                         OFX.BANKMSGSRSV1.STMTTRNRS.STMTRS.BANKTRANLIST.STMTTRN.TRNAMT.val)
+        self.assertTrue(walked.count < 30)
+
+        root = node = OFXNode(OFXNode.TYPE_OPENING, 'A')
+        for i in range(sys.getrecursionlimit()*2):
+            child = OFXNode(OFXNode.TYPE_OPENING, 'A')
+            node.append_child(child)
+            node = child
+        node.append_child(OFXNode(OFXNode.TYPE_SELFCLOSING, 'CODE', '0'))
+        self.assertEqual(len(list(root.iter_postorder())), sys.getrecursionlimit()*2+2)
+        self.assertEqual(root.iter_leaves().next().value, '0')
+
+ 
 
 if __name__=="__main__":
     unittest.main()
@@ -20,7 +20,7 @@ import unittest
 import logging
 import sys
 import os
-from edofx import OFXParser, OFXNode, OFXObfuscator
+from edofx import OFXParser, OFXNode, OFXObfuscator, OFXPseudonymizer
 
 class TestLoggingHandler(logging.Handler):
     def __init__(self):
@@ -93,6 +93,64 @@ class AcceptanceTests(unittest.TestCase):
         f.write(OFX.xml_repr())
         f.close()
 
+    def test_06_obfuscated_file_keeps_headers_dates_and_amounts(self):
+        '''
+        Headers, dates, amounts and codes of an obfuscated file remain usable
+        '''
+        obfuscator = OFXObfuscator.from_file(self.path+'real_file_with_headers.ofx')
+        f = open('output/real_file_obfuscated_stream.ofx', 'wb')
+        obfuscator.write(f, chunk_size=100)
+        f.close()
+        obfuscated = open('output/real_file_obfuscated_stream.ofx').read()
+        self.assertEqual(obfuscated, obfuscator.obfuscate())
+
+        parser = OFXParser(open(self.path+'real_file_with_headers.ofx').read())
+        OFX = parser.parse()
+        obfuscated_parser = OFXParser(obfuscated)
+        obfuscated_OFX = obfuscated_parser.parse()
+        self.assertEqual(obfuscated_parser.OFX_headers, parser.OFX_headers)
+
+        transactions = OFX.find_children_by_name('STMTTRN')
+        obfuscated_transactions = obfuscated_OFX.find_children_by_name('STMTTRN')
+        self.assertEqual(len(obfuscated_transactions), len(transactions))
+        for t, o in zip(transactions, obfuscated_transactions):
+            self.assertEqual(o.DTPOSTED.val, t.DTPOSTED.val)
+            self.assertEqual(o.TRNTYPE.value, t.TRNTYPE.value)
+            self.assertEqual(o.TRNAMT.val < 0, t.TRNAMT.val < 0)
+            self.assertEqual(len(o.NAME.value), len(t.NAME.value))
+            self.assertFalse([ c for c in o.NAME.value if c.isalnum() and c not in 'A9' ])
+        self.assertEqual(obfuscated_OFX.BANKMSGSRSV1.STMTTRNRS.STMTRS.BANKACCTFROM.ACCTID.value.strip('9'), '')
+
+    def test_07_deterministic_pseudonyms(self):
+        '''
+        With the same key, a value gets the same pseudonym in every output, amounts keep sign and magnitude
+        '''
+        OFX = OFXParser(open(self.path+'multi_account_file.ofx').read()).parse()
+        first = OFX.obfuscated_ofx_repr(pseudonymizer=OFXPseudonymizer('secret'))
+        self.assertEqual(OFX.obfuscated_ofx_repr(pseudonymizer=OFXPseudonymizer('secret')), first)
+        self.assertNotEqual(OFX.obfuscated_ofx_repr(pseudonymizer=OFXPseudonymizer('other secret')), first)
+
+        pseudonymizer = OFXPseudonymizer('secret')
+        self.assertEqual(pseudonymizer.text('AU COIN 12/03'), pseudonymizer.text('AU COIN') + pseudonymizer.text(' 12/03'))
+        self.assertEqual(len(pseudonymizer.text('55628849529')), 11)
+        self.assertTrue(pseudonymizer.text('55628849529').isdigit())
+        self.assertEqual(pseudonymizer.amount('0,01'), '0,01')
+        self.assertEqual(pseudonymizer.amount('-0.01'), '-0.01')
+        self.assertEqual(pseudonymizer.amount('0.00'), '0.00')
+
+        obfuscated = OFXParser(first).parse()
+        transactions = OFX.find_children_by_name('STMTTRN')
+        obfuscated_transactions = obfuscated.find_children_by_name('STMTTRN')
+        self.assertEqual(len(obfuscated_transactions), len(transactions))
+        names = {}
+        for t, o in zip(transactions, obfuscated_transactions):
+            self.assertEqual(o.DTPOSTED.value, t.DTPOSTED.value)
+            ratio = o.TRNAMT.val / t.TRNAMT.val if t.TRNAMT.val else 1.0
+            self.assertTrue(0.49 < ratio < 1.51)
+            self.assertEqual(names.setdefault(t.NAME.value, o.NAME.value), o.NAME.value)
+        accounts = [ a.value for a in obfuscated.find_children_by_name('ACCTID') ]
+        self.assertEqual(accounts, [ pseudonymizer.text(a.value) for a in OFX.find_children_by_name('ACCTID') ])
+
 
 if __name__=="__main__":
     unittest.main()
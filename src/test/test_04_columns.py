@@ -0,0 +1,45 @@
+# coding: utf-8
+'''
+Columnar extraction of transactions
+'''
+import unittest
+import sys
+import os
+
+from edofx import OFXParser
+from edofx2csv import build_Statement_tree
+from edofx_columns import TransactionTable
+
+
+class AcceptanceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.dirname(os.path.abspath(sys.modules[__name__].__file__))+'/fixtures/'
+
+    def test_01_transaction_table(self):
+        '''
+        Columns and aggregations must agree with build_Statement_tree
+        '''
+        table = TransactionTable.from_file(self.path+'multi_account_file.ofx')
+        statements = build_Statement_tree(OFXParser(open(self.path+'multi_account_file.ofx').read()).parse())
+        transactions = [ (s, t) for s in statements for t in s.transaction_list ]
+
+        self.assertEqual(len(table), len(transactions))
+        self.assertEqual(table.fitid, [ t.fitid for s, t in transactions ])
+        self.assertEqual(table.dates(), [ t.date for s, t in transactions ])
+        self.assertEqual([ table.types[c] for c in table.type ], [ t.type for s, t in transactions ])
+        self.assertEqual([ table.accounts[c] for c in table.account ], [ (s.type, s.account_id.strip()) for s, t in transactions ])
+
+        balances = table.balance_by_account()
+        for s in statements:
+            self.assertEqual(balances[(s.type, s.account_id.strip())],
+                             sum(int(round(t.amount*100)) for t in s.transaction_list))
+
+        self.assertEqual(sum(table.sum_by_type().values()), sum(table.amount_cents))
+        monthly = table.monthly_totals()
+        self.assertEqual(sum(monthly.values()), sum(table.amount_cents))
+        self.assertTrue(all( 2009 <= year <= 2010 and 1 <= month <= 12 for year, month in monthly ))
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+# coding: utf-8
+'''
+CSV export of statements
+'''
+import unittest
+import csv
+import shutil
+import sys
+import os
+import tempfile
+
+from datetime import date
+from StringIO import StringIO
+
+from edofx import OFXParser
+from edofx2csv import Statement, StatementTransaction, StatementCSVWriter, build_Statement_tree
+import edofx2csv
+
+
+class AcceptanceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.dirname(os.path.abspath(sys.modules[__name__].__file__))+'/fixtures/'
+        self.work_dir = tempfile.mkdtemp(prefix='edofx_test')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_01_csv_quoting_and_formats(self):
+        '''
+        Separators and quotes in values are escaped, amounts and dates are formatted
+        '''
+        stmt = Statement('CHECKING')
+        stmt.account_id = '123'
+        stmt.transaction_list.append(StatementTransaction('1', 'DEBIT', date(2010, 3, 5), -12.5, 'A;B "C"', 'memo'))
+        stmt.transaction_list.append(StatementTransaction('2', 'CREDIT', date(2010, 3, 6), 7.25, 'D', ''))
+
+        out = stmt.export_as_csv()
+        rows = list(csv.reader(StringIO(out), delimiter=';'))
+        self.assertEqual(rows[0], list(StatementCSVWriter.HEADER))
+        self.assertEqual(rows[1], ['CHECKING', '', '', '123', '1', 'DEBIT', '05/03/2010', '-12,5', '', '-12,5', 'A;B "C"', 'memo'])
+        self.assertEqual(rows[2][7:10], ['7,25', '7,25', ''])
+
+        out = StringIO()
+        stmt.write_csv(out, separator=',', decimal_separator='.', date_format='%Y-%m-%d', header_line=False, batch_size=1)
+        rows = list(csv.reader(StringIO(out.getvalue())))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][6:8], ['2010-03-05', '-12.5'])
+
+    def test_02_combined_csv_file(self):
+        '''
+        All statements of a file are written to one CSV file
+        '''
+        edofx2csv.main(self.path+'multi_account_file.ofx', 'output/combined.csv')
+        rows = list(csv.reader(open('output/combined.csv', 'rb'), delimiter=';'))
+
+        statements = build_Statement_tree(OFXParser(open(self.path+'multi_account_file.ofx').read()).parse())
+        self.assertEqual(len(rows), 1 + sum(len(s.transaction_list) for s in statements))
+        self.assertEqual(set(r[3] for r in rows[1:]), set(s.account_id for s in statements))
+
+    def test_03_parallel_batch(self):
+        '''
+        A batch of files is converted by a pool of workers, a malformed file is reported and doesn't abort the batch
+        '''
+        batch = os.path.join(self.work_dir, 'batch')
+        batch_csv = os.path.join(self.work_dir, 'batch_csv')
+        os.mkdir(batch)
+        os.mkdir(batch_csv)
+        source = open(self.path+'multi_account_file.ofx').read()
+        for i in range(3):
+            open(os.path.join(batch, 'good_%d.ofx' % i), 'w').write(source)
+        open(os.path.join(batch, 'bad.OFX'), 'w').write(source.replace('<DTSTART>', '<DTSTART>garbage', 1))
+        open(os.path.join(batch, 'readme.txt'), 'w').write('not an ofx file')
+        missing = os.path.join(self.work_dir, 'missing.ofx')
+
+        sources = edofx2csv.expand_sources([batch, os.path.join(batch, 'good_*.ofx'), batch + '/./good_0.ofx', missing])
+        self.assertEqual(sources, [ os.path.join(batch, n) for n in ('bad.OFX', 'good_0.ofx', 'good_1.ofx', 'good_2.ofx') ] + [missing])
+
+        results = list(edofx2csv.convert_files(sources, 2, batch_csv))
+        self.assertEqual(sorted(r[0] for r in results), sorted(sources))
+        failed = [ r for r in results if r[1] is not None ]
+        self.assertEqual(sorted(r[0] for r in failed), [ os.path.join(batch, 'bad.OFX'), missing ])
+        statements = build_Statement_tree(OFXParser(source).parse())
+        for r in results:
+            if r[1] is None:
+                self.assertEqual(r[2:4], (len(statements), sum(len(s.transaction_list) for s in statements)))
+        # same accounts and periods in the 3 files, CSV names start with the source name
+        names = os.listdir(batch_csv)
+        self.assertEqual(len(names), 3 * len(statements))
+        self.assertEqual(len([ n for n in names if n.startswith('good_1_releve_compte_') ]), len(statements))
+
+        out = StringIO()
+        self.assertEqual(edofx2csv.print_summary(results, 0.5, out), 2)
+        self.assertTrue('3 files converted, 2 failed' in out.getvalue())
+
+        # files of the same name in other directories
+        monthly_csv = os.path.join(self.work_dir, 'monthly_csv')
+        os.mkdir(monthly_csv)
+        monthly = []
+        for month in ('2024-01', '2024-02'):
+            os.makedirs(os.path.join(self.work_dir, 'monthly', month))
+            monthly.append(os.path.join(self.work_dir, 'monthly', month, 'bank.ofx'))
+            open(monthly[-1], 'w').write(source)
+        monthly.append(os.path.join(self.work_dir, 'monthly', 'BANK.ofx'))
+        open(monthly[-1], 'w').write(source)
+        results = list(edofx2csv.convert_files(monthly, 1, monthly_csv))
+        self.assertEqual([ r[1] for r in results ], [None] * 3)
+        self.assertEqual(len(os.listdir(monthly_csv)), 3 * len(statements))
+        self.assertEqual(edofx2csv.source_prefixes(monthly), ['2024-01_bank_', '2024-02_bank_', 'BANK_'])
+        self.assertEqual(edofx2csv.source_prefixes([ 'a/b_c.ofx', 'a_b/c.ofx', 'x/c.ofx', 'b_c.ofx' ]), ['a_b_c_', 'a_b_c_2_', 'x_c_', 'b_c_'])
+        self.assertEqual(edofx2csv.source_prefixes(monthly[:1]), [''])
+
+    def test_04_invalid_xml_file(self):
+        '''
+        An OFX 2.x file with invalid XML is reported as failed, not as a truncated conversion
+        '''
+        xml_file = os.path.join(self.work_dir, 'invalid.ofx')
+        f = open(xml_file, 'w')
+        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<?OFX OFXHEADER="200" VERSION="211"?>\n')
+        # &GIA; of a NAME is not an XML entity
+        OFXParser(open(self.path+'multi_account_file.ofx').read()).parse().write_xml(f)
+        f.close()
+
+        results = list(edofx2csv.convert_files([xml_file], 1, self.work_dir))
+        self.assertEqual(len(results), 1)
+        self.assertTrue('Invalid XML at line' in results[0][1])
+
+
+if __name__=="__main__":
+    unittest.main()
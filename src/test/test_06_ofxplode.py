@@ -0,0 +1,138 @@
+# coding: utf-8
+'''
+Split of multi-account OFX files
+'''
+import unittest
+import shutil
+import sys
+import os
+import tempfile
+
+from edofx import OFXParser, ofx_encoding
+import ofxplode
+
+
+class AcceptanceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.dirname(os.path.abspath(sys.modules[__name__].__file__))+'/fixtures/'
+        self.output_dir = tempfile.mkdtemp(prefix='edofx_explode')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_01_one_document_per_account(self):
+        '''
+        Each bank and credit card statement gets its own OFX and XML document with the shared envelope
+        '''
+        source = OFXParser(open(self.path+'multi_account_file.ofx').read()).parse()
+        expected = [ (s.STMTRS.BANKACCTFROM.ACCTID.value, len(s.STMTRS.BANKTRANLIST.STMTTRN)) for s in source.BANKMSGSRSV1.STMTTRNRS ]
+        expected += [ (s.CCSTMTRS.CCACCTFROM.ACCTID.value.strip(), len(s.CCSTMTRS.BANKTRANLIST.STMTTRN)) for s in source.CREDITCARDMSGSRSV1.CCSTMTTRNRS ]
+
+        written = ofxplode.main(self.path+'multi_account_file.ofx', self.output_dir)
+        self.assertEqual(len(written), 2*len(expected))
+        self.assertEqual(len(os.listdir(self.output_dir)), len(written))
+
+        found = []
+        for name in written:
+            if name.endswith('.xml'):
+                xml = open(name).read()
+                self.assertTrue(xml.startswith('<OFX>\n    <SIGNONMSGSRSV1>\n'))
+                self.assertTrue(xml.endswith('    </BANKMSGSRSV1>\n</OFX>\n') or xml.endswith('    </CREDITCARDMSGSRSV1>\n</OFX>\n'))
+                continue
+            o = OFXParser(open(name).read()).parse()
+            self.assertEqual(o.SIGNONMSGSRSV1.ofx_repr(), source.SIGNONMSGSRSV1.ofx_repr())
+            self.assertEqual(len(o.children), 2)
+            if o.children[1].name == 'BANKMSGSRSV1':
+                self.assertEqual(len(o.BANKMSGSRSV1.STMTTRNRS), 1)
+                stmtrs = o.BANKMSGSRSV1.STMTTRNRS.STMTRS
+                found.append( (stmtrs.BANKACCTFROM.ACCTID.value, len(stmtrs.BANKTRANLIST.STMTTRN)) )
+                self.assertTrue(os.path.basename(name).startswith('compte_'))
+            else:
+                self.assertTrue(os.path.basename(name).startswith('cc_compte_'))
+                self.assertEqual(len(o.CREDITCARDMSGSRSV1.CCSTMTTRNRS), 1)
+                stmtrs = o.CREDITCARDMSGSRSV1.CCSTMTTRNRS.CCSTMTRS
+                found.append( (stmtrs.CCACCTFROM.ACCTID.value.strip(), len(stmtrs.BANKTRANLIST.STMTTRN)) )
+        self.assertEqual(sorted(found), sorted(expected))
+
+        # a credit card with the ACCTID of a bank account
+        bank_id = expected[0][0]
+        card_id = source.CREDITCARDMSGSRSV1.CCSTMTTRNRS[0].CCSTMTRS.CCACCTFROM.ACCTID.value
+        same_ids = os.path.join(self.output_dir, 'same_ids.ofx')
+        open(same_ids, 'w').write(open(self.path+'multi_account_file.ofx').read().replace(card_id, bank_id))
+        written = ofxplode.main(same_ids, self.output_dir)
+        self.assertEqual(len(set(written)), 2*len(expected))
+
+    def test_02_split_by_period(self):
+        '''
+        Statements are split by month, the source tree is left unmodified
+        '''
+        p = OFXParser(open(self.path+'real_file_with_headers.ofx').read())
+        o = p.parse()
+        before = o.ofx_repr()
+        splitter = ofxplode.OFXSplitter(o, p.OFX_headers, 'month')
+        documents = list(splitter.iter_documents())
+        self.assertEqual(o.ofx_repr(), before)
+
+        self.assertEqual([ d[2][:8] for d in documents ], ['20100121', '20100201'] * 2)
+        self.assertEqual([ d[3][:8] for d in documents ], ['20100131', '20100228'] * 2)
+        total = 0
+        for msgset_name, account_id, dtstart, dtend, stmttrnrs in documents:
+            for t in stmttrnrs.find_children_by_name('STMTTRN'):
+                self.assertEqual(t.DTPOSTED.value[:6], dtend[:6])
+                total += 1
+        self.assertEqual(total, len(o.find_children_by_name('STMTTRN')))
+
+        out = open('output/split.ofx', 'w')
+        splitter.write_ofx(out, documents[0][0], documents[0][4])
+        out.close()
+        p = OFXParser(open('output/split.ofx').read())
+        p.parse()
+        self.assertEqual(p.OFX_headers, OFXParser(open(self.path+'real_file_with_headers.ofx').read()).parse_headers())
+
+        self.assertRaises(ValueError, ofxplode.OFXSplitter, o, None, 'week')
+
+    def test_03_invalid_xml_file(self):
+        '''
+        An OFX 2.x file with invalid XML is not split
+        '''
+        xml_file = os.path.join(self.output_dir, 'invalid.ofx')
+        f = open(xml_file, 'w')
+        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<?OFX OFXHEADER="200" VERSION="211"?>\n')
+        # &GIA; of a NAME is not an XML entity
+        OFXParser(open(self.path+'multi_account_file.ofx').read()).parse().write_xml(f)
+        f.close()
+
+        self.assertRaises(ValueError, ofxplode.main, xml_file, self.output_dir)
+        self.assertEqual(os.listdir(self.output_dir), ['invalid.ofx'])
+
+    def test_04_xml_source_gets_sgml_headers(self):
+        '''
+        Documents split from an OFX 2.x file have OFX 1.x headers in the encoding of the source
+        '''
+        source = OFXParser(open(self.path+'real_file_with_headers.ofx').read()).parse()
+        xml_file = os.path.join(self.output_dir, 'ofx2.xml')
+        f = open(xml_file, 'w')
+        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n'
+                '<?OFX OFXHEADER="200" VERSION="211" SECURITY="NONE" OLDFILEUID="NONE" NEWFILEUID="1234"?>\n')
+        source.write_xml(f)
+        f.close()
+
+        written = ofxplode.main(xml_file, self.output_dir)
+        self.assertTrue(written)
+        for name in written:
+            if name.endswith('.ofx'):
+                p = OFXParser(open(name).read())
+                o = p.parse()
+                self.assertEqual(p.OFX_headers, { 'OFXHEADER' : '100', 'DATA' : 'OFXSGML', 'VERSION' : '102', 'SECURITY' : 'NONE',
+                                                  'ENCODING' : 'USASCII', 'CHARSET' : 'ISO-8859-1', 'COMPRESSION' : 'NONE',
+                                                  'OLDFILEUID' : 'NONE', 'NEWFILEUID' : '1234' })
+                self.assertEqual(ofx_encoding(p.OFX_headers), 'iso8859-1')
+                self.assertEqual(o.SIGNONMSGSRSV1.ofx_repr(), source.SIGNONMSGSRSV1.ofx_repr())
+
+        self.assertEqual(ofxplode.sgml_headers({ 'OFXHEADER' : '200' })['ENCODING'], 'UTF-8')
+        self.assertEqual(ofxplode.sgml_headers({ 'OFXHEADER' : '200', 'encoding' : 'windows-1252' })['CHARSET'], '1252')
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+# coding: utf-8
+'''
+Transaction rewrite rules
+'''
+import unittest
+import sys
+import os
+
+from edofx import OFXParser, OFXIncrementalParser
+from edofx_rules import Rule, RuleSet
+
+
+SOURCE = '''<OFX>
+<BANKMSGSRSV1>
+<STMTTRNRS>
+<STMTRS>
+<BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>OTHER
+<TRNAMT>-12.50
+<NAME>BOULANGERIE DU COIN  12/03
+<MEMO>PAIEMENT PAR CARTE
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>OTHER
+<TRNAMT>-450.00
+<NAME>PRET IMMO 05/03/10
+<MEMO>REMBOURSEMENT DE PRET
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>OTHER
+<TRNAMT>1500.00
+<NAME>SALAIRE
+<MEMO>VIREMENT EN VOTRE FAVEUR
+</STMTTRN>
+</BANKTRANLIST>
+</STMTRS>
+</STMTTRNRS>
+</BANKMSGSRSV1>
+<CREDITCARDMSGSRSV1>
+<CCSTMTTRNRS>
+<CCSTMTRS>
+<BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>OTHER
+<TRNAMT>-20.00
+<NAME>LIBRAIRIE
+<MEMO>.
+</STMTTRN>
+</BANKTRANLIST>
+</CCSTMTRS>
+</CCSTMTTRNRS>
+</CREDITCARDMSGSRSV1>
+</OFX>
+'''
+
+
+class AcceptanceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.dirname(os.path.abspath(sys.modules[__name__].__file__))+'/'
+        self.rules = RuleSet.from_file(self.path+'../rules/credit_agricole.ini')
+
+    def transactions(self, OFX):
+        return [ (t.TRNTYPE.value, t.NAME.value, t.MEMO.value) for t in OFX.find_children_by_name('STMTTRN') ]
+
+    def test_01_credit_agricole_rules(self):
+        '''
+        Credit Agricole rules rewrite bank transactions while the tree is built
+        '''
+        expected = [ ('PAIEMENT PAR CARTE', 'BOULANGERIE DU COIN', 'Operation du 12/03'),
+                     ('REMBOURSEMENT DE PRET', 'PRET IMMO', 'Echeance du 05/03/10 '),
+                     ('VIREMENT EN VOTRE FAVEUR', 'SALAIRE', ''),
+                     ('OTHER', 'LIBRAIRIE', '.') ]
+
+        OFX = OFXParser(SOURCE, handlers=self.rules.handlers()).parse()
+        self.assertEqual(self.transactions(OFX), expected)
+
+        parser = OFXIncrementalParser(discard=('CREDITCARDMSGSRSV1',), handlers=self.rules.handlers())
+        for i in range(0, len(SOURCE), 7):
+            parser.feed(SOURCE[i:i+7])
+        self.assertEqual(self.transactions(parser.close()), expected[:3])
+
+    def test_02_stages_and_missing_fields(self):
+        '''
+        A rule sees TRNTYPE set by a previous rule, missing fields are created
+        '''
+        rules = RuleSet([ Rule('debit', when={'TRNTYPE' : 'OTHER'}, match={'TRNAMT' : '^-'}, set={'TRNTYPE' : 'DEBIT'}),
+                          Rule('tag', when={'TRNTYPE' : 'DEBIT'}, set={'CHECKNUM' : '{TRNTYPE}-{NAME}'}),
+                          Rule('any', set={'SIC' : '0'}) ])
+        OFX = OFXParser(SOURCE, handlers=rules.handlers()).parse()
+        trns = OFX.find_children_by_name('STMTTRN')
+        self.assertEqual([ t.TRNTYPE.value for t in trns ], ['DEBIT', 'DEBIT', 'OTHER', 'DEBIT'])
+        self.assertEqual(trns[3].CHECKNUM.value, 'DEBIT-LIBRAIRIE')
+        self.assertRaises(AttributeError, getattr, trns[2], 'CHECKNUM')
+        self.assertEqual([ t.SIC.value for t in trns ], ['0'] * 4)
+
+    def test_03_invalid_rules(self):
+        '''
+        Invalid rules are reported when compiled or applied
+        '''
+        self.assertRaises(ValueError, Rule, 'bad', match={'NAME' : '('})
+        self.assertRaises(IOError, RuleSet.from_file, self.path+'missing.ini')
+        self.assertRaises(ValueError, Rule, 'bad', set={'MEMO' : '{unknown}'})
+        self.assertRaises(ValueError, Rule, 'bad', set={'MEMO' : '{0}'})
+        self.assertRaises(ValueError, Rule, 'bad', set={'MEMO' : '{NAME'})
+        Rule('good', match={'NAME' : '(?P<unknown>.*)'}, set={'MEMO' : '{unknown}'})
+
+    def test_04_missing_fields_in_templates(self):
+        '''
+        Optional fields missing from a transaction are '' in templates
+        '''
+        source = '<OFX><BANKMSGSRSV1><STMTTRN><TRNTYPE>DEBIT<NAME>X</STMTTRN></BANKMSGSRSV1></OFX>'
+        OFX = OFXParser(source, handlers=self.rules.handlers()).parse()
+        self.assertEqual(self.transactions(OFX), [ ('', 'X', '') ])
+
+
+if __name__=="__main__":
+    unittest.main()
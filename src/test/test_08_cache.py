@@ -0,0 +1,103 @@
+# coding: utf-8
+'''
+On disk cache of parsed trees
+'''
+import unittest
+import shutil
+import sys
+import os
+import tempfile
+
+import edofx
+from edofx import OFXParser
+from edofx_cache import OFXCache, tree_to_snapshot, snapshot_to_tree
+
+
+class AcceptanceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.dirname(os.path.abspath(sys.modules[__name__].__file__))+'/fixtures/'
+        self.cache_dir = tempfile.mkdtemp(prefix='edofx_cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_01_cached_tree_is_the_parsed_tree(self):
+        '''
+        Second parse of a file comes from the cache and gives the same headers and tree
+        '''
+        cache = OFXCache(self.cache_dir)
+        parser = OFXParser(open(self.path+'real_file_with_headers.ofx').read())
+        OFX = parser.parse()
+
+        headers, tree = cache.parse_file(self.path+'real_file_with_headers.ofx')
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        headers, tree = cache.parse_file(self.path+'real_file_with_headers.ofx')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(headers, parser.OFX_headers)
+        self.assertEqual(tree.ofx_repr(), OFX.ofx_repr())
+        self.assertEqual(tree.BANKMSGSRSV1.STMTTRNRS.STMTRS.BANKTRANLIST.DTSTART.val,
+                         OFX.BANKMSGSRSV1.STMTTRNRS.STMTRS.BANKTRANLIST.DTSTART.val)
+
+        xml_file = os.path.join(self.cache_dir, 'ofx2.xml')
+        f = open(xml_file, 'w')
+        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<?OFX OFXHEADER="200" VERSION="211"?>\n')
+        OFX.write_xml(f)
+        f.close()
+        headers, tree = cache.parse_file(xml_file)
+        self.assertEqual(headers['VERSION'], '211')
+        self.assertEqual(tree.ofx_repr(), OFX.ofx_repr())
+
+        deep = OFXParser('<A>' * 3000 + '<B>1' + '</A>' * 3000).parse()
+        self.assertEqual(snapshot_to_tree(*tree_to_snapshot(deep)).ofx_repr(), deep.ofx_repr())
+
+    def test_02_invalidation_and_eviction(self):
+        '''
+        Snapshots of another version or invalid ones are not used, least recently used ones are evicted
+        '''
+        source = open(self.path+'multi_account_file.ofx').read()
+        cache = OFXCache(self.cache_dir)
+        cache.parse(source)
+        snapshot = os.path.join(self.cache_dir, cache.key(source) + OFXCache.SUFFIX)
+        self.assertTrue(os.path.exists(snapshot))
+
+        self.assertEqual(cache.key(source), OFXCache(self.cache_dir, version=edofx.PARSER_VERSION).key(source))
+        other_version = OFXCache(self.cache_dir, version=edofx.PARSER_VERSION + 1)
+        self.assertNotEqual(other_version.key(source), cache.key(source))
+        self.assertEqual(other_version.load(cache.key(source)), None)
+        self.assertFalse(os.path.exists(snapshot))
+
+        cache.parse(source)
+        open(snapshot, 'wb').write('garbage')
+        headers, tree = cache.parse(source)
+        self.assertEqual(cache.misses, 3)
+        self.assertEqual(tree.ofx_repr(), OFXParser(source).parse().ofx_repr())
+
+        size = os.path.getsize(snapshot)
+        cache.max_size = 2 * size
+        os.utime(snapshot, (1, 1))
+        for i in range(2):
+            cache.parse(source + '\n' * (i+1))
+        self.assertFalse(os.path.exists(snapshot))
+        self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+
+    def test_03_invalid_xml_is_not_stored(self):
+        '''
+        An OFX 2.x file with invalid XML raises and leaves no snapshot
+        '''
+        xml_file = os.path.join(self.cache_dir, 'invalid.ofx')
+        f = open(xml_file, 'w')
+        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<?OFX OFXHEADER="200" VERSION="211"?>\n')
+        # &GIA; of a NAME is not an XML entity
+        OFXParser(open(self.path+'multi_account_file.ofx').read()).parse().write_xml(f)
+        f.close()
+
+        cache = OFXCache(self.cache_dir)
+        self.assertRaises(ValueError, cache.parse_file, xml_file)
+        self.assertRaises(ValueError, cache.parse_file, xml_file)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertEqual(os.listdir(self.cache_dir), ['invalid.ofx'])
+
+
+if __name__=="__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+# coding: utf-8
+'''
+Selectors of OFXNode trees
+'''
+import unittest
+import sys
+import os
+
+from edofx import OFXParser, OFXIncrementalParser, OFXPath, compile_path
+
+
+class AcceptanceTests(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.dirname(os.path.abspath(sys.modules[__name__].__file__))+'/fixtures/'
+        self.source = open(self.path+'real_file_with_headers.ofx').read()
+        self.OFX = OFXParser(self.source).parse()
+
+    def test_01_select(self):
+        '''
+        Wildcards, descendants and predicates select the nodes of DSL chains
+        '''
+        OFX = self.OFX
+        transactions = OFX.find_children_by_name('STMTTRN')
+        debits = [ t for t in transactions if t.TRNAMT.val < 0 ]
+
+        self.assertEqual(list(OFX.select('OFX/*MSGSRSV1/*STMTTRNRS/*/BANKTRANLIST/STMTTRN[TRNAMT<0]')), debits)
+        self.assertEqual(list(OFX.select('//STMTTRN')), transactions)
+        self.assertEqual(list(OFX.select('OFX//BANKTRANLIST//STMTTRN[TRNAMT>=0][NAME]')), [ t for t in transactions if t.TRNAMT.val >= 0 ])
+        self.assertEqual(list(OFX.select('//STMTTRN[DTPOSTED>=201002][DTPOSTED<20100215]')),
+                         [ t for t in transactions if '20100201' <= t.DTPOSTED.value[:8] < '20100215' ])
+        self.assertEqual(list(OFX.select('//STMTTRN[NAME="%s"]' % transactions[3].NAME.value)), [ transactions[3] ])
+        self.assertEqual(list(OFX.select('OFX/SIGNONMSGSRSV1/SONRS[STATUS/CODE=0]/LANGUAGE')), [ OFX.SIGNONMSGSRSV1.SONRS.LANGUAGE ])
+        self.assertEqual(list(OFX.select('//STMTTRN[TRNAMT=abc]')), [])
+        self.assertEqual(list(OFX.select('BANKMSGSRSV1')), [])
+        self.assertEqual(OFX.select('//STMTTRN/TRNAMT').next().parent, transactions[0])
+
+        path = compile_path('//STMTTRN[CHECKNUM]')
+        self.assertTrue(path is compile_path('//STMTTRN[CHECKNUM]'))
+        self.assertEqual(path.first(OFX), None)
+        self.assertEqual(OFXPath('//*AMT').first(OFX), transactions[0].TRNAMT)
+
+        nested = OFXParser('<A><A><A><B>1</A><B>2</A><B>3</A>').parse()
+        self.assertEqual([ n.value for n in nested.select('//A//B') ], ['1', '2', '3'])
+        self.assertEqual([ n.value for n in nested.select('//A/B') ], ['1', '2', '3'])
+        nested = OFXParser('<R><A><B>1<A><B>2</A><B>3</A></R>').parse()
+        self.assertEqual([ n.value for n in nested.select('//A/B') ], ['1', '2', '3'])
+        self.assertEqual([ n.value for n in nested.select('R//A/B') ], ['1', '2', '3'])
+        self.assertEqual([ (n.parent.name, n.value) for n in nested.select('//B') ], [('A', '1'), ('A', '2'), ('A', '3')])
+        self.assertEqual([ n.parent.name for n in nested.select('R//A') ], ['R', 'A'])
+
+        for path in ('', 'OFX//', 'OFX/[A]', 'OFX/A[B=<1]', 'OFX A'):
+            self.assertRaises(ValueError, OFXPath, path)
+
+    def test_02_streaming(self):
+        '''
+        Selectors match nodes of parser handlers
+        '''
+        path = OFXPath('OFX/*MSGSRSV1/*STMTTRNRS/*/BANKTRANLIST/STMTTRN[TRNAMT<0]')
+        expected = [ t.FITID.value for t in self.OFX.select(path) ]
+        found = []
+        parser = OFXIncrementalParser(discard=('STMTTRN',), handlers=path.handlers(lambda node, ancestors: found.append(node.FITID.value)))
+        for i in range(0, len(self.source), 50):
+            parser.feed(self.source[i:i+50])
+        parser.close()
+        self.assertEqual(found, expected)
+
+        self.assertTrue(OFXPath('//STMTRS/*').matches(self.OFX.BANKMSGSRSV1.STMTTRNRS.STMTRS.BANKTRANLIST,
+                                                      [ self.OFX, self.OFX.BANKMSGSRSV1, self.OFX.BANKMSGSRSV1.STMTTRNRS, self.OFX.BANKMSGSRSV1.STMTTRNRS.STMTRS ]))
+        self.assertFalse(OFXPath('OFX/BANKMSGSRSV1/STMTRS').matches(self.OFX.BANKMSGSRSV1.STMTTRNRS.STMTRS,
+                                                                 [ self.OFX, self.OFX.BANKMSGSRSV1, self.OFX.BANKMSGSRSV1.STMTTRNRS ]))
+        self.assertRaises(ValueError, OFXPath('//*').handlers, None)
+
+
+if __name__=="__main__":
+    unittest.main()